@@ -9,6 +9,8 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from typing import Any
 
+from ..rawjson import RawJSON
+
 
 @dataclass
 class AdapterContext:
@@ -18,8 +20,8 @@ class AdapterContext:
     包含原始请求的所有信息,供适配器进行检测和转换
     """
 
-    raw_body: dict[str, Any]
-    """原始请求体"""
+    raw_body: dict[str, Any] | RawJSON
+    """原始请求体 (选中透传适配器时为未解析的 RawJSON)"""
 
     raw_headers: dict[str, str]
     """原始请求头 (小写 key)"""
@@ -42,7 +44,7 @@ class TransformResult:
     - 元数据 (用于日志记录)
     """
 
-    body: dict[str, Any]
+    body: dict[str, Any] | RawJSON
     """转换后的请求体"""
 
     extra_headers: dict[str, str] = field(default_factory=dict)
@@ -51,6 +53,9 @@ class TransformResult:
     metadata: dict[str, Any] = field(default_factory=dict)
     """元数据 (用于日志记录,如 adapter 名称、客户端版本等)"""
 
+    priority: int = 0
+    """调度优先级 (由 AdapterManager 填入选中适配器的 priority, 上游排队时高优先级先放行)"""
+
 
 class ClientAdapter(ABC):
     """
@@ -78,6 +83,14 @@ class ClientAdapter(ABC):
     version: str = "1.0.0"
     """适配器版本"""
 
+    passthrough: bool = False
+    """
+    是否原样透传请求体 (transform 不修改请求体, 且 detect 只读取请求头)
+
+    为 True 时服务可跳过请求体的完整解析和校验, ctx.raw_body 为 RawJSON,
+    转换结果的 body 原样返回即可, 上游收到的是客户端发来的原始字节
+    """
+
     @abstractmethod
     def detect(self, ctx: AdapterContext) -> bool:
         """
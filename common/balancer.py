@@ -0,0 +1,210 @@
+"""
+上游负载均衡
+
+一组等价的上游端点 (如多个中转节点) 组成 UpstreamGroup,
+每个请求通过 power-of-two-choices 选择端点: 随机取两个候选, 选择
+"EWMA 首字节耗时 × (在途请求数 + 1)" 较小者。长时间未获得流量的端点
+由后台任务定期探测, 使恢复正常的慢端点能重新获得流量
+"""
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from typing import Any
+
+from .circuit_breaker import CircuitBreaker
+from .config import settings
+from .errors import CircuitOpenError
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Endpoint:
+    """上游端点及其实时负载状态"""
+
+    def __init__(self, base_url: str, group: str) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.breaker = CircuitBreaker(f"{group}:{self.base_url}")
+        self.ewma_ttfb: float | None = None  # 首字节耗时 EWMA (秒), None 表示尚无样本
+        self.outstanding = 0  # 在途请求数 (流式请求直到流关闭)
+        self.requests = 0
+        self.failures = 0
+        self.last_used = 0.0
+        self.last_probe_ms: float | None = None
+
+    def url(self, path: str) -> str:
+        """拼接完整请求 URL"""
+        return f"{self.base_url}{path}"
+
+    def cost(self) -> float:
+        """预估代价: 无样本的端点代价为 0, 以便尽快获得首个样本"""
+        if self.ewma_ttfb is None:
+            return 0.0
+        return self.ewma_ttfb * (self.outstanding + 1)
+
+    def observe(self, seconds: float) -> None:
+        """记录一次首字节耗时样本"""
+        if self.ewma_ttfb is None:
+            self.ewma_ttfb = seconds
+        else:
+            alpha = settings.lb_ewma_alpha
+            self.ewma_ttfb = (1 - alpha) * self.ewma_ttfb + alpha * seconds
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "ewma_ttfb_ms": round(self.ewma_ttfb * 1000, 2) if self.ewma_ttfb is not None else None,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "last_probe_ms": self.last_probe_ms,
+            "breaker": self.breaker.to_dict(),
+        }
+
+
+class UpstreamGroup:
+    """一组等价上游端点"""
+
+    def __init__(self, name: str, base_urls: Iterable[str]) -> None:
+        self.name = name
+        self.endpoints = [Endpoint(url, name) for url in base_urls]
+        if not self.endpoints:
+            raise ValueError(f"Upstream group '{name}' has no endpoints")
+        self._probe_task: asyncio.Task[None] | None = None
+        _registry[name] = self
+
+    @property
+    def base_urls(self) -> list[str]:
+        return [endpoint.base_url for endpoint in self.endpoints]
+
+    def pick(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """
+        选择端点 (power-of-two-choices)
+
+        熔断中的端点不参与选择
+
+        Args:
+            exclude: 需要排除的端点 (如本次请求已失败的端点); 全部被排除时忽略该条件
+
+        Returns:
+            选中的端点
+
+        Raises:
+            CircuitOpenError: 所有端点均处于熔断状态
+        """
+        available = self.check_available()
+        excluded = set(map(id, exclude))
+        candidates = [e for e in available if id(e) not in excluded] or available
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first, second = random.sample(candidates, 2)
+        return first if first.cost() <= second.cost() else second
+
+    def check_available(self) -> list[Endpoint]:
+        """
+        返回未熔断的端点
+
+        Raises:
+            CircuitOpenError: 所有端点均处于熔断状态 (携带最短的剩余熔断时间)
+        """
+        available = [e for e in self.endpoints if e.breaker.available()]
+        if not available:
+            retry_after = min(e.breaker.retry_after() for e in self.endpoints)
+            raise CircuitOpenError(self.name, retry_after=retry_after)
+        return available
+
+    def begin(self, endpoint: Endpoint) -> None:
+        """请求开始"""
+        endpoint.outstanding += 1
+        endpoint.requests += 1
+        endpoint.last_used = time.monotonic()
+
+    def end(self, endpoint: Endpoint, ttfb: float | None, ok: bool) -> None:
+        """
+        请求结束
+
+        Args:
+            endpoint: 端点
+            ttfb: 首字节耗时 (秒), 未收到响应时为 None
+            ok: 是否成功; 失败时按 lb_failure_penalty 计入 EWMA, 使端点暂时降权
+        """
+        endpoint.outstanding = max(0, endpoint.outstanding - 1)
+        if not ok:
+            endpoint.failures += 1
+            endpoint.observe(settings.lb_failure_penalty)
+        elif ttfb is not None:
+            endpoint.observe(ttfb)
+
+    def start_probing(self, probe: Callable[[str], Awaitable[float]]) -> None:
+        """
+        启动后台探测任务
+
+        Args:
+            probe: 探测函数, 接收 base_url, 返回耗时 (秒), 失败时抛出异常
+        """
+        if len(self.endpoints) < 2 or self._probe_task is not None:
+            return
+        self._probe_task = asyncio.create_task(self._probe_loop(probe))
+        logger.info("upstream_probing_started", upstream=self.name, endpoints=len(self.endpoints))
+
+    def stop_probing(self) -> None:
+        """停止后台探测任务"""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+
+    async def _probe_loop(self, probe: Callable[[str], Awaitable[float]]) -> None:
+        """探测长时间没有流量的端点"""
+        while True:
+            await asyncio.sleep(settings.lb_probe_interval)
+            now = time.monotonic()
+            for endpoint in self.endpoints:
+                if now - endpoint.last_used < settings.lb_probe_idle_after:
+                    continue
+                await self._probe(endpoint, probe)
+
+    async def _probe(self, endpoint: Endpoint, probe: Callable[[str], Awaitable[float]]) -> None:
+        """
+        探测单个端点
+
+        探测请求只反映网络/中转延迟 (不含模型推理时间), 因此探测成功时不直接写入
+        EWMA, 而是将其向当前最优端点的 EWMA 回归; 探测失败时按失败惩罚计入
+        """
+        try:
+            seconds = await probe(endpoint.base_url)
+        except Exception as e:
+            endpoint.failures += 1
+            endpoint.observe(settings.lb_failure_penalty)
+            logger.warning(
+                "upstream_probe_failed",
+                upstream=self.name,
+                base_url=endpoint.base_url,
+                error=str(e),
+            )
+            return
+
+        endpoint.last_probe_ms = round(seconds * 1000, 2)
+        samples = [e.ewma_ttfb for e in self.endpoints if e.ewma_ttfb is not None]
+        if endpoint.ewma_ttfb is not None and samples:
+            endpoint.observe(min(samples))
+        logger.debug(
+            "upstream_probe_complete",
+            upstream=self.name,
+            base_url=endpoint.base_url,
+            probe_ms=endpoint.last_probe_ms,
+        )
+
+    def stats(self) -> list[dict[str, Any]]:
+        """端点状态列表"""
+        return [endpoint.to_dict() for endpoint in self.endpoints]
+
+
+# 已创建的上游组 (供 /stats 端点展示)
+_registry: dict[str, UpstreamGroup] = {}
+
+
+def get_upstream_groups() -> dict[str, UpstreamGroup]:
+    """获取所有已创建的上游组"""
+    return _registry
@@ -0,0 +1,161 @@
+"""
+上游熔断器
+
+按上游端点统计最近 breaker_window 秒内的错误率和慢调用率:
+- closed: 正常放行; 样本数达到 breaker_min_requests 且错误率或慢调用率超过阈值时熔断
+- open: 直接拒绝 (503 + retry-after), 不再占用连接池和客户端连接;
+  breaker_open_seconds 后进入 half-open
+- half-open: 最多放行 breaker_half_open_probes 个探测请求, 全部成功则恢复,
+  任一失败则重新熔断
+"""
+import time
+from collections import deque
+from enum import StrEnum
+from typing import Any
+
+from .config import settings
+from .logger import get_logger
+from .metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class CircuitState(StrEnum):
+    """熔断器状态"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个上游端点的熔断器 (仅在事件循环内使用, 无需加锁)"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CircuitState.CLOSED
+        self._window: deque[tuple[float, bool, bool]] = deque()  # (时间, 失败, 慢调用)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+
+    def available(self) -> bool:
+        """是否可以放行请求 (无副作用, 用于端点选择)"""
+        if not settings.breaker_enabled or self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.OPEN:
+            return self.retry_after() <= 0
+        return self._probes_in_flight < settings.breaker_half_open_probes
+
+    def acquire(self) -> bool:
+        """
+        申请放行一个请求
+
+        Returns:
+            是否放行; half-open 状态下放行的请求为探测请求
+        """
+        if not settings.breaker_enabled:
+            return True
+        if self.state == CircuitState.OPEN and self.retry_after() <= 0:
+            self._transition(CircuitState.HALF_OPEN)
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.HALF_OPEN and (
+            self._probes_in_flight < settings.breaker_half_open_probes
+        ):
+            self._probes_in_flight += 1
+            return True
+        metrics.inc("breaker_rejected", breaker=self.name)
+        return False
+
+    def release(self) -> None:
+        """请求被取消 (不计入统计) 时释放探测名额"""
+        if self.state == CircuitState.HALF_OPEN and self._probes_in_flight > 0:
+            self._probes_in_flight -= 1
+
+    def record(self, failed: bool, latency: float | None = None) -> None:
+        """
+        记录请求结果
+
+        Args:
+            failed: 是否失败 (网络错误或上游 5xx)
+            latency: 首字节耗时 (秒), 用于慢调用统计; None 表示不参与慢调用统计
+        """
+        if not settings.breaker_enabled:
+            return
+
+        slow_threshold = settings.breaker_slow_call_seconds
+        slow = slow_threshold > 0 and latency is not None and latency > slow_threshold
+
+        if self.state == CircuitState.HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if failed or slow:
+                self._transition(CircuitState.OPEN)
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= settings.breaker_half_open_probes:
+                self._transition(CircuitState.CLOSED)
+            return
+
+        if self.state == CircuitState.OPEN:
+            return
+
+        now = time.monotonic()
+        self._window.append((now, failed, slow))
+        self._prune(now)
+
+        total = len(self._window)
+        if total < settings.breaker_min_requests:
+            return
+        failures = sum(1 for _, f, _ in self._window if f)
+        slow_calls = sum(1 for _, _, s in self._window if s)
+        if (
+            failures / total >= settings.breaker_error_rate
+            or slow_calls / total >= settings.breaker_slow_call_rate
+        ):
+            logger.warning(
+                "circuit_breaker_tripped",
+                breaker=self.name,
+                requests=total,
+                failures=failures,
+                slow_calls=slow_calls,
+            )
+            self._transition(CircuitState.OPEN)
+
+    def retry_after(self) -> float:
+        """熔断剩余时间 (秒), 非 open 状态返回 0"""
+        if self.state != CircuitState.OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + settings.breaker_open_seconds - time.monotonic())
+
+    def _prune(self, now: float) -> None:
+        cutoff = now - settings.breaker_window
+        while self._window and self._window[0][0] < cutoff:
+            self._window.popleft()
+
+    def _transition(self, state: CircuitState) -> None:
+        previous = self.state
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == CircuitState.OPEN:
+            self._opened_at = time.monotonic()
+        if state == CircuitState.CLOSED:
+            self._window.clear()
+
+        metrics.inc("breaker_transitions", breaker=self.name, state=state.value)
+        logger.info(
+            "circuit_breaker_state_changed",
+            breaker=self.name,
+            previous=previous.value,
+            state=state.value,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        self._prune(time.monotonic())
+        return {
+            "state": self.state.value,
+            "window_requests": len(self._window),
+            "window_failures": sum(1 for _, f, _ in self._window if f),
+            "retry_after": round(self.retry_after(), 2),
+        }
@@ -0,0 +1,132 @@
+"""
+相同请求合并 (single-flight)
+
+评测脚本、探活类提示词等场景会在短时间内发出大量逐字节相同的请求, 各自打到上游。
+启用 coalesce_enabled 后, 转换后请求体 (规范化 JSON) 和目标上游都相同的并发请求
+共享同一个上游调用:
+- 非流式请求等待同一个上游响应
+- 流式请求共享同一个上游 SSE 流, 后加入的客户端先收到已转发的事件, 再跟随实时事件;
+  每个客户端按自己的进度读取, 慢客户端不影响其他客户端
+- 只合并进行中的请求, 上游响应结束后到达的请求重新执行
+- 只在使用相同上游凭据的调用方之间合并 (同一个租户 Key 池, 或同一个调用方 Key)
+
+temperature 高于 coalesce_max_temperature (默认 0) 的采样请求不合并: 调用方期望
+各自得到不同的采样结果。未设置 temperature 的请求按上游默认值 1.0 处理
+"""
+import hashlib
+from collections.abc import Awaitable, Callable, Mapping
+from threading import Lock
+from typing import Any, ClassVar
+
+from fastapi.responses import Response
+
+from .codec import dumps
+from .config import settings
+from .fanout import SharedResponse
+from .key_pool import KeyPools
+from .logger import get_logger
+from .metrics import metrics
+from .pacing import key_fingerprint
+from .rawjson import RawJSON
+from .spool import fingerprint
+
+logger = get_logger(__name__)
+
+# Anthropic / OpenAI 未设置 temperature 时的默认值
+_DEFAULT_TEMPERATURE = 1.0
+
+# 所有客户端断开后上游请求的保留时长 (秒): 仅覆盖响应头返回到客户端开始读取之间的间隙
+_ORPHAN_GRACE = 1.0
+
+
+class Coalescer:
+    """相同请求合并器 (单例, 仅在事件循环内使用)"""
+
+    _instance: ClassVar["Coalescer | None"] = None
+    _lock: ClassVar[Lock] = Lock()
+    _inflight: dict[str, SharedResponse]
+
+    def __new__(cls) -> "Coalescer":
+        # 双重检查锁定
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._inflight = {}
+        return cls._instance
+
+    async def handle(
+        self,
+        body: Mapping[str, Any],
+        *,
+        upstream: str,
+        api_key: str,
+        key_pools: KeyPools,
+        call: Callable[[], Awaitable[Response | Any]],
+    ) -> Response | Any:
+        """
+        执行请求 (相同的并发请求合并为一个上游调用)
+
+        Args:
+            body: 转换后的请求体 (RawJSON 按原始字节比较)
+            upstream: 目标上游名
+            api_key: 调用方 API Key
+            key_pools: 目标上游的租户 Key 池
+            call: 实际执行请求, 返回 Response 或可 JSON 序列化的响应体
+
+        Returns:
+            未合并时为 call 的返回值, 否则为 Response
+        """
+        if not settings.coalesce_enabled or not _coalescible(body):
+            return await call()
+
+        key_pool = key_pools.for_client(api_key)
+        credentials = f"pool:{key_pool.tenant}" if key_pool else key_fingerprint(api_key)
+        if isinstance(body, RawJSON):
+            canonical = body.data
+        else:
+            # 落盘请求体中的大字符串按请求体摘要 + 位置比较, 不读取内容
+            canonical = dumps(body, sort_keys=True, default=fingerprint)
+        key = hashlib.sha256(f"{upstream}\n{credentials}\n".encode() + canonical).hexdigest()
+
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = self._inflight[key] = SharedResponse(
+                call,
+                orphan_grace=_ORPHAN_GRACE,
+                on_done=lambda done: self._finish(key, done),
+                name="coalescing",
+            )
+            metrics.inc("coalesce", upstream=upstream, result="leader")
+        else:
+            metrics.inc("coalesce", upstream=upstream, result="follower")
+            logger.info(
+                "request_coalesced",
+                upstream=upstream,
+                model=body.get("model"),
+                subscribers=shared.subscribers + 1,
+            )
+        return await shared.response()
+
+    def _finish(self, key: str, shared: SharedResponse) -> None:
+        if self._inflight.get(key) is shared:
+            del self._inflight[key]
+
+    def stats(self) -> dict[str, int]:
+        """进行中的合并请求数和读取中的客户端数"""
+        return {
+            "inflight": len(self._inflight),
+            "subscribers": sum(shared.subscribers for shared in self._inflight.values()),
+        }
+
+
+def _coalescible(body: Mapping[str, Any]) -> bool:
+    """确定性请求才合并 (temperature 不高于 coalesce_max_temperature)"""
+    temperature = body.get("temperature")
+    if not isinstance(temperature, int | float):
+        temperature = _DEFAULT_TEMPERATURE
+    return temperature <= settings.coalesce_max_temperature
+
+
+# 全局合并器实例
+coalescer = Coalescer()
@@ -0,0 +1,201 @@
+"""
+JSON 编解码
+
+请求体解析、上游请求体编码、非流式响应解析和返回给客户端的响应都经过这里。安装 orjson
+(可选依赖) 时使用 orjson, 1MB 级别的对话历史编解码的 CPU 开销只有标准库的几分之一
+(见 scripts/bench_json.py); 未安装时使用标准库 json:
+- 输出始终为紧凑格式 (无空格) 的 UTF-8 bytes, 不转义非 ASCII 字符, 可直接传给 httpx 的 content=
+- orjson 不支持的值 (超过 64 位的整数、非字符串键) 以及 orjson 拒绝的输入
+  (NaN / Infinity 字面量) 退回标准库处理, 行为与原先一致
+- 注意 orjson 把超过 64 位的整数解析为浮点数
+
+注入上游请求的静态内容 (Claude Code system prompt、Codex instructions 和默认工具) 在启动时
+通过 prepare 编码一次, 编码请求体时 (dumps_body / upload.iter_json) 按对象 identity
+识别并直接拼接预先编码的结果, 每个请求的编码开销只与客户端发送的内容有关:
+- 登记的值转换为只读结构 (修改时抛出 TypeError, 复制得到普通 dict / list),
+  所有请求共享同一个对象, 拼接时无需检查是否被修改
+- 使用 orjson 时 dumps_body 不拼接: orjson 一次编码整个请求体比逐字段拼接更快
+"""
+import copy
+import json
+from collections.abc import Callable
+from typing import Any, TypeVar
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+# 当前使用的实现 (orjson / json)
+backend = "orjson" if orjson is not None else "json"
+
+_T = TypeVar("_T")
+
+# 预先编码的静态值: id -> (值, 编码结果); 同时持有值的引用, 保证 id 不被复用
+_prepared: dict[int, tuple[Any, bytes]] = {}
+
+
+def _readonly(self: Any, *args: Any, **kwargs: Any) -> Any:
+    raise TypeError(f"{type(self).__name__} is read-only, copy it before modifying")
+
+
+class FrozenDict(dict[Any, Any]):
+    """prepare 登记的只读 dict (仍是 dict, 序列化和 isinstance 检查不受影响)"""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self) -> dict[Any, Any]:
+        return dict(self)
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> dict[Any, Any]:
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+
+class FrozenList(list[Any]):
+    """prepare 登记的只读 list"""
+
+    __slots__ = ()
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = clear = extend = insert = pop = remove = reverse = sort = _readonly
+
+    def __copy__(self) -> list[Any]:
+        return list(self)
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> list[Any]:
+        return [copy.deepcopy(item, memo) for item in self]
+
+
+def freeze(value: Any) -> Any:
+    """递归转换为只读结构 (dict -> FrozenDict, list -> FrozenList, 其他值原样返回)"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def _stdlib_dumps(value: Any, sort_keys: bool, default: Callable[[Any], Any] | None) -> bytes:
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        allow_nan=False,
+        sort_keys=sort_keys,
+        default=default,
+    ).encode()
+
+
+def dumps(
+    value: Any, *, sort_keys: bool = False, default: Callable[[Any], Any] | None = None
+) -> bytes:
+    """
+    序列化为紧凑的 UTF-8 JSON
+
+    Args:
+        value: 可 JSON 序列化的值
+        sort_keys: 是否按键排序 (用于生成规范化的比较键)
+        default: 不支持的类型的转换函数 (同 json.dumps, 如落盘请求体中的 spool.Blob)
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                value, default=default, option=orjson.OPT_SORT_KEYS if sort_keys else 0
+            )
+        except TypeError:
+            pass
+    return _stdlib_dumps(value, sort_keys, default)
+
+
+def loads(data: bytes | str) -> Any:
+    """
+    解析 JSON
+
+    Raises:
+        json.JSONDecodeError: 不是有效的 JSON
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def prepare(value: _T) -> _T:
+    """
+    预先编码运行期间不变的值, 返回只读的副本 (见 freeze; str 等不可变值返回其本身)
+
+    请求体中出现返回的对象时直接拼接预先编码的结果。列表同时登记每个元素
+    (请求体中的列表常由静态元素和客户端内容拼接而成, 如默认工具 + 客户端工具)
+    """
+    frozen = freeze(value)
+    _register(frozen)
+    if isinstance(frozen, list):
+        for item in frozen:
+            _register(item)
+    return frozen  # type: ignore[no-any-return]
+
+
+def _register(value: Any) -> None:
+    _prepared[id(value)] = (value, dumps(value))
+
+
+def prepared() -> list[tuple[Any, bytes]]:
+    """已登记的静态值及其编码结果"""
+    return list(_prepared.values())
+
+
+def encoded(value: Any, *, default: Callable[[Any], Any] | None = None) -> bytes:
+    """编码单个值 (静态值直接返回预先编码的结果)"""
+    entry = _prepared.get(id(value))
+    if entry is None:
+        return dumps(value, default=default)
+    return entry[1]
+
+
+def dumps_body(body: Any, *, default: Callable[[Any], Any] | None = None) -> bytes:
+    """
+    编码上游请求体 (结果与 dumps 逐字节一致)
+
+    顶层字段值和列表字段的元素为静态值时拼接预先编码的结果, 其余内容整体编码;
+    使用 orjson 时直接整体编码
+    """
+    if orjson is not None or not _prepared or not isinstance(body, dict):
+        return dumps(body, default=default)
+
+    fields = []
+    for key, value in body.items():
+        if isinstance(value, list) and id(value) not in _prepared:
+            if any(id(item) in _prepared for item in value):
+                data = b"[" + b",".join(encoded(item, default=default) for item in value) + b"]"
+            else:
+                data = dumps(value, default=default)
+        else:
+            data = encoded(value, default=default)
+        fields.append(dumps(key) + b":" + data)
+    return b"{" + b",".join(fields) + b"}"
+
+
+def with_content(kwargs: dict[str, Any], content: Any) -> dict[str, Any]:
+    """以 content= 替换 json= 请求体, 并设置 JSON 的 Content-Type (去掉原有的 Content-Length)"""
+    result = {key: value for key, value in kwargs.items() if key != "json"}
+    headers = {
+        name: value
+        for name, value in (kwargs.get("headers") or {}).items()
+        if name.lower() not in ("content-type", "content-length")
+    }
+    headers["content-type"] = "application/json"
+    result["headers"] = headers
+    result["content"] = content
+    return result
+
+
+class CompactJSONResponse(JSONResponse):
+    """使用 codec.dumps 序列化的 JSONResponse (紧凑格式; 直接返回时不经过 jsonable_encoder)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,189 @@
+"""
+上游请求体压缩
+
+Claude Code / Codex 请求常带 200KB-2MB 的历史消息、工具定义和 instructions, 跨地域上传
+占首字节耗时的相当一部分。对配置了压缩的上游 (http_request_compression), JSON 请求体
+超过 http_compression_min_bytes 时以 gzip / zstd 压缩并设置 Content-Encoding:
+- 压缩在线程池中执行, 不阻塞事件循环; 同一请求的重试 / 对冲复用同一份压缩结果
+- 并非所有中转都接受压缩请求体: 压缩请求返回 415 (或尚未确认支持时返回 400),
+  且以未压缩请求体重发成功时, 记录该上游不支持该编码,
+  http_compression_unsupported_ttl 秒内不再压缩; 压缩请求成功时记录为已支持
+- zstd 需要安装 zstandard (可选依赖), 未安装时退回 gzip
+"""
+import asyncio
+import gzip
+import time
+from threading import Lock
+from typing import Any, ClassVar
+
+from .codec import dumps_body
+from .config import settings
+from .logger import get_logger
+from .metrics import metrics
+from .spool import iter_encoded
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+logger = get_logger(__name__)
+
+ENCODINGS = ("gzip", "zstd")
+
+
+def _compress(data: bytes, encoding: str) -> tuple[bytes, float]:
+    """压缩数据 (在工作线程中执行), 返回压缩结果和耗费的 CPU 时间 (秒)"""
+    started = time.thread_time()
+    if encoding == "zstd":
+        compressed = zstandard.ZstdCompressor(level=settings.http_zstd_level).compress(data)
+    else:
+        compressed = gzip.compress(data, compresslevel=settings.http_gzip_level, mtime=0)
+    return compressed, time.thread_time() - started
+
+
+class _Negotiation:
+    """单个上游对某种编码的支持情况"""
+
+    __slots__ = ("rejected_until", "supported")
+
+    def __init__(self) -> None:
+        self.supported = False  # 是否已有压缩请求成功
+        self.rejected_until = 0.0  # 不支持时, 在该时间 (monotonic) 之前不再压缩
+
+
+class RequestCompressor:
+    """请求体压缩器 (单例)"""
+
+    _instance: ClassVar["RequestCompressor | None"] = None
+    _lock: ClassVar[Lock] = Lock()
+    _negotiations: dict[tuple[str, str], _Negotiation]
+
+    def __new__(cls) -> "RequestCompressor":
+        # 双重检查锁定
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._negotiations = {}
+        return cls._instance
+
+    def encoding_for(self, target: str) -> str | None:
+        """
+        上游当前应使用的编码
+
+        Args:
+            target: 上游名 (或连接池名)
+
+        Returns:
+            "gzip" / "zstd"; 未配置或已确认不支持时返回 None
+        """
+        encoding = settings.http_request_compression.get(target)
+        if encoding not in ENCODINGS:
+            return None
+        if encoding == "zstd" and zstandard is None:
+            encoding = "gzip"
+        negotiation = self._negotiations.get((target, encoding))
+        if negotiation is not None and negotiation.rejected_until > time.monotonic():
+            return None
+        return encoding
+
+    async def compress(self, target: str, kwargs: dict[str, Any]) -> dict[str, Any] | None:
+        """
+        压缩 JSON 请求体
+
+        Args:
+            target: 上游名 (或连接池名)
+            kwargs: 请求参数 (json= 请求体, 或 content= 透传的原始 JSON 字节)
+
+        Returns:
+            替换为 content= 压缩请求体并带 Content-Encoding 头的请求参数;
+            上游未启用压缩、没有 JSON 请求体或请求体低于阈值时返回 None
+        """
+        encoding = self.encoding_for(target)
+        if encoding is None:
+            return None
+        if isinstance(kwargs.get("content"), bytes):
+            data = kwargs["content"]
+        elif kwargs.get("json") is not None:
+            data = b"".join(iter_encoded(kwargs["json"], dumps_body))
+        else:
+            return None
+
+        if len(data) < settings.http_compression_min_bytes:
+            return None
+
+        compressed, cpu_time = await asyncio.to_thread(_compress, data, encoding)
+        metrics.observe(
+            "upstream_compression_cpu_ms", cpu_time * 1000, upstream=target, encoding=encoding
+        )
+        metrics.inc("upstream_compression_bytes_in", len(data), upstream=target, encoding=encoding)
+        metrics.inc(
+            "upstream_compression_bytes_saved",
+            len(data) - len(compressed),
+            upstream=target,
+            encoding=encoding,
+        )
+
+        result = {key: value for key, value in kwargs.items() if key not in ("json", "content")}
+        headers = {
+            name: value
+            for name, value in (kwargs.get("headers") or {}).items()
+            if name.lower() not in ("content-type", "content-encoding", "content-length")
+        }
+        headers["content-type"] = "application/json"
+        headers["content-encoding"] = encoding
+        result["headers"] = headers
+        result["content"] = compressed
+        return result
+
+    def maybe_rejected(self, target: str, encoding: str, status: int) -> bool:
+        """
+        压缩请求的响应状态码是否可能表示上游不接受压缩请求体
+
+        415 总是视为拒绝; 400 只在该编码尚未确认支持时视为可能的拒绝
+        (普通的错误请求同样返回 400, 需以未压缩请求体重发确认)
+        """
+        if status == 415:
+            return True
+        negotiation = self._negotiations.get((target, encoding))
+        return status == 400 and (negotiation is None or not negotiation.supported)
+
+    def record(self, target: str, encoding: str, *, supported: bool) -> None:
+        """
+        记录上游对编码的支持情况
+
+        Args:
+            target: 上游名 (或连接池名)
+            encoding: 编码
+            supported: True 表示压缩请求成功; False 表示上游拒绝压缩请求体而未压缩请求成功
+        """
+        negotiation = self._negotiations.setdefault((target, encoding), _Negotiation())
+        if supported:
+            negotiation.supported = True
+            return
+
+        negotiation.supported = False
+        negotiation.rejected_until = time.monotonic() + settings.http_compression_unsupported_ttl
+        metrics.inc("upstream_compression_rejected", upstream=target, encoding=encoding)
+        logger.warning(
+            "upstream_compression_rejected",
+            upstream=target,
+            encoding=encoding,
+            disabled_seconds=settings.http_compression_unsupported_ttl,
+        )
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """各上游的压缩协商状态"""
+        now = time.monotonic()
+        return {
+            f"{target}/{encoding}": {
+                "supported": negotiation.supported,
+                "disabled_seconds": round(max(0.0, negotiation.rejected_until - now), 2),
+            }
+            for (target, encoding), negotiation in self._negotiations.items()
+        }
+
+
+# 全局压缩器实例
+compressor = RequestCompressor()
@@ -0,0 +1,267 @@
+"""
+上游自适应并发限制
+
+固定的 http_max_connections 无法感知上游变慢: 上游已经排队时继续压入请求只会让延迟更高。
+AdaptiveLimiter 按上游维护并发上限 (limit), 并根据请求结果动态调整:
+- 流式请求的首字节耗时 (首个 SSE 事件) 作为延迟信号, 采用 gradient 算法:
+  gradient = clamp(tolerance × 长期耗时 / 本次耗时, 0.5, 1),
+  新上限 = limit × gradient + sqrt(limit), 再按 smoothing 平滑。
+  延迟接近长期水平时上限缓慢增长, 延迟升高时上限按比例收缩
+- 网络错误 / 429 / 5xx 视为过载信号, 上限乘以 backoff_ratio (乘性减)
+- 非流式请求的耗时包含完整生成时间, 不作为延迟信号; 成功时上限加 1/limit (加性增)
+- 在途请求数低于上限一半时不增长, 避免低负载时上限无限膨胀
+- 初始上限默认等于连接池大小 (http_max_connections): 冷启动的 worker 不会比原先更早排队,
+  上游变慢后再由 gradient 下调
+
+超过上限的请求进入有界等待队列, 按优先级 / 公平份额 / 截止时间放行 (见 scheduler);
+队列已满或预计排队时间超过请求的截止时间时立即拒绝 (429 + retry-after), 不再向上游施压
+注意: 每个 gunicorn worker 独立限流
+"""
+import asyncio
+import math
+import time
+from typing import Any
+
+from .config import settings
+from .errors import RateLimitError
+from .logger import get_logger
+from .metrics import metrics
+from .scheduler import FairQueue, RequestContext, Waiter, current_request_context
+
+logger = get_logger(__name__)
+
+# 长期耗时 EWMA 的平滑系数 (约等于最近 100 个样本)
+_LONG_LATENCY_ALPHA = 2 / 101
+
+# 许可持有时长 EWMA 的平滑系数 (用于估算排队时间)
+_HOLD_TIME_ALPHA = 0.1
+
+
+class AdaptiveLimiter:
+    """单个上游的自适应并发限制器 (仅在事件循环内使用, 无需加锁)"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        initial = settings.concurrency_initial_limit or settings.http_max_connections
+        self.limit = float(
+            min(max(initial, settings.concurrency_min_limit), settings.concurrency_max_limit)
+        )
+        self.inflight = 0
+        self._queue = FairQueue()
+        self._long_latency: float | None = None  # 长期首字节耗时 EWMA (秒)
+        self._hold_time: float | None = None  # 许可持有时长 EWMA (秒)
+
+    def check(self) -> None:
+        """
+        检查新请求是否会被立即拒绝 (无副作用)
+
+        流式响应一旦开始就只能以错误事件结束, 调用方可在返回响应前先行检查
+
+        Raises:
+            RateLimitError: 队列已满或预计排队时间超过上限
+        """
+        if self._has_capacity():
+            return
+        self._reject_if_overloaded(current_request_context(), time.monotonic())
+
+    async def acquire(self) -> float:
+        """
+        申请一个并发许可, 超过上限时按当前请求的调度信息排队等待
+
+        Returns:
+            获得许可的时间 (monotonic), 释放时传给 release
+
+        Raises:
+            RateLimitError: 队列已满、预计排队时间或实际排队时间超过截止时间
+        """
+        if self._has_capacity():
+            self.inflight += 1
+            self._report()
+            return time.monotonic()
+
+        context = current_request_context()
+        started = time.monotonic()
+        self._reject_if_overloaded(context, started)
+        waiter = Waiter(context, asyncio.get_running_loop().create_future())
+        self._queue.push(waiter)
+        self._report()
+        try:
+            async with asyncio.timeout(max(0.0, context.remaining(started))):
+                await waiter.future
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 许可已转交但任务同时被取消 / 超时: 归还许可
+                self._release_slot()
+            else:
+                waiter.future.cancel()
+                self._queue.discard(waiter)
+                self._report()
+            if isinstance(e, TimeoutError):
+                raise self._reject("queue_timeout", context) from None
+            raise
+
+        acquired = time.monotonic()
+        metrics.observe(
+            "concurrency_queue_ms",
+            (acquired - started) * 1000,
+            upstream=self.name,
+            priority=str(context.priority),
+        )
+        return acquired
+
+    def release(self, acquired: float) -> None:
+        """
+        释放许可
+
+        Args:
+            acquired: acquire 返回的时间
+        """
+        hold = time.monotonic() - acquired
+        if self._hold_time is None:
+            self._hold_time = hold
+        else:
+            self._hold_time += _HOLD_TIME_ALPHA * (hold - self._hold_time)
+        self._release_slot()
+
+    def record(self, latency: float | None, dropped: bool) -> None:
+        """
+        根据请求结果调整并发上限
+
+        Args:
+            latency: 首字节耗时 (秒); None 表示不作为延迟信号 (如非流式请求)
+            dropped: 是否为过载信号 (网络错误 / 429 / 5xx)
+        """
+        if not settings.concurrency_limit_enabled:
+            return
+
+        if dropped:
+            limit = self.limit * settings.concurrency_backoff_ratio
+        elif self.inflight < self.limit / 2:
+            # 负载不足以验证更高的上限
+            return
+        elif latency is None:
+            limit = self.limit + 1 / self.limit
+        else:
+            limit = self._gradient_limit(latency)
+
+        previous = self.limit
+        self.limit = min(
+            float(settings.concurrency_max_limit),
+            max(float(settings.concurrency_min_limit), limit),
+        )
+        if int(self.limit) != int(previous):
+            logger.debug(
+                "concurrency_limit_changed",
+                upstream=self.name,
+                previous=int(previous),
+                limit=int(self.limit),
+                dropped=dropped,
+            )
+        self._wake()
+
+    def estimated_wait(self, context: RequestContext | None = None) -> float | None:
+        """
+        按 Little 定律估算新请求的排队时间: (前方排队数 + 1) / 上限 × 平均持有时长
+
+        Args:
+            context: 请求的调度信息; 指定时只计入调度上会先于它放行的排队请求
+
+        Returns:
+            预计排队秒数; 尚无持有时长样本时返回 None
+        """
+        if self._hold_time is None:
+            return None
+        ahead = self._queue.ahead(context) if context is not None else len(self._queue)
+        return (ahead + 1) / self.limit * self._hold_time
+
+    def _gradient_limit(self, latency: float) -> float:
+        """gradient 算法计算新上限"""
+        latency = max(latency, 1e-3)
+        if self._long_latency is None:
+            self._long_latency = latency
+        else:
+            self._long_latency += _LONG_LATENCY_ALPHA * (latency - self._long_latency)
+            if self._long_latency / latency > 2:
+                # 上游已恢复: 加速长期耗时向新水平回落
+                self._long_latency *= 0.95
+
+        tolerance = settings.concurrency_latency_tolerance
+        gradient = max(0.5, min(1.0, tolerance * self._long_latency / latency))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        smoothing = settings.concurrency_smoothing
+        return self.limit * (1 - smoothing) + target * smoothing
+
+    def _has_capacity(self) -> bool:
+        """是否可以不排队直接放行 (已有排队请求时新请求也要排队, 由调度决定放行顺序)"""
+        if not settings.concurrency_limit_enabled:
+            return True
+        return not self._queue and self.inflight < int(self.limit)
+
+    def _reject_if_overloaded(self, context: RequestContext, now: float) -> None:
+        """队列已满或预计排队时间超过请求截止时间时拒绝"""
+        if len(self._queue) >= settings.concurrency_max_queue:
+            raise self._reject("queue_full", context)
+        wait = self.estimated_wait(context)
+        if wait is not None and wait > context.remaining(now):
+            raise self._reject("queue_deadline", context)
+
+    def _reject(self, reason: str, context: RequestContext) -> RateLimitError:
+        """记录拒绝并构建 429 错误"""
+        retry_after = self.estimated_wait(context) or settings.concurrency_queue_timeout
+        metrics.inc(
+            "concurrency_rejected",
+            upstream=self.name,
+            reason=reason,
+            priority=str(context.priority),
+        )
+        logger.warning(
+            "concurrency_rejected",
+            upstream=self.name,
+            reason=reason,
+            priority=context.priority,
+            flow=context.flow,
+            limit=int(self.limit),
+            inflight=self.inflight,
+            queued=len(self._queue),
+            retry_after=round(retry_after, 2),
+        )
+        return RateLimitError(
+            self.name,
+            retry_after=retry_after,
+            message=f"Upstream '{self.name}' is at its concurrency limit, please retry later",
+        )
+
+    def _release_slot(self) -> None:
+        self.inflight = max(0, self.inflight - 1)
+        self._wake()
+
+    def _wake(self) -> None:
+        """按调度顺序把空出的许可转交给排队请求"""
+        while self._queue and (
+            not settings.concurrency_limit_enabled or self.inflight < int(self.limit)
+        ):
+            waiter = self._queue.pop()
+            if waiter is None:
+                break
+            self.inflight += 1
+            waiter.future.set_result(None)
+        self._report()
+
+    def _report(self) -> None:
+        metrics.gauge("concurrency_limit", int(self.limit), upstream=self.name)
+        metrics.gauge("concurrency_inflight", self.inflight, upstream=self.name)
+        metrics.gauge("concurrency_queued", len(self._queue), upstream=self.name)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "inflight": self.inflight,
+            "queued": len(self._queue),
+            "queued_by_priority": self._queue.stats(),
+            "long_latency_ms": (
+                round(self._long_latency * 1000, 2) if self._long_latency is not None else None
+            ),
+            "hold_time_ms": (
+                round(self._hold_time * 1000, 2) if self._hold_time is not None else None
+            ),
+        }
@@ -1,9 +1,51 @@
 """
 共享配置管理
 """
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
+class HTTPPoolConfig(BaseModel):
+    """
+    命名连接池配置
+
+    匹配条件均为可选, 未设置表示不限制; 多个连接池同时匹配时选择条件最多的一个
+    """
+
+    base_url: str | None = None  # 上游 URL 前缀
+    models: list[str] = []  # 模型名前缀 (如 "claude-opus")
+    stream: bool | None = None  # 负载类型: True=流式长请求, False=非流式短请求
+
+    # 连接池限制 (未设置时使用全局 http_max_* 配置)
+    max_connections: int | None = None
+    max_keepalive: int | None = None
+
+    # 传输后端 (未设置时使用全局 http_transport / http_transport_stripes 配置)
+    transport: str | None = None  # http2 / http1 / aiohttp
+    stripes: int | None = None
+
+
+class HTTPTimeoutConfig(BaseModel):
+    """
+    上游分阶段超时 (秒)
+
+    未设置的字段使用全局 http_*_timeout 配置
+    """
+
+    connect: float | None = None  # TCP 建连 + TLS 握手
+    headers: float | None = None  # 发出请求到收到响应头 (非流式请求包含完整生成时间)
+    first_event: float | None = None  # 流式请求收到响应头到第一个 SSE 事件
+    idle: float | None = None  # 响应体两个数据块之间的最长间隔
+    total: float | None = None  # 请求总时长 (含重试)
+
+
+class KeyPoolConfig(BaseModel):
+    """租户上游 Key 池"""
+
+    client_keys: list[str]  # 租户调用方使用的 Key (请求携带其中之一时使用该池)
+    upstream_keys: list[str]  # 发往上游的 API Key
+
+
 class Settings(BaseSettings):
     """全局配置"""
 
@@ -29,6 +71,22 @@ class Settings(BaseSettings):
     anthropic_base_url: str = "https://api.anthropic.com"  # 可通过环境变量覆盖
     openai_base_url: str = "https://api.openai.com/v1"     # 可通过环境变量覆盖
 
+    # 多个等价上游端点 (JSON 列表, 设置后覆盖对应的单个 base_url)
+    anthropic_base_urls: list[str] = []
+    openai_base_urls: list[str] = []
+
+    # 内部租户的上游 Key 池 (JSON, 如 {"team-a": {"client_keys": [...], "upstream_keys": [...]}})
+    # 调用方 Key 不属于任何租户时直接转发调用方的 Key
+    anthropic_key_pools: dict[str, KeyPoolConfig] = {}
+    openai_key_pools: dict[str, KeyPoolConfig] = {}
+    key_pool_cooldown: float = 30.0  # Key 收到 429 且无 retry-after 时移出轮换的时长 (秒)
+
+    # 负载均衡配置 (多端点时生效)
+    lb_ewma_alpha: float = 0.3  # 首字节耗时 EWMA 平滑系数
+    lb_failure_penalty: float = 10.0  # 失败请求按该耗时 (秒) 计入 EWMA
+    lb_probe_interval: float = 10.0  # 后台探测间隔 (秒)
+    lb_probe_idle_after: float = 30.0  # 端点无流量超过该时长 (秒) 时进行探测
+
     # 调试配置
     codex_dump_requests: bool = False
     codex_dump_dir: str = "/tmp"
@@ -44,6 +102,16 @@ class Settings(BaseSettings):
     log_level: str = "INFO"
     log_format: str = "json"  # json or text
 
+    @property
+    def anthropic_endpoints(self) -> list[str]:
+        """Anthropic 上游端点列表"""
+        return self.anthropic_base_urls or [self.anthropic_base_url]
+
+    @property
+    def openai_endpoints(self) -> list[str]:
+        """OpenAI 上游端点列表"""
+        return self.openai_base_urls or [self.openai_base_url]
+
     @property
     def is_test_environment(self) -> bool:
         """判断是否为测试环境"""
@@ -55,6 +123,131 @@ class Settings(BaseSettings):
     http_max_keepalive: int = 100
     http_max_connections: int = 200
     http_keepalive_expiry: float = 30.0
+    # 传输后端: http2 (httpx HTTP/2) / http1 (httpx HTTP/1.1) / aiohttp (需安装 aiohttp)
+    # 可按命名连接池 (http_pools) 覆盖, 即按上游选择
+    http_transport: str = "http2"
+    http_transport_stripes: int = 1  # 连接池拆分为 N 个子传输 (HTTP/2 下即 N 条并行连接)
+
+    # 上游 DNS 缓存 (所有连接池共享, 安装 aiodns 时遵循记录的 TTL, 否则使用 dns_default_ttl)
+    dns_cache_enabled: bool = True
+    dns_default_ttl: float = 60.0  # 无法获得 TTL 时的缓存时长 (秒)
+    dns_min_ttl: float = 5.0  # TTL 下限 (秒), 避免 TTL 为 0 的记录每次建连都重新解析
+    dns_max_ttl: float = 600.0  # TTL 上限 (秒)
+    dns_stale_ttl: float = 300.0  # 解析失败时继续使用过期结果的时长 (秒)
+    dns_timeout: float = 5.0  # 单次解析超时 (秒)
+
+    # 上游请求分阶段超时 (秒), http_timeout 仅作为预热 / 探测等内部请求的默认超时
+    http_headers_timeout: float = 120.0
+    http_first_event_timeout: float = 120.0
+    http_idle_timeout: float = 60.0
+    http_total_timeout: float = 900.0
+    # 按模型前缀覆盖 (JSON, 如 {"claude-opus": {"first_event": 600}}), 最长前缀优先
+    http_model_timeouts: dict[str, HTTPTimeoutConfig] = {}
+
+    # 上游请求体压缩 (JSON, 如 {"anthropic": "zstd", "openai": "gzip"}, 键为上游名或连接池名)
+    # 未配置的上游不压缩; zstd 需要安装 zstandard, 未安装时使用 gzip
+    http_request_compression: dict[str, str] = {}
+    http_compression_min_bytes: int = 16384  # 请求体低于该大小 (字节) 时不压缩
+    http_gzip_level: int = 5
+    http_zstd_level: int = 3
+    http_compression_unsupported_ttl: float = 3600.0  # 上游拒绝压缩请求体后停用压缩的时长 (秒)
+
+    # 未压缩的大请求体分块增量编码上传 (编码与上传交替进行, 不保留完整编码结果)
+    http_stream_upload_enabled: bool = True
+    http_stream_upload_chunk_size: int = 65536  # 分块大小 (字节), 不超过一块的请求体一次性发送
+
+    # 透传适配器 (官方 Claude Code 客户端) 的请求体不解析 / 重新序列化, 原始字节直接转发给上游
+    request_passthrough_enabled: bool = True
+    # 非流式上游响应体原样返回给客户端 (不解析 / 重新序列化)
+    response_passthrough_enabled: bool = True
+
+    # 大请求体落盘 (写入临时文件后 mmap 解析, 大 base64 字符串转发时直接从文件分块读取)
+    request_spool_threshold: int = 8388608  # Content-Length 超过该值 (字节) 时落盘, 0 表示关闭
+    request_spool_min_string: int = 65536  # 保留在文件中的 base64 字符串的最小长度 (字节)
+    request_spool_dir: str | None = None  # 临时目录 (应位于磁盘), 未设置时使用系统默认临时目录
+
+    # 上游重试配置 (仅在响应体第一个字节转发给客户端之前重试)
+    retry_max_attempts: int = 3  # 总尝试次数 (含首次), 1 表示关闭重试
+    retry_statuses: list[int] = [429, 502, 503, 504, 529]
+    retry_backoff_base: float = 0.5  # 指数退避基数 (秒), 带 full jitter
+    retry_backoff_max: float = 8.0  # 单次退避上限 (秒)
+    retry_max_retry_after: float = 20.0  # 上游 retry-after 超过该值 (秒) 时放弃重试
+    retry_budget_ratio: float = 0.2  # 每个原始请求存入的重试令牌数
+    retry_budget_min_per_second: float = 1.0  # 重试令牌最低补充速率 (个/秒)
+    retry_budget_max_tokens: float = 20.0  # 重试令牌桶容量
+
+    # 熔断配置 (按上游端点统计)
+    breaker_enabled: bool = True
+    breaker_window: float = 30.0  # 统计窗口 (秒)
+    breaker_min_requests: int = 10  # 窗口内样本数达到该值才会熔断
+    breaker_error_rate: float = 0.5  # 错误率阈值 (网络错误 / 5xx)
+    breaker_slow_call_seconds: float = 30.0  # 流式请求首字节超过该值视为慢调用 (0 表示关闭)
+    breaker_slow_call_rate: float = 0.8  # 慢调用率阈值
+    breaker_open_seconds: float = 15.0  # 熔断持续时间 (秒), 之后进入 half-open
+    breaker_half_open_probes: int = 2  # half-open 状态放行的探测请求数
+
+    # 对冲请求配置 (首次尝试超过历史首字节耗时分位数仍未响应时, 向其他端点再发一次)
+    hedge_enabled: bool = True
+    hedge_quantile: float = 0.95  # 对冲延迟取首字节耗时的该分位数
+    hedge_min_samples: int = 20  # 样本数不足时不对冲
+    hedge_min_delay: float = 0.5  # 对冲延迟下限 (秒)
+    hedge_max_delay: float = 60.0  # 对冲延迟上限 (秒)
+    hedge_budget_ratio: float = 0.05  # 每个原始请求存入的对冲令牌数 (即最多约 5% 额外上游负载)
+    hedge_budget_max_tokens: float = 5.0  # 对冲令牌桶容量
+
+    # 自适应并发限制 (按上游, 根据首字节耗时和过载信号动态调整并发上限)
+    concurrency_limit_enabled: bool = True
+    # 初始上限, 未设置时等于 http_max_connections (冷启动时与原连接池并发相同, 由 gradient 下调)
+    concurrency_initial_limit: int | None = None
+    concurrency_min_limit: int = 4
+    concurrency_max_limit: int = 200  # 不超过 http_max_connections 才有意义
+    concurrency_latency_tolerance: float = 1.5  # 首字节耗时超过长期水平该倍数时开始收缩
+    concurrency_smoothing: float = 0.2  # 上限调整平滑系数
+    concurrency_backoff_ratio: float = 0.9  # 过载信号 (网络错误 / 429 / 5xx) 时的收缩比例
+    concurrency_max_queue: int = 100  # 排队请求数上限
+    concurrency_queue_timeout: float = 30.0  # 最长排队时间 (秒), 预计超过时直接返回 429
+
+    # 进程内存预算 (按在途请求声明的 Content-Length 准入, 预算不足时排队; 每个 worker 独立统计)
+    memory_budget_enabled: bool = True
+    memory_budget_bytes: int = 67108864  # 在途请求 / 响应体的预算 (字节), 按 512MB 容器 4 个 worker 估算
+    memory_budget_body_factor: float = 3.0  # 内存中处理的请求体的放大倍数 (解析结果 + 上游编码)
+    memory_budget_min_request: int = 65536  # 每个请求至少预留 (字节)
+    memory_budget_max_request: int = 33554432  # 声明大小超过该值 (字节) 时直接返回 413
+    memory_budget_max_queue: int = 100  # 排队请求数上限
+    memory_budget_queue_timeout: float = 30.0  # 最长排队时间 (秒), 超过时返回 503 + retry-after
+
+    # 排队调度 (优先级类之间严格优先, 类内按流加权公平, 流内按截止时间)
+    # 流权重 (JSON, 如 {"<key 指纹>": 2, "10.0.0.5": 0.5}), 未配置的流权重为 1
+    scheduler_flow_weights: dict[str, float] = {}
+
+    # 限流额度节流 (按上游响应头记录每个 API Key 的剩余额度, 额度耗尽时本地等待而不是发出必然 429 的请求)
+    pacing_enabled: bool = True
+    pacing_max_wait: float = 10.0  # 最长本地等待 (秒), 超过时直接返回 429 + retry-after
+    pacing_min_tokens: int = 1000  # 剩余 token 低于该值时等待 token 额度重置
+    pacing_state_path: str = ""  # 跨 worker 共享的状态文件 (默认 /dev/shm/cc-proxy-ratelimit.sqlite)
+
+    # Idempotency-Key 支持 (重复请求挂到进行中的上游响应上, 或重放已保存的响应)
+    idempotency_enabled: bool = True
+    idempotency_ttl: float = 600.0  # 响应保存时长 (秒)
+    idempotency_max_bytes: int = 268435456  # 已保存响应的总大小上限 (字节), 超过时淘汰最早的响应
+    idempotency_orphan_grace: float = 10.0  # 所有客户端断开后上游请求的保留时长 (秒)
+
+    # 相同请求合并 (转换后请求体和目标上游都相同的并发请求共享一个上游调用 / SSE 流)
+    coalesce_enabled: bool = False
+    coalesce_max_temperature: float = 0.0  # temperature 高于该值的请求不合并 (未设置按 1.0)
+
+    # Claude 流式响应续写配置 (上游中途断开时以已转发文本作为 prefill 续写)
+    stream_resume_enabled: bool = True
+    stream_resume_max_attempts: int = 2  # 单个流最多续写次数
+
+    # 命名连接池 (JSON, 如 {"claude-stream": {"base_url": "https://...", "stream": true}})
+    # 未匹配任何命名池的请求按上游 origin 各自使用独立连接池
+    http_pools: dict[str, HTTPPoolConfig] = {}
+
+    # 连接预热配置 (启动时预建上游连接, 并定期 ping 保持连接不过期)
+    http_prewarm_connections: int = 2  # 每个上游预建连接数 (0 表示关闭预热)
+    http_prewarm_timeout: float = 5.0  # 预热总超时 (秒), 避免阻塞服务启动
+    http_keepwarm_interval: float = 20.0  # 保活 ping 间隔 (秒), 需小于 http_keepalive_expiry
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,82 @@
+"""
+客户端断开检测
+
+ASGI spec 2.4 起 StreamingResponse 不再监听 http.disconnect, 只有在下一次写入
+失败时才发现客户端已断开; 等待上游响应的非流式请求无论哪个版本都要等上游返回后
+才会结束。在此期间上游仍在生成并占用连接池。
+
+CancelOnDisconnectMiddleware 在请求体读取完毕后主动等待 http.disconnect,
+客户端断开时立即取消请求处理任务, 取消会沿调用链传递到 HTTPClient,
+关闭上游流 (HTTP/2 下为 RST_STREAM) 并释放连接
+"""
+import asyncio
+from typing import Any
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .logger import get_logger
+from .metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class CancelOnDisconnectMiddleware:
+    """客户端断开时取消请求处理 (纯 ASGI 中间件)"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        body_complete = asyncio.Event()
+        disconnected = asyncio.Event()
+        state: dict[str, Any] = {"response_started": False, "response_complete": False}
+
+        async def wrapped_receive() -> Message:
+            # 请求体读完后, 后续 receive 只会返回 http.disconnect, 由 watcher 统一读取
+            if body_complete.is_set():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_complete.set()
+            return message
+
+        async def wrapped_send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                state["response_started"] = True
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["response_complete"] = True
+            await send(message)
+
+        async def watch() -> None:
+            await body_complete.wait()
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+
+        handler = asyncio.create_task(self.app(scope, wrapped_receive, wrapped_send))
+        watcher = asyncio.create_task(watch())
+        cancelled = False
+        try:
+            await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not handler.done() and disconnected.is_set() and not state["response_complete"]:
+                phase = "streaming" if state["response_started"] else "waiting"
+                metrics.inc("client_disconnects", path=scope.get("path", ""), phase=phase)
+                logger.info("client_disconnected", path=scope.get("path"), phase=phase)
+                handler.cancel()
+                cancelled = True
+            try:
+                await handler
+            except asyncio.CancelledError:
+                if not cancelled:
+                    raise
+        finally:
+            watcher.cancel()
+            if not handler.done():
+                handler.cancel()
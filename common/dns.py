@@ -0,0 +1,212 @@
+"""
+上游 DNS 缓存
+
+httpcore / aiohttp 每次新建连接都要在线程池中调用 getaddrinfo 解析上游域名:
+连接抖动 (keepalive 过期、worker 重启、突发超过 keepalive 上限) 时解析耗时直接计入首字节耗时,
+DNS 服务器变慢时还会卡住建连。DNSCache 由所有上游连接池共享 (见 transports):
+- 安装 aiodns 时异步解析并遵循记录的 TTL (限制在 dns_min_ttl ~ dns_max_ttl 之间);
+  未安装时在线程池中调用 getaddrinfo, 结果缓存 dns_default_ttl 秒
+- 缓存剩余 TTL 不足 20% 时被使用会触发后台刷新, 请求直接使用当前结果, 不等待解析;
+  同一域名的并发解析合并为一次
+- 解析失败时继续使用过期结果 (最多 dns_stale_ttl 秒), DNS 短暂故障不会导致建连失败
+- 新连接在解析出的所有地址之间轮转 (连接建立后固定在该地址上), 连接失败时依次尝试其他地址;
+  HTTP/2 连接池通常只有一条连接, 配合 http_transport_stripes 才能分散到多个地址
+"""
+import asyncio
+import ipaddress
+import socket
+import time
+from threading import Lock
+from typing import Any, ClassVar
+
+from .config import settings
+from .logger import get_logger
+from .metrics import metrics
+
+try:
+    import aiodns
+except ImportError:  # pragma: no cover - 可选依赖
+    aiodns = None
+
+logger = get_logger(__name__)
+
+# 剩余 TTL 低于该比例时后台刷新
+_REFRESH_AHEAD = 0.2
+
+
+class _Entry:
+    """单个域名的解析结果"""
+
+    __slots__ = ("addresses", "expires", "refresh_at", "rotation", "ttl")
+
+    def __init__(self, addresses: list[str], ttl: float) -> None:
+        now = time.monotonic()
+        self.addresses = addresses
+        self.ttl = ttl
+        self.expires = now + ttl
+        self.refresh_at = now + ttl * (1 - _REFRESH_AHEAD)
+        self.rotation = 0  # 下一个新连接使用的首选地址下标
+
+
+class DNSCache:
+    """上游域名解析缓存 (单例, 仅在事件循环内使用)"""
+
+    _instance: ClassVar["DNSCache | None"] = None
+    _lock: ClassVar[Lock] = Lock()
+    _entries: dict[str, _Entry]
+    _pending: dict[str, "asyncio.Task[list[str]]"]
+    _resolver: Any
+
+    def __new__(cls) -> "DNSCache":
+        # 双重检查锁定
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._entries = {}
+                    cls._instance._pending = {}
+                    cls._instance._resolver = None
+        return cls._instance
+
+    async def targets(self, host: str) -> list[str]:
+        """
+        新连接的候选地址 (按轮转顺序排列, 依次尝试)
+
+        Args:
+            host: 域名或 IP
+
+        Raises:
+            OSError: 解析失败且没有可用的过期结果
+        """
+        if _is_ip(host):
+            return [host]
+
+        addresses = await self._lookup(host)
+        entry = self._entries.get(host)
+        if entry is None or len(addresses) < 2:
+            return addresses
+        index = entry.rotation % len(addresses)
+        entry.rotation += 1
+        return addresses[index:] + addresses[:index]
+
+    async def _lookup(self, host: str) -> list[str]:
+        now = time.monotonic()
+        entry = self._entries.get(host)
+        if entry is None:
+            metrics.inc("dns_cache", result="miss")
+            return await self._refresh(host)
+
+        if now < entry.expires:
+            metrics.inc("dns_cache", result="hit")
+            if now >= entry.refresh_at and host not in self._pending:
+                metrics.inc("dns_cache", result="refresh")
+                self._start_refresh(host)
+            return entry.addresses
+
+        try:
+            metrics.inc("dns_cache", result="expired")
+            return await self._refresh(host)
+        except OSError:
+            if now >= entry.expires + settings.dns_stale_ttl:
+                raise
+            metrics.inc("dns_cache", result="stale")
+            return entry.addresses
+
+    def _start_refresh(self, host: str) -> "asyncio.Task[list[str]]":
+        """启动 (或复用进行中的) 解析任务"""
+        task = self._pending.get(host)
+        if task is None:
+            task = asyncio.create_task(self._resolve(host))
+            self._pending[host] = task
+            task.add_done_callback(lambda _: self._pending.pop(host, None))
+            # 后台刷新无人等待时也要取走异常, 避免 "exception was never retrieved"
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _refresh(self, host: str) -> list[str]:
+        # shield: 单个等待方被取消时不影响其他等待同一解析结果的请求
+        return await asyncio.shield(self._start_refresh(host))
+
+    async def _resolve(self, host: str) -> list[str]:
+        """解析域名并写入缓存"""
+        started = time.perf_counter()
+        resolver = "aiodns" if aiodns is not None else "getaddrinfo"
+        try:
+            async with asyncio.timeout(settings.dns_timeout):
+                if aiodns is not None:
+                    addresses, ttl = await self._query(host)
+                else:
+                    addresses, ttl = await _getaddrinfo(host), settings.dns_default_ttl
+            if not addresses:
+                raise socket.gaierror(socket.EAI_NONAME, f"No address found for {host}")
+        except Exception as e:
+            metrics.inc("dns_resolve_failed", host=host)
+            logger.warning("dns_resolve_failed", host=host, resolver=resolver, error=str(e))
+            if isinstance(e, OSError):
+                raise
+            raise socket.gaierror(socket.EAI_FAIL, f"Failed to resolve {host}: {e}") from e
+
+        ttl = min(settings.dns_max_ttl, max(settings.dns_min_ttl, ttl))
+        metrics.observe(
+            "dns_resolve_ms", (time.perf_counter() - started) * 1000, host=host, resolver=resolver
+        )
+        previous = self._entries.get(host)
+        entry = self._entries[host] = _Entry(addresses, ttl)
+        if previous is not None:
+            entry.rotation = previous.rotation
+            if previous.addresses != addresses:
+                logger.info(
+                    "dns_addresses_changed",
+                    host=host,
+                    previous=previous.addresses,
+                    addresses=addresses,
+                )
+        return addresses
+
+    async def _query(self, host: str) -> tuple[list[str], float]:
+        """aiodns 解析, 返回 (地址列表, 最小 TTL)"""
+        if self._resolver is None:
+            self._resolver = aiodns.DNSResolver()
+        result = await self._resolver.getaddrinfo(host, type=socket.SOCK_STREAM)
+        addresses: list[str] = []
+        ttls: list[float] = []
+        for node in result.nodes:
+            address = node.addr[0]
+            address = address.decode() if isinstance(address, bytes) else address
+            if address not in addresses:
+                addresses.append(address)
+            ttls.append(node.ttl)
+        return addresses, min(ttls, default=settings.dns_default_ttl)
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """各域名的缓存地址和剩余 TTL"""
+        now = time.monotonic()
+        return {
+            host: {
+                "addresses": entry.addresses,
+                "ttl": round(entry.ttl, 2),
+                "expires_in": round(entry.expires - now, 2),
+            }
+            for host, entry in self._entries.items()
+        }
+
+
+async def _getaddrinfo(host: str) -> list[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    addresses: list[str] = []
+    for *_, sockaddr in infos:
+        if sockaddr[0] not in addresses:
+            addresses.append(sockaddr[0])
+    return addresses
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+# 全局 DNS 缓存实例
+dns_cache = DNSCache()
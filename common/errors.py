@@ -1,6 +1,7 @@
 """
 自定义异常类
 """
+import math
 from typing import Any
 
 
@@ -13,11 +14,13 @@ class ProxyError(Exception):
         error_type: str = "proxy_error",
         status_code: int = 500,
         details: dict[str, Any] | None = None,
+        headers: dict[str, str] | None = None,
     ) -> None:
         self.message = message
         self.error_type = error_type
         self.status_code = status_code
         self.details = details or {}
+        self.headers = headers or {}  # 需要附加到错误响应的头 (如 retry-after)
         super().__init__(message)
 
     def to_dict(self) -> dict[str, Any]:
@@ -57,10 +60,87 @@ class InvalidRequestError(ProxyError):
 class ServiceUnavailableError(ProxyError):
     """服务不可用错误"""
 
-    def __init__(self, service: str) -> None:
+    def __init__(
+        self,
+        service: str,
+        retry_after: float | None = None,
+        message: str | None = None,
+    ) -> None:
         super().__init__(
-            message=f"Service '{service}' is unavailable",
+            message=message or f"Service '{service}' is unavailable",
             error_type="service_unavailable",
             status_code=503,
             details={"service": service},
+            headers=_retry_after_header(retry_after),
+        )
+
+
+class CircuitOpenError(ServiceUnavailableError):
+    """上游熔断中 (快速失败, 不发起上游请求)"""
+
+    def __init__(self, service: str, retry_after: float) -> None:
+        super().__init__(
+            service,
+            retry_after=retry_after,
+            message=f"Service '{service}' is temporarily unavailable (circuit open)",
+        )
+
+
+class RateLimitError(ProxyError):
+    """代理侧限流 (上游并发已达上限且排队超时等)"""
+
+    def __init__(
+        self,
+        service: str,
+        retry_after: float | None = None,
+        message: str | None = None,
+    ) -> None:
+        super().__init__(
+            message=message or f"Service '{service}' is rate limited",
+            error_type="rate_limit_error",
+            status_code=429,
+            details={"service": service},
+            headers=_retry_after_header(retry_after),
         )
+
+
+class GatewayTimeoutError(ProxyError):
+    """上游超时 (分阶段超时)"""
+
+    def __init__(self, service: str, phase: str, seconds: float) -> None:
+        super().__init__(
+            message=f"Service '{service}' timed out ({phase} timeout after {seconds:g}s)",
+            error_type="timeout_error",
+            status_code=504,
+            details={"service": service, "phase": phase},
+        )
+
+
+class RequestTooLargeError(ProxyError):
+    """请求体超过大小上限 (按声明的 Content-Length 判断, 不读取请求体)"""
+
+    def __init__(self, size: int, limit: int) -> None:
+        super().__init__(
+            message=f"Request body of {size} bytes exceeds the limit of {limit} bytes",
+            error_type="request_too_large",
+            status_code=413,
+            details={"size": size, "limit": limit},
+        )
+
+
+class IdempotencyKeyReusedError(ProxyError):
+    """同一个 Idempotency-Key 用于不同的请求"""
+
+    def __init__(self) -> None:
+        super().__init__(
+            message="Idempotency-Key has already been used with a different request",
+            error_type="invalid_request_error",
+            status_code=422,
+        )
+
+
+def _retry_after_header(retry_after: float | None) -> dict[str, str]:
+    """构建 retry-after 响应头 (向上取整到秒)"""
+    if retry_after is None:
+        return {}
+    return {"retry-after": str(max(1, math.ceil(retry_after)))}
@@ -0,0 +1,181 @@
+"""
+共享上游响应
+
+一个上游请求在独立任务中执行, 响应 (流式响应的每个数据块) 记录在共享列表中,
+任意数量的客户端各自按自己的进度读取: 先重放已记录的数据, 再跟随实时数据,
+慢客户端不会拖慢上游读取或其他客户端。Idempotency-Key 去重 (idempotency)
+和相同请求合并 (coalescing) 都基于 SharedResponse
+
+记录的数据计入进程内存预算 (memory_budget 的 shared), 上游响应结束且没有客户端
+仍在读取时释放
+"""
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+from fastapi.responses import Response, StreamingResponse
+
+from .codec import CompactJSONResponse
+from .logger import get_logger
+from .memory_budget import memory_budget
+from .metrics import metrics
+
+logger = get_logger(__name__)
+
+# 重建响应时不沿用的响应头 (由新响应重新计算)
+_SKIP_HEADERS = frozenset({"content-length"})
+
+
+class SharedResponse:
+    """
+    多个客户端共享的上游响应
+
+    所有客户端都断开后, 上游请求再保留 orphan_grace 秒, 仍没有客户端读取时取消
+    """
+
+    def __init__(
+        self,
+        call: Callable[[], Awaitable[Response | Any]],
+        *,
+        orphan_grace: float,
+        on_done: Callable[["SharedResponse"], None],
+        name: str,
+    ) -> None:
+        """
+        Args:
+            call: 实际执行请求, 返回 Response 或可 JSON 序列化的响应体
+            orphan_grace: 所有客户端断开后上游请求的保留时长 (秒)
+            on_done: 上游响应结束 (或失败) 后的回调
+            name: 指标标签 (kind) 和日志中的名称
+        """
+        self.name = name
+        self.orphan_grace = orphan_grace
+        self.chunks: list[bytes] = []
+        self.size = 0
+        self._charged = 0  # 计入内存预算的字节
+        self.complete = False
+        self.succeeded = False
+        self.subscribers = 0
+
+        # 响应头就绪: (状态码, 响应头, 是否流式)
+        self._head: asyncio.Future[tuple[int, dict[str, str], bool]] = (
+            asyncio.get_running_loop().create_future()
+        )
+        self._head.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._changed = asyncio.Event()
+        self._reaper: asyncio.TimerHandle | None = None
+        self._on_done = on_done
+        self._task = asyncio.create_task(self._produce(call))
+
+    async def response(self, headers: dict[str, str] | None = None) -> Response:
+        """
+        等待响应头, 返回该客户端的响应
+
+        Args:
+            headers: 附加的响应头
+
+        Raises:
+            原请求在响应头之前抛出的异常
+        """
+        self.subscribers += 1
+        try:
+            status_code, head_headers, streaming = await asyncio.shield(self._head)
+        finally:
+            self._unsubscribe()
+
+        if headers:
+            head_headers = {**head_headers, **headers}
+        if streaming:
+            return StreamingResponse(
+                self._follow(), status_code=status_code, headers=head_headers
+            )
+        return Response(b"".join(self.chunks), status_code=status_code, headers=head_headers)
+
+    async def _produce(self, call: Callable[[], Awaitable[Response | Any]]) -> None:
+        """执行上游请求并记录响应 (独立于各客户端的请求处理任务)"""
+        try:
+            response = await call()
+            if not isinstance(response, Response):
+                response = CompactJSONResponse(content=response)
+            headers = {
+                name: value
+                for name, value in response.headers.items()
+                if name not in _SKIP_HEADERS
+            }
+            streaming = isinstance(response, StreamingResponse)
+            self._head.set_result((response.status_code, headers, streaming))
+
+            if streaming:
+                async for chunk in response.body_iterator:
+                    if chunk:
+                        self._append(chunk if isinstance(chunk, bytes) else chunk.encode())
+            else:
+                self._append(response.body)
+            # 流式错误在流内以 error 事件返回
+            self.succeeded = response.status_code < 400 and not (
+                streaming and self.chunks and b"event: error" in self.chunks[-1]
+            )
+        except Exception as e:
+            # 响应头之前的错误交给每个等待的客户端各自处理 (转换为错误响应)
+            if not self._head.done():
+                self._head.set_exception(e)
+            else:
+                logger.warning(
+                    "shared_stream_error", name=self.name, error=str(e), chunks=len(self.chunks)
+                )
+        finally:
+            if not self._head.done():
+                self._head.cancel()
+            self.complete = True
+            self._notify()
+            if self._reaper is not None:
+                self._reaper.cancel()
+            self._release_budget()
+            self._on_done(self)
+
+    def _append(self, chunk: bytes) -> None:
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self._charged += len(chunk)
+        memory_budget.charge("shared", len(chunk))
+        self._notify()
+
+    def _notify(self) -> None:
+        # 唤醒当前等待者, 之后的等待使用新的 Event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _follow(self) -> AsyncIterator[bytes]:
+        """重放已记录的数据块, 再跟随实时数据直到上游响应结束"""
+        self.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.complete:
+                    return
+                await self._changed.wait()
+        finally:
+            self._unsubscribe()
+
+    def _unsubscribe(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.complete and self._reaper is None:
+            self._reaper = asyncio.get_running_loop().call_later(self.orphan_grace, self._reap)
+        self._release_budget()
+
+    def _release_budget(self) -> None:
+        """上游响应结束且没有客户端仍在读取时, 释放计入内存预算的字节"""
+        if self.complete and self.subscribers == 0 and self._charged:
+            memory_budget.release("shared", self._charged)
+            self._charged = 0
+
+    def _reap(self) -> None:
+        """宽限期内没有客户端重新读取时取消上游请求"""
+        self._reaper = None
+        if self.subscribers == 0 and not self.complete:
+            metrics.inc("shared_response_orphans_cancelled", kind=self.name)
+            logger.info("shared_response_orphaned", name=self.name, chunks=len(self.chunks))
+            self._task.cancel()
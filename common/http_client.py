@@ -1,24 +1,168 @@
 """
 HTTP 客户端
 使用 httpx 提供异步 HTTP 客户端,支持 HTTP/2 和连接池
+
+连接池按上游隔离: 每个命名连接池 (settings.http_pools) 或上游 origin
+使用独立的 httpx.AsyncClient, 长时间的流式请求不会占满其他上游的连接
 """
-from collections.abc import AsyncIterator
+import asyncio
+import time
+from collections.abc import AsyncIterator, Callable
 from threading import Lock
 from typing import Any
 
 import httpx
 
-from .config import settings
+from .balancer import Endpoint, UpstreamGroup
+from .compression import compressor
+from .concurrency import AdaptiveLimiter
+from .config import HTTPPoolConfig, settings
+from .errors import CircuitOpenError, ProxyError
+from .key_pool import KeyLease, KeyPool, with_api_key
 from .logger import get_logger
+from .metrics import metrics
+from .pacing import api_key_from_headers, pacer
+from .retry import RETRYABLE_ERRORS, RetryBudget, backoff_delay, retry_after_from
+from .timeouts import PhaseTimeouts, UpstreamTimeoutError, resolve_timeouts
+from .transports import create_mounts, create_transport, transport_stats
+from .upload import stream_upload
 
 logger = get_logger(__name__)
 
 
+class _ConnectTimer:
+    """httpx trace 回调: 记录新建连接的 TCP 建连 + TLS 握手耗时 (复用连接时不触发)"""
+
+    def __init__(self, pool: str) -> None:
+        self.pool = pool
+        self.started: float | None = None
+        self.duration: float | None = None
+        self._reported = False
+
+    async def __call__(self, event_name: str, info: dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self.started = time.perf_counter()
+        elif event_name == "connection.connect_tcp.failed":
+            metrics.inc("http_pool_connect_failed", pool=self.pool)
+        elif self.started is not None and event_name in (
+            "connection.connect_tcp.complete",
+            "connection.start_tls.complete",
+        ):
+            self.duration = time.perf_counter() - self.started
+        elif self.duration is not None and not self._reported:
+            # 连接建立完成后的第一个 HTTP 事件: 上报建连指标
+            self._reported = True
+            metrics.inc("http_pool_connections_opened", pool=self.pool)
+            metrics.observe("http_connect_ms", self.duration * 1000, pool=self.pool)
+
+
+def _phase_budget(
+    phase: str,
+    limit: float,
+    timeouts: PhaseTimeouts,
+    deadline: float,
+) -> tuple[str, float, float]:
+    """
+    计算某阶段实际可等待的时间
+
+    Returns:
+        (生效的阶段, 该阶段的超时配置, 实际等待秒数); 总时长剩余时间更短时阶段为 total
+    """
+    remaining = deadline - time.monotonic()
+    if remaining < limit:
+        return "total", timeouts.total, max(0.0, remaining)
+    return phase, limit, limit
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """
+    响应体流包装
+
+    - 流关闭时 (读完、出错或被取消) 执行一次 on_close 回调
+    - 支持预读第一个数据块, 预读的数据块在迭代时原样先行返回
+    - 数据块间隔超过 idle 超时或超过总时长截止时间时抛出 UpstreamTimeoutError
+    """
+
+    def __init__(
+        self,
+        stream: httpx.AsyncByteStream,
+        timeouts: PhaseTimeouts,
+        deadline: float,
+        request: httpx.Request,
+    ) -> None:
+        self._stream = stream
+        self._timeouts = timeouts
+        self._deadline = deadline
+        self._request = request
+        self._iterator: AsyncIterator[bytes] | None = None
+        self._first: bytes | None = None
+        self.on_close: Callable[[], None] | None = None
+
+    async def prefetch(self) -> None:
+        """预读第一个数据块 (流式响应的首个 SSE 事件)"""
+        self._iterator = self._stream.__aiter__()
+        try:
+            self._first = await self._next("first_event", self._timeouts.first_event)
+        except StopAsyncIteration:
+            self._first = None
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self._iterator is None:
+            self._iterator = self._stream.__aiter__()
+        if self._first is not None:
+            first, self._first = self._first, None
+            yield first
+        while True:
+            try:
+                chunk = await self._next("idle", self._timeouts.idle)
+            except StopAsyncIteration:
+                return
+            yield chunk
+
+    async def _next(self, phase: str, limit: float) -> bytes:
+        """读取下一个数据块, 超时时间取阶段超时与总时长剩余时间的较小值"""
+        assert self._iterator is not None
+        phase, limit, wait = _phase_budget(phase, limit, self._timeouts, self._deadline)
+        try:
+            async with asyncio.timeout(wait):
+                return await anext(self._iterator)
+        except TimeoutError as e:
+            metrics.inc("upstream_timeouts", phase=phase)
+            raise UpstreamTimeoutError(phase, limit, request=self._request) from e
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self.on_close is not None:
+                on_close, self.on_close = self.on_close, None
+                on_close()
+
+
+def _on_close(response: httpx.Response, callback: Callable[[], None]) -> None:
+    """在响应体关闭时 (已有回调之后) 执行回调"""
+    assert isinstance(response.stream, _TrackedStream)
+    previous = response.stream.on_close
+
+    def on_close() -> None:
+        if previous is not None:
+            previous()
+        callback()
+
+    response.stream.on_close = on_close
+
+
 class HTTPClient:
     """异步 HTTP 客户端 (单例,线程安全)"""
 
     _instance: "HTTPClient | None" = None
-    _client: httpx.AsyncClient | None = None
+    _clients: dict[str, httpx.AsyncClient]
+    _keepwarm_task: "asyncio.Task[None] | None" = None
+    _warm_stats: dict[str, dict[str, Any]]
+    _retry_budgets: dict[str, RetryBudget]
+    _hedge_budgets: dict[str, RetryBudget]
+    _limiters: dict[str, AdaptiveLimiter]
+    _background: set["asyncio.Future[None]"]
     _lock = Lock()
 
     def __new__(cls) -> "HTTPClient":
@@ -27,21 +171,37 @@ class HTTPClient:
             with cls._lock:
                 if cls._instance is None:
                     cls._instance = super().__new__(cls)
+                    cls._instance._clients = {}
+                    cls._instance._warm_stats = {}
+                    cls._instance._retry_budgets = {}
+                    cls._instance._hedge_budgets = {}
+                    cls._instance._limiters = {}
+                    cls._instance._background = set()
         return cls._instance
 
-    def __init__(self) -> None:
-        if self._client is None:
-            self._client = self._create_client()
+    def _create_client(self, pool: HTTPPoolConfig | None = None) -> httpx.AsyncClient:
+        """创建 HTTP 客户端实例 (一个实例对应一个独立连接池)"""
+        max_connections = settings.http_max_connections
+        max_keepalive = settings.http_max_keepalive
+        transport = settings.http_transport
+        stripes = settings.http_transport_stripes
+        if pool is not None:
+            max_connections = pool.max_connections or max_connections
+            max_keepalive = min(pool.max_keepalive or max_keepalive, max_connections)
+            transport = pool.transport or transport
+            stripes = pool.stripes or stripes
 
-    def _create_client(self) -> httpx.AsyncClient:
-        """创建 HTTP 客户端实例"""
+        options: dict[str, Any] = {
+            "stripes": stripes,
+            "max_connections": max_connections,
+            "max_keepalive": max_keepalive,
+            "keepalive_expiry": settings.http_keepalive_expiry,
+            "dns_cache": settings.dns_cache_enabled,
+        }
         return httpx.AsyncClient(
-            http2=True,  # 启用 HTTP/2
-            limits=httpx.Limits(
-                max_keepalive_connections=settings.http_max_keepalive,
-                max_connections=settings.http_max_connections,
-                keepalive_expiry=settings.http_keepalive_expiry,
-            ),
+            transport=create_transport(transport, **options),
+            # 显式指定 transport 时 httpx 不读取代理环境变量, 在此按环境变量挂载代理传输
+            mounts=create_mounts(transport, **options),
             timeout=httpx.Timeout(
                 timeout=settings.http_timeout,
                 connect=settings.http_connect_timeout,
@@ -51,22 +211,83 @@ class HTTPClient:
 
     @property
     def client(self) -> httpx.AsyncClient:
-        """获取客户端实例"""
-        if self._client is None:
-            self._client = self._create_client()
-        return self._client
+        """获取默认连接池的客户端实例 (不区分上游)"""
+        return self._get_client("default")
+
+    def select_pool(
+        self,
+        url: str,
+        model: str | None = None,
+        stream: bool | None = None,
+    ) -> str:
+        """
+        为请求选择连接池
+
+        匹配规则: 命名连接池中匹配条件最多者优先; 均不匹配时使用上游 origin 专属连接池
+
+        Args:
+            url: 请求 URL
+            model: 模型名 (可选)
+            stream: 是否为流式请求 (可选)
+
+        Returns:
+            连接池名称
+        """
+        best_name: str | None = None
+        best_score = -1
+        for name, pool in settings.http_pools.items():
+            score = 0
+            if pool.base_url is not None:
+                if not url.startswith(pool.base_url):
+                    continue
+                score += 1
+            if pool.models:
+                if model is None or not any(model.startswith(m) for m in pool.models):
+                    continue
+                score += 1
+            if pool.stream is not None:
+                if stream is None or pool.stream != stream:
+                    continue
+                score += 1
+            if score > best_score:
+                best_name, best_score = name, score
+
+        if best_name is not None:
+            return best_name
+
+        origin = httpx.URL(url)
+        return f"{origin.scheme}://{origin.netloc.decode('ascii')}"
+
+    def _get_client(self, pool_name: str) -> httpx.AsyncClient:
+        """获取 (必要时创建) 指定连接池的客户端"""
+        client = self._clients.get(pool_name)
+        if client is None or client.is_closed:
+            with self._lock:
+                client = self._clients.get(pool_name)
+                if client is None or client.is_closed:
+                    client = self._create_client(settings.http_pools.get(pool_name))
+                    self._clients[pool_name] = client
+                    logger.info("http_pool_created", pool=pool_name)
+        return client
 
     async def stream_request(
         self,
         method: str,
         url: str,
+        *,
+        upstream: UpstreamGroup | None = None,
+        model: str | None = None,
+        key_pool: KeyPool | None = None,
         **kwargs: Any,
     ) -> AsyncIterator[bytes]:
         """流式请求"""
         logger.info("stream_request_start", method=method, url=url)
 
         try:
-            async with self.client.stream(method, url, **kwargs) as response:
+            response = await self.open_stream(
+                method, url, upstream=upstream, model=model, key_pool=key_pool, **kwargs
+            )
+            try:
                 response.raise_for_status()
 
                 chunk_count = 0
@@ -77,16 +298,18 @@ class HTTPClient:
                 logger.info(
                     "stream_request_complete",
                     method=method,
-                    url=url,
+                    url=str(response.url),
                     chunks=chunk_count,
                     status=response.status_code,
                 )
+            finally:
+                await response.aclose()
 
         except httpx.HTTPStatusError as e:
             logger.error(
                 "stream_request_http_error",
                 method=method,
-                url=url,
+                url=str(e.request.url),
                 status=e.response.status_code,
                 error=str(e),
             )
@@ -96,23 +319,69 @@ class HTTPClient:
             logger.error("stream_request_error", method=method, url=url, error=str(e))
             raise
 
+    async def open_stream(
+        self,
+        method: str,
+        url: str,
+        *,
+        upstream: UpstreamGroup | None = None,
+        model: str | None = None,
+        key_pool: KeyPool | None = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        发起流式请求并返回已收到响应头的 Response
+
+        不检查状态码; 调用方负责读取响应体并调用 response.aclose() 释放连接
+
+        Args:
+            method: HTTP 方法
+            url: 请求 URL; 指定 upstream 时为相对路径 (如 "/v1/messages")
+            upstream: 上游组 (按负载均衡选择端点)
+            model: 模型名 (用于选择连接池)
+            key_pool: 租户上游 Key 池 (指定时用池中选出的 Key 替换请求头中的 Key)
+            **kwargs: 透传给 httpx.AsyncClient.build_request 的参数
+
+        Returns:
+            httpx.Response: 流式响应
+        """
+        return await self._send(
+            method, url, upstream=upstream, model=model, stream=True, key_pool=key_pool, **kwargs
+        )
+
     async def request(
         self,
         method: str,
         url: str,
+        *,
+        upstream: UpstreamGroup | None = None,
+        model: str | None = None,
+        key_pool: KeyPool | None = None,
         **kwargs: Any,
     ) -> httpx.Response:
-        """普通请求"""
+        """普通请求 (参数含义同 open_stream)"""
         logger.info("request_start", method=method, url=url)
 
         try:
-            response = await self.client.request(method, url, **kwargs)
+            response = await self._send(
+                method,
+                url,
+                upstream=upstream,
+                model=model,
+                stream=False,
+                key_pool=key_pool,
+                **kwargs,
+            )
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
             response.raise_for_status()
 
             logger.info(
                 "request_complete",
                 method=method,
-                url=url,
+                url=str(response.url),
                 status=response.status_code,
             )
 
@@ -122,7 +391,7 @@ class HTTPClient:
             logger.error(
                 "request_http_error",
                 method=method,
-                url=url,
+                url=str(e.request.url),
                 status=e.response.status_code,
                 error=str(e),
             )
@@ -132,13 +401,741 @@ class HTTPClient:
             logger.error("request_error", method=method, url=url, error=str(e))
             raise
 
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        *,
+        upstream: UpstreamGroup | None,
+        model: str | None,
+        stream: bool,
+        key_pool: KeyPool | None = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        发送请求直到收到响应头 (响应体未读取)
+
+        指定 key_pool 时先从池中选出上游 Key 替换请求头中的 Key, 该 Key 的在途计数
+        在响应体关闭时释放; 收到 429 的 Key 暂时移出轮换, 重试时换用池中另一个 Key
+
+        Raises:
+            RateLimitError: Key 池全部冷却、限流额度等待过长或并发排队超时 (429)
+        """
+        if key_pool is None:
+            return await self._send_limited(
+                method, url, upstream=upstream, model=model, stream=stream, **kwargs
+            )
+
+        lease = KeyLease(key_pool)
+        kwargs["headers"] = with_api_key(kwargs.get("headers"), lease.key.key)
+        started = time.perf_counter()
+        try:
+            response = await self._send_limited(
+                method, url, upstream=upstream, model=model, stream=stream, lease=lease, **kwargs
+            )
+        except Exception:
+            lease.release(None, None)
+            raise
+        except BaseException:
+            lease.key.finish(None)
+            raise
+
+        ttfb = time.perf_counter() - started
+        status = response.status_code
+        _on_close(response, lambda: lease.release(ttfb, status))
+        return response
+
+    async def _send_limited(
+        self,
+        method: str,
+        url: str,
+        *,
+        upstream: UpstreamGroup | None,
+        model: str | None,
+        stream: bool,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        发送请求直到收到响应头 (经过限流额度节流和并发限制)
+
+        请求先按 API Key 的限流额度节流 (额度耗尽时等待重置), 再在上游的自适应并发限制器中
+        获取许可 (必要时排队), 许可在响应体关闭时释放;
+        首字节耗时 (仅流式) 和过载信号 (网络错误 / 429 / 5xx) 用于调整并发上限
+
+        Raises:
+            RateLimitError: 限流额度等待过长, 或并发已达上限且排队超时 (429)
+        """
+        target = upstream.name if upstream is not None else self.select_pool(url, model, stream)
+        api_key = api_key_from_headers(kwargs.get("headers"))
+        await pacer.acquire(target, api_key)
+
+        limiter = self._limiter(target)
+        acquired = await limiter.acquire()
+        started = time.perf_counter()
+        try:
+            response = await self._send_encoded(
+                method,
+                url,
+                target=target,
+                upstream=upstream,
+                model=model,
+                stream=stream,
+                api_key=api_key,
+                **kwargs,
+            )
+        except Exception as e:
+            limiter.record(None, dropped=isinstance(e, httpx.TransportError))
+            limiter.release(acquired)
+            raise
+        except BaseException:
+            limiter.release(acquired)
+            raise
+
+        limiter.record(
+            time.perf_counter() - started if stream else None,
+            dropped=response.status_code == 429 or response.status_code >= 500,
+        )
+        _on_close(response, lambda: limiter.release(acquired))
+        return response
+
+    async def _send_encoded(
+        self, method: str, url: str, *, target: str, **kwargs: Any
+    ) -> httpx.Response:
+        """
+        发送请求直到收到响应头, 按上游配置编码 JSON 请求体
+
+        上游启用压缩时压缩请求体; 压缩请求被上游拒绝 (见 compressor.maybe_rejected) 时
+        以未压缩请求体重发一次, 重发成功才记录该上游不支持该编码。
+        未压缩的大请求体分块增量编码上传 (见 upload)
+        """
+        compressed = await compressor.compress(target, kwargs)
+        if compressed is None:
+            return await self._send_with_retry(
+                method, url, target=target, **stream_upload(kwargs)
+            )
+
+        encoding = compressed["headers"]["content-encoding"]
+        response = await self._send_with_retry(method, url, target=target, **compressed)
+        if not compressor.maybe_rejected(target, encoding, response.status_code):
+            if response.status_code < 400:
+                compressor.record(target, encoding, supported=True)
+            return response
+
+        await response.aclose()
+        response = await self._send_with_retry(
+            method, url, target=target, **stream_upload(kwargs)
+        )
+        if response.status_code < 400:
+            compressor.record(target, encoding, supported=False)
+        return response
+
+    async def _send_with_retry(
+        self,
+        method: str,
+        url: str,
+        *,
+        target: str,
+        upstream: UpstreamGroup | None,
+        model: str | None,
+        stream: bool,
+        api_key: str | None,
+        lease: KeyLease | None = None,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        发送请求直到收到响应头, 失败时重试
+
+        连接错误和可重试状态码 (settings.retry_statuses) 在此处重试:
+        此时还没有任何字节转发给客户端。多端点时每次重试重新选择端点并排除已失败的端点。
+        重试次数用尽、预算不足、retry-after 过长或超出总时长时, 返回最后一次响应或抛出最后一次错误。
+        响应头 / 首个 SSE 事件超时同样在此重试, 所有尝试共享同一个总时长截止时间。
+        使用租户 Key 池 (lease) 时, 收到 429 的 Key 移出轮换, 重试换用池中另一个 Key
+        (不等待该 Key 的 retry-after)
+        """
+        timeouts = resolve_timeouts(model)
+        deadline = time.monotonic() + timeouts.total
+        budget = self._retry_budget(target)
+        budget.deposit()
+        if upstream is not None and settings.hedge_enabled:
+            self._hedge_budget(target).deposit()
+
+        failed: list[Endpoint] = []
+        attempt = 0
+        while True:
+            attempt += 1
+            if lease is not None:
+                api_key = lease.key.key
+                kwargs["headers"] = with_api_key(kwargs.get("headers"), api_key)
+            result, used = await self._race(
+                method,
+                url,
+                upstream,
+                failed,
+                target=target,
+                model=model,
+                stream=stream,
+                timeouts=timeouts,
+                deadline=deadline,
+                **kwargs,
+            )
+
+            if isinstance(result, httpx.Response):
+                await pacer.observe(target, api_key, result)
+                if lease is not None and result.status_code == 429:
+                    lease.cool_down(retry_after_from(result))
+                if result.status_code not in settings.retry_statuses:
+                    outcome = "ok" if result.status_code < 400 else f"status_{result.status_code}"
+                    metrics.inc("upstream_attempts", upstream=target, outcome=outcome)
+                    return result
+                outcome = f"status_{result.status_code}"
+                retry_after = retry_after_from(result)
+            else:
+                outcome = type(result).__name__
+                retry_after = None
+            # 换用另一个 Key 重试时不等待收到 429 的 Key 的 retry-after
+            rotate = outcome == "status_429" and lease is not None and lease.can_rotate()
+            metrics.inc("upstream_attempts", upstream=target, outcome=outcome)
+
+            delay = backoff_delay(attempt, None if rotate else retry_after)
+            give_up_reason = self._give_up_reason(attempt, delay, deadline, budget)
+            metrics.gauge("upstream_retry_budget_tokens", round(budget.tokens, 2), upstream=target)
+
+            if give_up_reason is not None or delay is None:
+                if settings.retry_max_attempts > 1:
+                    metrics.inc("upstream_retry_given_up", upstream=target, reason=give_up_reason)
+                    logger.warning(
+                        "upstream_retry_given_up",
+                        upstream=target,
+                        attempts=attempt,
+                        reason=give_up_reason,
+                        outcome=outcome,
+                    )
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+            if isinstance(result, httpx.Response):
+                await result.aclose()
+            failed.extend(used)
+
+            metrics.inc("upstream_retries", upstream=target)
+            logger.warning(
+                "upstream_retry",
+                upstream=target,
+                attempt=attempt,
+                outcome=outcome,
+                delay=round(delay, 3),
+            )
+            await asyncio.sleep(delay)
+            if rotate and lease is not None:
+                lease.rotate()
+                await pacer.acquire(target, lease.key.key)
+
+    @staticmethod
+    def _give_up_reason(
+        attempt: int, delay: float | None, deadline: float, budget: RetryBudget
+    ) -> str | None:
+        """不再重试的原因 (可以重试时为 None, 此时从重试预算中扣除一次)"""
+        if attempt >= settings.retry_max_attempts:
+            return "max_attempts"
+        if delay is None:
+            return "retry_after_too_long"
+        if delay >= deadline - time.monotonic():
+            return "deadline"
+        if not budget.try_withdraw():
+            return "budget_exhausted"
+        return None
+
+    async def _race(
+        self,
+        method: str,
+        url: str,
+        upstream: UpstreamGroup | None,
+        exclude: list[Endpoint],
+        *,
+        target: str,
+        model: str | None,
+        stream: bool,
+        timeouts: PhaseTimeouts,
+        deadline: float,
+        **kwargs: Any,
+    ) -> tuple[httpx.Response | Exception, list[Endpoint]]:
+        """
+        发起一次 (可能对冲的) 尝试
+
+        首次尝试超过对冲延迟仍未返回时 (流式请求以首个 SSE 事件为准), 在对冲预算允许时
+        向另一端点发起对冲尝试, 采用先返回的非重试状态响应并取消另一个尝试
+
+        Returns:
+            (响应或可重试的网络错误, 本次使用的端点)
+        """
+        endpoint = upstream.pick(exclude=exclude) if upstream is not None else None
+        used = [endpoint] if endpoint is not None else []
+        primary = asyncio.create_task(
+            self._attempt(
+                method,
+                url,
+                upstream,
+                endpoint,
+                model=model,
+                stream=stream,
+                timeouts=timeouts,
+                deadline=deadline,
+                **kwargs,
+            )
+        )
+        tasks = {primary}
+        result: httpx.Response | Exception | None = None
+        try:
+            delay = self._hedge_delay(target, model, stream) if upstream is not None else None
+            if delay is not None and not (await asyncio.wait(tasks, timeout=delay))[0]:
+                hedge_endpoint = self._pick_hedge(target, upstream, [*exclude, *used])
+                if hedge_endpoint is not None:
+                    used.append(hedge_endpoint)
+                    tasks.add(
+                        asyncio.create_task(
+                            self._attempt(
+                                method,
+                                url,
+                                upstream,
+                                hedge_endpoint,
+                                model=model,
+                                stream=stream,
+                                timeouts=timeouts,
+                                deadline=deadline,
+                                **kwargs,
+                            )
+                        )
+                    )
+                    logger.info(
+                        "upstream_hedge_started",
+                        upstream=target,
+                        delay=round(delay, 3),
+                        primary=endpoint.base_url if endpoint else None,
+                        hedge=hedge_endpoint.base_url,
+                    )
+
+            pending = set(tasks)
+            while pending and not self._is_final(result):
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if self._is_final(result):
+                        break
+                    tasks.discard(task)
+                    if isinstance(result, httpx.Response):
+                        await result.aclose()
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        result = e
+                    if len(used) > 1 and task is not primary and self._is_final(result):
+                        metrics.inc("upstream_hedge_wins", upstream=target)
+        finally:
+            # 取消未被采用的尝试, 其已返回的响应在任务结束后关闭。
+            # 此处不等待任务结束: 外层被取消时 (如客户端断开) 再次 await 会被重复取消,
+            # 导致 httpcore 的连接清理被打断、连接泄漏
+            for task in tasks:
+                task.cancel()
+                task.add_done_callback(self._close_discarded)
+
+        assert result is not None
+        if isinstance(result, Exception) and not isinstance(result, RETRYABLE_ERRORS):
+            raise result
+        return result, used
+
+    def _close_discarded(self, task: "asyncio.Task[httpx.Response]") -> None:
+        """关闭未被采用的尝试返回的响应"""
+        if task.cancelled() or task.exception() is not None:
+            return
+        closing = asyncio.ensure_future(task.result().aclose())
+        self._background.add(closing)
+        closing.add_done_callback(self._background.discard)
+
+    @staticmethod
+    def _is_final(result: httpx.Response | Exception | None) -> bool:
+        """是否为可直接采用的结果 (非重试状态码的响应)"""
+        return isinstance(result, httpx.Response) and (
+            result.status_code not in settings.retry_statuses
+        )
+
+    def _hedge_delay(self, target: str, model: str | None, stream: bool) -> float | None:
+        """
+        对冲延迟
+
+        取同一上游 / 模型 / 流式类型的历史首字节耗时分位数, 并限制在
+        [hedge_min_delay, hedge_max_delay] 内; 未开启或样本不足时返回 None (不对冲)
+        """
+        if not settings.hedge_enabled:
+            return None
+        labels = {"upstream": target, "model": model or "-", "stream": stream}
+        if metrics.count("upstream_ttfb_ms", **labels) < settings.hedge_min_samples:
+            return None
+        ttfb_ms = metrics.quantile("upstream_ttfb_ms", settings.hedge_quantile, **labels)
+        if ttfb_ms is None:
+            return None
+        return min(settings.hedge_max_delay, max(settings.hedge_min_delay, ttfb_ms / 1000))
+
+    def _pick_hedge(
+        self,
+        target: str,
+        upstream: UpstreamGroup,
+        exclude: list[Endpoint],
+    ) -> Endpoint | None:
+        """选择对冲端点 (优先其他端点); 预算不足或无可用端点时返回 None"""
+        if not self._hedge_budget(target).try_withdraw():
+            metrics.inc("upstream_hedges_skipped", upstream=target, reason="budget_exhausted")
+            return None
+        try:
+            endpoint = upstream.pick(exclude=exclude)
+        except ProxyError:
+            metrics.inc("upstream_hedges_skipped", upstream=target, reason="no_endpoint")
+            return None
+        metrics.inc("upstream_hedges", upstream=target)
+        return endpoint
+
+    async def _attempt(
+        self,
+        method: str,
+        url: str,
+        upstream: UpstreamGroup | None,
+        endpoint: Endpoint | None,
+        *,
+        model: str | None,
+        stream: bool,
+        timeouts: PhaseTimeouts,
+        deadline: float,
+        **kwargs: Any,
+    ) -> httpx.Response:
+        """
+        单次请求尝试
+
+        指定端点时记录首字节耗时, 并在响应体关闭时释放端点的在途计数;
+        请求结果同时计入端点熔断器 (网络错误和 5xx 计为失败, 429 不计)。
+        流式请求的成功响应会预读第一个数据块, 首字节耗时以首个 SSE 事件为准,
+        预读阶段的网络错误与建连错误一样可以重试
+
+        Raises:
+            CircuitOpenError: 端点熔断器拒绝放行 (half-open 探测名额已满)
+        """
+        if endpoint is not None:
+            url = endpoint.url(url)
+
+        pool = self.select_pool(url, model=model, stream=stream)
+        client = self._get_client(pool)
+        request = client.build_request(
+            method,
+            url,
+            # 读超时由分阶段超时接管 (见 _open)
+            timeout=httpx.Timeout(
+                connect=timeouts.connect,
+                read=None,
+                write=timeouts.headers,
+                pool=timeouts.headers,
+            ),
+            extensions={"trace": _ConnectTimer(pool)},
+            **kwargs,
+        )
+        if upstream is None or endpoint is None:
+            return await self._open(
+                client, request, stream=stream, timeouts=timeouts, deadline=deadline
+            )
+
+        if not endpoint.breaker.acquire():
+            raise CircuitOpenError(upstream.name, retry_after=endpoint.breaker.retry_after())
+
+        upstream.begin(endpoint)
+        started = time.perf_counter()
+        try:
+            response = await self._open(
+                client, request, stream=stream, timeouts=timeouts, deadline=deadline
+            )
+        except Exception:
+            upstream.end(endpoint, None, ok=False)
+            endpoint.breaker.record(failed=True)
+            raise
+        except BaseException:
+            # 取消 (如客户端断开或对冲落败) 不计为端点失败
+            metrics.inc("upstream_cancelled", upstream=upstream.name)
+            upstream.end(endpoint, None, ok=True)
+            endpoint.breaker.release()
+            raise
+
+        ttfb = time.perf_counter() - started
+        ok = response.status_code < 500 and response.status_code != 429
+        # 非流式请求的首字节耗时包含完整生成时间, 不参与慢调用统计
+        endpoint.breaker.record(
+            failed=response.status_code >= 500,
+            latency=ttfb if stream else None,
+        )
+        if response.is_success:
+            metrics.observe(
+                "upstream_ttfb_ms",
+                ttfb * 1000,
+                upstream=upstream.name,
+                model=model or "-",
+                stream=stream,
+            )
+        assert isinstance(response.stream, _TrackedStream)
+        response.stream.on_close = lambda: upstream.end(endpoint, ttfb, ok)
+        return response
+
+    @staticmethod
+    async def _open(
+        client: httpx.AsyncClient,
+        request: httpx.Request,
+        *,
+        stream: bool,
+        timeouts: PhaseTimeouts,
+        deadline: float,
+    ) -> httpx.Response:
+        """
+        发送请求并等待响应头, 流式请求的成功响应预读第一个数据块
+
+        Raises:
+            UpstreamTimeoutError: 响应头 (headers) / 首个事件 (first_event) / 总时长 (total) 超时
+        """
+        phase, limit, wait = _phase_budget("headers", timeouts.headers, timeouts, deadline)
+        try:
+            async with asyncio.timeout(wait):
+                response = await client.send(request, stream=True)
+        except TimeoutError as e:
+            metrics.inc("upstream_timeouts", phase=phase)
+            raise UpstreamTimeoutError(phase, limit, request=request) from e
+
+        response.stream = _TrackedStream(response.stream, timeouts, deadline, request)
+        if stream and response.is_success:
+            try:
+                await response.stream.prefetch()
+            except BaseException:
+                await response.aclose()
+                raise
+        return response
+
+    def _retry_budget(self, target: str) -> RetryBudget:
+        """获取上游 (或连接池) 的重试预算"""
+        budget = self._retry_budgets.get(target)
+        if budget is None:
+            budget = self._retry_budgets.setdefault(
+                target,
+                RetryBudget(
+                    ratio=settings.retry_budget_ratio,
+                    min_per_second=settings.retry_budget_min_per_second,
+                    max_tokens=settings.retry_budget_max_tokens,
+                ),
+            )
+        return budget
+
+    def _limiter(self, target: str) -> AdaptiveLimiter:
+        """获取上游 (或连接池) 的自适应并发限制器"""
+        limiter = self._limiters.get(target)
+        if limiter is None:
+            limiter = self._limiters.setdefault(target, AdaptiveLimiter(target))
+        return limiter
+
+    def check_capacity(self, upstream: UpstreamGroup) -> None:
+        """
+        检查上游是否还能接受新请求 (流式响应开始前调用, 以便直接返回 429)
+
+        Raises:
+            RateLimitError: 并发已达上限且排队已满或预计排队超时
+        """
+        self._limiter(upstream.name).check()
+
+    def limiter_stats(self) -> dict[str, dict[str, Any]]:
+        """各上游并发限制器状态"""
+        return {name: limiter.to_dict() for name, limiter in self._limiters.items()}
+
+    def _hedge_budget(self, target: str) -> RetryBudget:
+        """获取上游的对冲预算 (与重试预算相同的令牌桶, 但没有最低补充速率)"""
+        budget = self._hedge_budgets.get(target)
+        if budget is None:
+            budget = self._hedge_budgets.setdefault(
+                target,
+                RetryBudget(
+                    ratio=settings.hedge_budget_ratio,
+                    min_per_second=0.0,
+                    max_tokens=settings.hedge_budget_max_tokens,
+                ),
+            )
+        return budget
+
+    async def ping(self, base_url: str) -> float:
+        """
+        对上游发送 HEAD 请求 (任何状态码均视为可达)
+
+        Returns:
+            耗时 (秒)
+
+        Raises:
+            httpx.RequestError: 上游不可达
+        """
+        pool = self.select_pool(base_url)
+        started = time.perf_counter()
+        await self._get_client(pool).head(base_url, extensions={"trace": _ConnectTimer(pool)})
+        return time.perf_counter() - started
+
+    async def prewarm(self, base_urls: list[str]) -> dict[str, dict[str, Any]]:
+        """
+        预热上游连接
+
+        在服务启动时为每个上游建立 http_prewarm_connections 个连接,
+        使首个真实请求无需承担 DNS + TCP + TLS + HTTP/2 握手开销
+
+        Args:
+            base_urls: 上游基础 URL 列表
+
+        Returns:
+            每个连接池的预热结果 (warm_connections, connect_ms, ...)
+        """
+        if settings.http_prewarm_connections <= 0:
+            return {}
+
+        try:
+            async with asyncio.timeout(settings.http_prewarm_timeout):
+                await self._warm_all(base_urls)
+        except TimeoutError:
+            logger.warning(
+                "http_client_prewarm_timeout",
+                timeout=settings.http_prewarm_timeout,
+            )
+
+        for pool, stats in self._warm_stats.items():
+            logger.info(
+                "http_client_prewarmed",
+                pool=pool,
+                base_url=stats.get("base_url"),
+                warm_connections=stats.get("warm_connections", 0),
+                connect_ms=stats.get("connect_ms"),
+                error=stats.get("error"),
+            )
+        return self._warm_stats
+
+    def start_keepwarm(self, base_urls: list[str]) -> None:
+        """
+        启动后台保活任务
+
+        每隔 http_keepwarm_interval 秒对上游发送轻量 HEAD 请求,
+        在 http_keepalive_expiry 到期之前刷新空闲连接
+        """
+        if settings.http_prewarm_connections <= 0 or self._keepwarm_task is not None:
+            return
+
+        self._keepwarm_task = asyncio.create_task(self._keepwarm_loop(base_urls))
+        logger.info(
+            "http_client_keepwarm_started",
+            interval=settings.http_keepwarm_interval,
+            upstreams=len(base_urls),
+        )
+
+    @property
+    def warm_stats(self) -> dict[str, dict[str, Any]]:
+        """最近一次预热/保活结果 (按连接池)"""
+        return self._warm_stats
+
+    async def _keepwarm_loop(self, base_urls: list[str]) -> None:
+        """保活循环 (直到 close() 取消)"""
+        while True:
+            await asyncio.sleep(settings.http_keepwarm_interval)
+            await self._warm_all(base_urls)
+            logger.debug(
+                "http_client_keepwarm_ping",
+                warm_connections={
+                    pool: stats.get("warm_connections", 0)
+                    for pool, stats in self._warm_stats.items()
+                },
+            )
+
+    def _warm_targets(self, base_urls: list[str]) -> list[tuple[str, str]]:
+        """列出需要预热的 (连接池, 上游 URL) 组合"""
+        targets: list[tuple[str, str]] = []
+        for url in base_urls:
+            pools = {self.select_pool(url)}
+            pools.update(
+                name
+                for name, pool in settings.http_pools.items()
+                if pool.base_url is None or url.startswith(pool.base_url)
+            )
+            targets.extend((pool, url) for pool in sorted(pools))
+        return targets
+
+    async def _warm_all(self, base_urls: list[str]) -> None:
+        """并发预热所有目标连接池"""
+        await asyncio.gather(
+            *(
+                self._warm(pool, url, settings.http_prewarm_connections)
+                for pool, url in self._warm_targets(base_urls)
+            )
+        )
+
+    async def _warm(self, pool: str, base_url: str, count: int) -> None:
+        """
+        并发发送 count 个 HEAD 请求
+
+        HTTP/1.1 下每个并发请求占用一个独立连接; HTTP/2 下会复用同一连接,
+        此时实际连接数为 1。任何状态码都视为成功 (只关心连接本身)
+        """
+        client = self._get_client(pool)
+        timers = [_ConnectTimer(pool) for _ in range(count)]
+        results = await asyncio.gather(
+            *(client.head(base_url, extensions={"trace": timer}) for timer in timers),
+            return_exceptions=True,
+        )
+
+        errors = [r for r in results if isinstance(r, BaseException)]
+        durations = [timer.duration * 1000 for timer in timers if timer.duration is not None]
+        self._warm_stats[pool] = {
+            "base_url": base_url,
+            "warm_connections": self._pool_stats(client)["connections"],
+            "connect_ms": round(max(durations), 2) if durations else None,
+            "new_connections": len(durations),
+            "error": str(errors[0]) if errors else None,
+            "warmed_at": time.time(),
+        }
+
+    def pool_stats(self) -> dict[str, dict[str, Any]]:
+        """
+        导出所有连接池的实时状态
+
+        Returns:
+            按连接池名称索引的统计:
+            - connections / active / idle: 连接占用
+            - queued: 等待空闲连接的请求数
+            - http2_streams: 每个 HTTP/2 连接上的活跃 stream 数
+            - opened_total / closed_total: 连接建立/关闭累计 (连接抖动)
+        """
+        stats: dict[str, dict[str, Any]] = {}
+        for name, client in list(self._clients.items()):
+            if client.is_closed:
+                continue
+            pool_stats = self._pool_stats(client)
+            opened = int(metrics.get_counter("http_pool_connections_opened", pool=name))
+            pool_stats["opened_total"] = opened
+            pool_stats["closed_total"] = max(0, opened - pool_stats["connections"])
+            pool_stats["connect_failed_total"] = int(
+                metrics.get_counter("http_pool_connect_failed", pool=name)
+            )
+            stats[name] = pool_stats
+        return stats
+
+    @staticmethod
+    def _pool_stats(client: httpx.AsyncClient) -> dict[str, Any]:
+        """读取连接池内部状态 (见 transports.transport_stats)"""
+        return transport_stats(client._transport)
+
     async def close(self) -> None:
         """关闭客户端 (线程安全)"""
+        if self._keepwarm_task is not None:
+            self._keepwarm_task.cancel()
+            self._keepwarm_task = None
+
         with self._lock:
-            if self._client is not None:
-                await self._client.aclose()
-                self._client = None
-                logger.info("http_client_closed")
+            clients = list(self._clients.values())
+            self._clients = {}
+
+        for client in clients:
+            await client.aclose()
+        if clients:
+            logger.info("http_client_closed", pools=len(clients))
 
     @classmethod
     def reset_instance(cls) -> None:
@@ -153,7 +1150,7 @@ class HTTPClient:
     def __del__(self) -> None:
         """析构函数,确保客户端被关闭"""
         # 注意: 在析构函数中不能使用 await,只能记录警告
-        if self._client is not None and not self._client.is_closed:
+        if any(not client.is_closed for client in self._clients.values()):
             logger.warning(
                 "http_client_not_closed",
                 message="HTTPClient was not properly closed before deletion",
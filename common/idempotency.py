@@ -0,0 +1,160 @@
+"""
+Idempotency-Key 支持
+
+CherryStudio 和内部脚本在客户端超时后会重试同一个请求, 此时原请求往往仍在上游生成,
+重试使上游成本和负载翻倍。请求携带 Idempotency-Key 头时 (按调用方 API Key 和路径隔离):
+- 首个请求在独立任务中执行, 响应 (流式响应的每个数据块) 边转发边记录
+- 原请求仍在进行时到达的重复请求挂到同一个上游响应上: 先重放已记录的数据, 再跟随实时数据
+- 原请求完成后 idempotency_ttl 秒内到达的重复请求直接返回记录的响应
+- 同一个 Key 携带不同请求体时返回 422
+
+失败的请求不保存 (抛出异常、状态码 >= 400 或流以 error 事件结束), 之后的重试会重新执行;
+已挂上的重复请求仍会收到相同的结果。所有客户端都断开后上游请求再保留
+idempotency_orphan_grace 秒, 等待客户端超时后的重试挂上, 仍无人挂上时取消。
+记录只保存在当前进程内, 多 worker 部署时落到其他 worker 的重复请求会重新执行
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from threading import Lock
+from typing import Any, ClassVar
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from .config import settings
+from .errors import IdempotencyKeyReusedError
+from .fanout import SharedResponse
+from .logger import get_logger
+from .metrics import metrics
+from .pacing import key_fingerprint
+from .spool import spooled
+
+logger = get_logger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "idempotent-replayed"
+
+
+class _Entry:
+    """一个 Idempotency-Key 对应的响应记录"""
+
+    __slots__ = ("expires", "fingerprint", "shared")
+
+    def __init__(self, fingerprint: str, shared: SharedResponse) -> None:
+        self.fingerprint = fingerprint  # 请求体摘要
+        self.shared = shared
+        self.expires = 0.0
+
+
+class IdempotencyStore:
+    """按 Idempotency-Key 记录和重放响应 (单例, 仅在事件循环内使用)"""
+
+    _instance: ClassVar["IdempotencyStore | None"] = None
+    _lock: ClassVar[Lock] = Lock()
+    _inflight: dict[tuple[str, str, str], _Entry]
+    _completed: "OrderedDict[tuple[str, str, str], _Entry]"
+    _stored_bytes: int
+
+    def __new__(cls) -> "IdempotencyStore":
+        # 双重检查锁定
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._inflight = {}
+                    cls._instance._completed = OrderedDict()
+                    cls._instance._stored_bytes = 0
+        return cls._instance
+
+    async def handle(
+        self,
+        request: Request,
+        api_key: str,
+        call: Callable[[], Awaitable[Response | Any]],
+    ) -> Response | Any:
+        """
+        执行请求 (携带 Idempotency-Key 时去重)
+
+        Args:
+            request: 客户端请求
+            api_key: 调用方 API Key (Key 按调用方隔离)
+            call: 实际执行请求, 返回 Response 或可 JSON 序列化的响应体
+
+        Returns:
+            未携带 Idempotency-Key 时为 call 的返回值, 否则为 Response
+
+        Raises:
+            IdempotencyKeyReusedError: 同一个 Key 携带不同请求体
+        """
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not settings.idempotency_enabled or not idempotency_key:
+            return await call()
+
+        key = (key_fingerprint(api_key), request.url.path, idempotency_key)
+        # 落盘的请求体已经读取完毕 (不能再 await request.body()), 使用落盘时的摘要
+        spooled_body = spooled(request)
+        if spooled_body is not None:
+            digest = spooled_body.digest()
+        else:
+            digest = hashlib.sha256(await request.body()).hexdigest()
+        self._purge()
+
+        entry = self._inflight.get(key) or self._completed.get(key)
+        if entry is not None and entry.fingerprint != digest:
+            metrics.inc("idempotency", path=request.url.path, result="conflict")
+            raise IdempotencyKeyReusedError()
+
+        if entry is None:
+            shared = SharedResponse(
+                call,
+                orphan_grace=settings.idempotency_orphan_grace,
+                on_done=lambda shared: self._finish(key, shared),
+                name="idempotency",
+            )
+            self._inflight[key] = _Entry(digest, shared)
+            metrics.inc("idempotency", path=request.url.path, result="new")
+            return await shared.response()
+
+        result = "replayed" if entry.shared.complete else "attached"
+        metrics.inc("idempotency", path=request.url.path, result=result)
+        logger.info("idempotent_request", path=request.url.path, result=result)
+        return await entry.shared.response({REPLAYED_HEADER: "true"})
+
+    def _finish(self, key: tuple[str, str, str], shared: SharedResponse) -> None:
+        """原请求结束: 成功的响应保存 idempotency_ttl 秒"""
+        entry = self._inflight.get(key)
+        if entry is None or entry.shared is not shared:
+            return
+        del self._inflight[key]
+        if not shared.succeeded or shared.size > settings.idempotency_max_bytes:
+            return
+
+        entry.expires = time.monotonic() + settings.idempotency_ttl
+        self._completed[key] = entry
+        self._stored_bytes += shared.size
+        self._purge()
+
+    def _purge(self) -> None:
+        """清理过期记录, 总大小超过 idempotency_max_bytes 时淘汰最早的记录"""
+        now = time.monotonic()
+        while self._completed:
+            key, entry = next(iter(self._completed.items()))
+            if entry.expires > now and self._stored_bytes <= settings.idempotency_max_bytes:
+                break
+            del self._completed[key]
+            self._stored_bytes -= entry.shared.size
+        metrics.gauge("idempotency_stored_bytes", self._stored_bytes)
+
+    def stats(self) -> dict[str, int]:
+        """进行中 / 已保存的记录数"""
+        return {
+            "inflight": len(self._inflight),
+            "stored": len(self._completed),
+            "stored_bytes": self._stored_bytes,
+        }
+
+
+# 全局 Idempotency-Key 记录实例
+idempotency = IdempotencyStore()
@@ -0,0 +1,274 @@
+"""
+上游 API Key 池
+
+内部租户使用服务端配置的一组上游 Key, 而不是直接把调用方的 Key 转发给上游:
+调用方携带租户 Key (client_keys 之一) 时, 代理从该租户的上游 Key 池中为每个请求选择一个 Key:
+- 优先选择限流额度余量最多 (pacing 记录的剩余请求数占比)、在途请求 (含流式) 最少的 Key
+- 收到 429 的 Key 暂时移出轮换 (retry-after 或 key_pool_cooldown 秒), 全部冷却时返回 429
+- 需要等待额度重置的 Key 排在最后
+
+单个热点 Key 不再限制整个团队的吞吐; 每个 Key 的吞吐和延迟通过 /stats 查看
+"""
+import hashlib
+import hmac
+import time
+from collections import deque
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from .config import KeyPoolConfig, settings
+from .errors import RateLimitError
+from .logger import get_logger
+from .metrics import metrics
+from .pacing import key_fingerprint, pacer
+
+logger = get_logger(__name__)
+
+# 吞吐统计窗口 (秒)
+_THROUGHPUT_WINDOW = 60.0
+
+
+class PooledKey:
+    """池中的单个上游 Key 及其实时状态"""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.key_id = key_fingerprint(key)
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0  # monotonic 时间
+        self.ewma_ttfb: float | None = None  # 首字节耗时 EWMA (秒)
+        self._completed: deque[float] = deque()  # 最近完成的请求时间 (用于计算吞吐)
+
+    def finish(self, ttfb: float | None) -> None:
+        """请求结束, 记录首字节耗时样本 (None 表示不记录)"""
+        self.inflight = max(0, self.inflight - 1)
+        self._completed.append(time.monotonic())
+        if ttfb is None:
+            return
+        if self.ewma_ttfb is None:
+            self.ewma_ttfb = ttfb
+        else:
+            alpha = settings.lb_ewma_alpha
+            self.ewma_ttfb = (1 - alpha) * self.ewma_ttfb + alpha * ttfb
+
+    def cooling(self, now: float) -> float:
+        """剩余冷却时间 (秒)"""
+        return max(0.0, self.cooldown_until - now)
+
+    def throughput(self, now: float) -> float:
+        """最近一分钟完成的请求数"""
+        cutoff = now - _THROUGHPUT_WINDOW
+        while self._completed and self._completed[0] < cutoff:
+            self._completed.popleft()
+        return float(len(self._completed))
+
+    def to_dict(self, upstream: str) -> dict[str, Any]:
+        now = time.monotonic()
+        state = pacer.state(upstream, self.key)
+        return {
+            "key_id": self.key_id,
+            "inflight": self.inflight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "requests_per_minute": self.throughput(now),
+            "ewma_ttfb_ms": round(self.ewma_ttfb * 1000, 2) if self.ewma_ttfb is not None else None,
+            "cooldown_seconds": round(self.cooling(now), 2),
+            "requests_remaining": state.requests_remaining if state is not None else None,
+            "tokens_remaining": state.tokens_remaining if state is not None else None,
+        }
+
+
+class KeyPool:
+    """单个租户的上游 Key 池 (仅在事件循环内使用, 无需加锁)"""
+
+    def __init__(self, tenant: str, upstream: str, keys: Iterable[str]) -> None:
+        self.tenant = tenant
+        self.upstream = upstream
+        self.keys = [PooledKey(key) for key in keys]
+        if not self.keys:
+            raise ValueError(f"Key pool '{tenant}' has no upstream keys")
+
+    def check_available(self) -> None:
+        """
+        检查是否有未冷却的 Key (流式响应开始前调用, 以便直接返回 429)
+
+        Raises:
+            RateLimitError: 所有 Key 均在冷却中
+        """
+        now = time.monotonic()
+        if all(key.cooling(now) > 0 for key in self.keys):
+            raise self._exhausted(now)
+
+    def acquire(self) -> PooledKey:
+        """
+        选择一个 Key 并计入在途请求
+
+        按 (需要等待额度重置, -额度余量 / (在途请求数 + 1)) 排序选择
+
+        Raises:
+            RateLimitError: 所有 Key 均在冷却中
+        """
+        now = time.monotonic()
+        candidates = [key for key in self.keys if key.cooling(now) <= 0]
+        if not candidates:
+            raise self._exhausted(now)
+
+        best = min(candidates, key=self._score)
+        best.inflight += 1
+        best.requests += 1
+        return best
+
+    def release(self, key: PooledKey, ttfb: float | None, status: int | None) -> None:
+        """
+        请求结束 (响应体关闭或请求失败)
+
+        Args:
+            key: acquire 返回的 Key
+            ttfb: 首字节耗时 (秒), 未收到响应时为 None
+            status: 上游状态码, 网络错误时为 None
+        """
+        key.finish(ttfb if status is not None and status < 400 else None)
+        if status is None or status >= 500:
+            key.failures += 1
+        metrics.inc(
+            "key_pool_requests",
+            tenant=self.tenant,
+            key_id=key.key_id,
+            outcome="error" if status is None else f"status_{status}",
+        )
+
+    def cool_down(self, key: PooledKey, retry_after: float | None) -> None:
+        """Key 收到 429: 暂时移出轮换"""
+        seconds = retry_after if retry_after is not None else settings.key_pool_cooldown
+        key.rate_limited += 1
+        key.cooldown_until = max(key.cooldown_until, time.monotonic() + seconds)
+        metrics.inc("key_pool_cooldowns", tenant=self.tenant, key_id=key.key_id)
+        logger.warning(
+            "key_pool_cooldown",
+            tenant=self.tenant,
+            upstream=self.upstream,
+            key_id=key.key_id,
+            seconds=round(seconds, 2),
+        )
+
+    def _score(self, key: PooledKey) -> tuple[bool, float]:
+        """排序键 (越小越优先)"""
+        headroom = 1.0
+        waiting = False
+        state = pacer.state(self.upstream, key.key)
+        if state is not None:
+            waiting = state.wait_time(time.time())[0] > 0
+            if state.requests_remaining is not None and state.requests_limit:
+                headroom = max(0.0, state.requests_remaining / state.requests_limit)
+        return waiting, -headroom / (key.inflight + 1)
+
+    def _exhausted(self, now: float) -> RateLimitError:
+        retry_after = min(key.cooling(now) for key in self.keys)
+        metrics.inc("key_pool_exhausted", tenant=self.tenant)
+        return RateLimitError(
+            self.upstream,
+            retry_after=retry_after,
+            message=f"All upstream keys of tenant '{self.tenant}' are rate limited",
+        )
+
+    def stats(self) -> list[dict[str, Any]]:
+        """各 Key 状态 (Key 以指纹展示)"""
+        return [key.to_dict(self.upstream) for key in self.keys]
+
+
+class KeyLease:
+    """单个请求当前使用的池中 Key (上游返回 429 后重试时换用另一个 Key)"""
+
+    def __init__(self, pool: KeyPool) -> None:
+        self.pool = pool
+        self.key = pool.acquire()
+
+    def cool_down(self, retry_after: float | None) -> None:
+        """当前 Key 收到 429: 暂时移出轮换"""
+        self.pool.cool_down(self.key, retry_after)
+
+    def can_rotate(self) -> bool:
+        """是否有其他未冷却的 Key 可供重试"""
+        now = time.monotonic()
+        return any(key.cooling(now) <= 0 for key in self.pool.keys if key is not self.key)
+
+    def rotate(self) -> None:
+        """释放收到 429 的当前 Key, 换用池中另一个 Key (全部冷却时继续使用当前 Key)"""
+        if not self.can_rotate():
+            return
+        previous, self.key = self.key, self.pool.acquire()
+        self.pool.release(previous, None, 429)
+
+    def release(self, ttfb: float | None, status: int | None) -> None:
+        """请求结束, 释放当前 Key"""
+        self.pool.release(self.key, ttfb, status)
+
+
+class KeyPools:
+    """一个上游的全部租户 Key 池, 按调用方 Key 查找"""
+
+    def __init__(self, upstream: str, configs: dict[str, KeyPoolConfig]) -> None:
+        self.upstream = upstream
+        self.pools = {
+            tenant: KeyPool(tenant, upstream, config.upstream_keys)
+            for tenant, config in configs.items()
+        }
+        # 调用方 Key 摘要 -> 租户 (不在内存中按明文比较)
+        self._clients = {
+            _client_digest(client_key): tenant
+            for tenant, config in configs.items()
+            for client_key in config.client_keys
+        }
+        _registry[upstream] = self
+
+    def for_client(self, api_key: str) -> KeyPool | None:
+        """
+        查找调用方 Key 对应的租户 Key 池
+
+        Returns:
+            租户 Key 池; 调用方不是内部租户时返回 None (直接转发调用方的 Key)
+        """
+        digest = _client_digest(api_key)
+        for known, tenant in self._clients.items():
+            if hmac.compare_digest(known, digest):
+                return self.pools[tenant]
+        return None
+
+    def stats(self) -> dict[str, list[dict[str, Any]]]:
+        return {tenant: pool.stats() for tenant, pool in self.pools.items()}
+
+
+def _client_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+def with_api_key(headers: Mapping[str, str] | None, api_key: str) -> dict[str, str]:
+    """
+    替换请求头中的 API Key (x-api-key 或 Authorization: Bearer, 保留原有的头名称)
+
+    请求头中没有 API Key 时添加 Authorization 头
+    """
+    result = dict(headers or {})
+    for name in result:
+        lowered = name.lower()
+        if lowered == "x-api-key":
+            result[name] = api_key
+            return result
+        if lowered == "authorization":
+            result[name] = f"Bearer {api_key}"
+            return result
+    result["authorization"] = f"Bearer {api_key}"
+    return result
+
+
+# 已创建的 Key 池 (供 /stats 端点展示)
+_registry: dict[str, KeyPools] = {}
+
+
+def get_key_pools() -> dict[str, KeyPools]:
+    """获取所有上游的租户 Key 池"""
+    return _registry
@@ -0,0 +1,247 @@
+"""
+进程内存预算
+
+http_max_connections=200 且不限制请求体大小时, 一批大对话请求同时到达就可能让 worker 超出
+容器内存 (docker-compose.yml 中为 512MB) 被 OOM kill, 该 worker 上的所有流同时中断。
+MemoryBudgetMiddleware 按进程统计在途请求 / 响应体占用的内存, 并在读取请求体之前准入:
+- 请求按声明的 Content-Length 预留: 内存中处理的请求体 × memory_budget_body_factor
+  (原始字节、解析结果和上游编码同时存在), 落盘的请求体 (见 spool) × 1; 至少预留
+  memory_budget_min_request, 最多预留整个预算
+- 声明大小超过 memory_budget_max_request 的请求直接返回 413, 不读取请求体
+- 预算不足时进入有界 FIFO 队列, 等待其他请求释放; 队列已满或等待超过
+  memory_budget_queue_timeout 时返回 503 + retry-after
+- 未声明 Content-Length (chunked) 的请求体按实际接收的字节计入, 响应体按 Content-Length
+  (流式响应按正在写出的块) 计入; 这两部分只统计, 不阻塞
+- Idempotency-Key 去重和相同请求合并缓存的共享上游响应 (见 fanout) 按已记录的字节计入
+  (shared, 同样只统计不阻塞), 上游响应结束且没有客户端仍在读取时释放; 之后保存在
+  idempotency 中等待重放的响应由 idempotency_max_bytes 单独限制, 不计入预算
+- 不带请求体的请求 (GET /health 等) 不经过准入
+- 排队期间不读取请求体, 客户端在排队时断开要到放行 (或排队超时) 后才会发现
+注意: 每个 gunicorn worker 独立统计
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .codec import CompactJSONResponse
+from .config import settings
+from .errors import ProxyError, RequestTooLargeError, ServiceUnavailableError
+from .logger import get_logger
+from .metrics import metrics
+
+logger = get_logger(__name__)
+
+# 需要准入的请求方法 (带请求体)
+_BODY_METHODS = ("POST", "PUT", "PATCH")
+
+# 预算不足被拒绝时建议的重试间隔 (秒)
+_RETRY_AFTER = 1.0
+
+
+class MemoryBudget:
+    """在途请求 / 响应体的内存预算 (仅在事件循环内使用, 无需加锁)"""
+
+    def __init__(self) -> None:
+        self.usage = {"request": 0, "response": 0, "shared": 0}  # 已计入的字节
+        self.peak = 0
+        self._queue: deque[tuple[int, asyncio.Future[None]]] = deque()
+
+    @property
+    def used(self) -> int:
+        return sum(self.usage.values())
+
+    def reservation(self, content_length: int | None) -> int:
+        """
+        请求的预留字节数
+
+        Args:
+            content_length: 声明的请求体大小 (未声明时为 None, 实际接收的字节另行计入)
+        """
+        if content_length is None:
+            size = 0
+        elif 0 < settings.request_spool_threshold < content_length:
+            size = content_length
+        else:
+            size = int(content_length * settings.memory_budget_body_factor)
+        return min(max(size, settings.memory_budget_min_request), settings.memory_budget_bytes)
+
+    async def acquire(self, size: int, path: str) -> None:
+        """
+        预留 size 字节, 预算不足时排队等待
+
+        Raises:
+            ServiceUnavailableError: 队列已满或排队超时
+        """
+        if not self._queue and self.used + size <= settings.memory_budget_bytes:
+            self.charge("request", size)
+            self._report()
+            return
+
+        if len(self._queue) >= settings.memory_budget_max_queue:
+            raise self._reject("queue_full", size, path)
+
+        started = time.monotonic()
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        entry = (size, future)
+        self._queue.append(entry)
+        self._report()
+        try:
+            async with asyncio.timeout(settings.memory_budget_queue_timeout):
+                await future
+        except BaseException as e:
+            if future.done() and not future.cancelled():
+                # 预留已转交但任务同时被取消 / 超时: 归还
+                self.release("request", size)
+            else:
+                # 同时超时的其他排队请求可能已在 _wake 中把本条目 (future 已取消) 移出队列
+                future.cancel()
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                self._wake()
+            self._report()
+            if isinstance(e, TimeoutError):
+                raise self._reject("queue_timeout", size, path) from None
+            raise
+
+        metrics.observe("memory_budget_queue_ms", (time.monotonic() - started) * 1000)
+        self._report()
+
+    def charge(self, kind: str, size: int) -> None:
+        """计入 size 字节 (不检查预算)"""
+        self.usage[kind] += size
+        self.peak = max(self.peak, self.used)
+
+    def release(self, kind: str, size: int) -> None:
+        """释放 size 字节, 并放行能够容纳的排队请求"""
+        self.usage[kind] -= size
+        if self._queue:
+            self._wake()
+
+    def finish(self, charged: dict[str, int]) -> None:
+        """请求结束, 释放计入的全部字节"""
+        for kind, size in charged.items():
+            self.release(kind, size)
+        self._report()
+
+    def _wake(self) -> None:
+        """按到达顺序放行 (队首放不下时后面的请求也继续等待, 避免大请求饿死)"""
+        while self._queue:
+            size, future = self._queue[0]
+            if future.done():
+                self._queue.popleft()
+                continue
+            if self.used + size > settings.memory_budget_bytes:
+                return
+            self._queue.popleft()
+            self.charge("request", size)
+            future.set_result(None)
+
+    def _reject(self, reason: str, size: int, path: str) -> ServiceUnavailableError:
+        """记录拒绝并构建 503 错误"""
+        metrics.inc("memory_budget_rejected", reason=reason)
+        logger.warning(
+            "memory_budget_rejected",
+            reason=reason,
+            path=path,
+            reservation=size,
+            used=self.used,
+            budget=settings.memory_budget_bytes,
+            queued=len(self._queue),
+        )
+        return ServiceUnavailableError(
+            "memory_budget",
+            retry_after=_RETRY_AFTER,
+            message="Server is at its in-flight memory budget, please retry later",
+        )
+
+    def _report(self) -> None:
+        for kind, size in self.usage.items():
+            metrics.gauge("memory_inflight_bytes", size, kind=kind)
+        metrics.gauge("memory_budget_queued", len(self._queue))
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": settings.memory_budget_enabled,
+            "budget": settings.memory_budget_bytes,
+            "used": self.used,
+            "request": self.usage["request"],
+            "response": self.usage["response"],
+            "shared": self.usage["shared"],
+            "peak": self.peak,
+            "queued": len(self._queue),
+        }
+
+
+class MemoryBudgetMiddleware:
+    """按内存预算准入请求 (纯 ASGI 中间件, 在读取请求体之前执行)"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or not settings.memory_budget_enabled
+            or scope["method"] not in _BODY_METHODS
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        path = scope.get("path", "")
+        length = Headers(scope=scope).get("content-length", "")
+        declared = int(length) if length.isdigit() else None
+        reserved = memory_budget.reservation(declared)
+        try:
+            if declared is not None and declared > settings.memory_budget_max_request:
+                metrics.inc("memory_budget_rejected", reason="too_large")
+                logger.warning("request_too_large", path=path, size=declared)
+                raise RequestTooLargeError(declared, settings.memory_budget_max_request)
+            await memory_budget.acquire(reserved, path)
+        except ProxyError as e:
+            response = CompactJSONResponse(
+                {"detail": e.to_dict()}, status_code=e.status_code, headers=e.headers or None
+            )
+            await response(scope, receive, send)
+            return
+
+        charged = {"request": reserved, "response": 0}
+        streaming = True  # 响应未声明 Content-Length 时按正在写出的块计入
+
+        async def wrapped_receive() -> Message:
+            message = await receive()
+            if declared is None and message["type"] == "http.request":
+                size = len(message.get("body", b""))
+                memory_budget.charge("request", size)
+                charged["request"] += size
+            return message
+
+        async def wrapped_send(message: Message) -> None:
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                length = Headers(raw=message.get("headers", [])).get("content-length", "")
+                if length.isdigit():
+                    streaming = False
+                    memory_budget.charge("response", int(length))
+                    charged["response"] += int(length)
+            elif message["type"] == "http.response.body" and streaming:
+                size = len(message.get("body", b""))
+                memory_budget.charge("response", size)
+                try:
+                    await send(message)
+                finally:
+                    memory_budget.release("response", size)
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, wrapped_receive, wrapped_send)
+        finally:
+            memory_budget.finish(charged)
+
+
+# 全局内存预算实例
+memory_budget = MemoryBudget()
@@ -0,0 +1,138 @@
+"""
+进程内指标
+
+提供计数器 / 仪表 / 摘要三类指标, 通过服务的 /stats 端点查看快照
+注意: 每个 gunicorn worker 独立计数, 快照只反映当前 worker
+"""
+from collections import deque
+from threading import Lock
+from typing import Any, ClassVar
+
+# 摘要指标保留的最近样本数 (用于计算分位数)
+_SUMMARY_WINDOW = 1024
+
+
+def _metric_key(name: str, labels: dict[str, Any]) -> str:
+    """生成指标键: name{k1=v1,k2=v2}"""
+    if not labels:
+        return name
+    rendered = ",".join(f"{key}={labels[key]}" for key in sorted(labels))
+    return f"{name}{{{rendered}}}"
+
+
+class _Summary:
+    """摘要指标 (count / sum / max + 最近样本分位数)"""
+
+    __slots__ = ("count", "max", "samples", "total")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: deque[float] = deque(maxlen=_SUMMARY_WINDOW)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float | None:
+        """最近样本的分位数 (样本为空时返回 None)"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+    def to_dict(self) -> dict[str, float | int | None]:
+        p50 = self.quantile(0.5)
+        p99 = self.quantile(0.99)
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "max": round(self.max, 3),
+            "p50": round(p50, 3) if p50 is not None else None,
+            "p99": round(p99, 3) if p99 is not None else None,
+        }
+
+
+class Metrics:
+    """指标注册表 (单例,线程安全)"""
+
+    _instance: ClassVar["Metrics | None"] = None
+    _lock: ClassVar[Lock] = Lock()
+    _counters: dict[str, float]
+    _gauges: dict[str, float]
+    _summaries: dict[str, _Summary]
+
+    def __new__(cls) -> "Metrics":
+        # 双重检查锁定
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._counters = {}
+                    cls._instance._gauges = {}
+                    cls._instance._summaries = {}
+        return cls._instance
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """计数器累加"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels: Any) -> None:
+        """设置仪表值"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """记录摘要样本 (如耗时毫秒)"""
+        key = _metric_key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary()
+            summary.observe(value)
+
+    def get_counter(self, name: str, **labels: Any) -> float:
+        """读取计数器当前值"""
+        return self._counters.get(_metric_key(name, labels), 0)
+
+    def count(self, name: str, **labels: Any) -> int:
+        """读取摘要指标的样本总数"""
+        summary = self._summaries.get(_metric_key(name, labels))
+        return summary.count if summary is not None else 0
+
+    def quantile(self, name: str, q: float, **labels: Any) -> float | None:
+        """读取摘要指标的分位数"""
+        summary = self._summaries.get(_metric_key(name, labels))
+        if summary is None:
+            return None
+        with self._lock:
+            return summary.quantile(q)
+
+    def snapshot(self) -> dict[str, Any]:
+        """导出全部指标快照"""
+        with self._lock:
+            return {
+                "counters": dict(sorted(self._counters.items())),
+                "gauges": dict(sorted(self._gauges.items())),
+                "summaries": {
+                    key: summary.to_dict() for key, summary in sorted(self._summaries.items())
+                },
+            }
+
+    def reset(self) -> None:
+        """清空全部指标 (测试用)"""
+        with self._lock:
+            self._counters = {}
+            self._gauges = {}
+            self._summaries = {}
+
+
+# 全局指标实例
+metrics = Metrics()
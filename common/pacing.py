@@ -0,0 +1,505 @@
+"""
+上游限流响应头驱动的请求节流 (pacing)
+
+上游 (及中转) 在响应头中返回每个 API Key 的剩余额度:
+- Anthropic: anthropic-ratelimit-{requests,tokens,input-tokens,output-tokens}-{remaining,reset}
+  (reset 为 RFC 3339 时间)
+- OpenAI: x-ratelimit-remaining-{requests,tokens} / x-ratelimit-reset-{requests,tokens}
+  (reset 为 "1s" / "6m0s" / "20ms" 形式的时长)
+- 429 响应的 retry-after / retry-after-ms
+
+RateLimitPacer 按 (上游, API Key) 记录剩余请求数 / token 数及重置时间。发送请求前检查额度:
+额度耗尽时在本地等待到重置时间, 而不是发出一个必然返回 429 的请求; 需要等待的时间超过
+pacing_max_wait 时直接返回 429 + retry-after。额度按 Key 独立, 额度耗尽的 Key 上的请求
+原地等待, 其他 Key 的请求照常放行
+
+状态保存在本机 SQLite 文件中 (默认位于 /dev/shm), 所有 gunicorn worker 共享同一份额度视图;
+放行请求时在事务中原子地扣减剩余请求数, 避免多个 worker 同时用掉最后一个额度。
+SQLite 读写在线程池中执行, 不阻塞事件循环; 每次放行 / 更新后的状态同时缓存在进程内,
+供 Key 池排序等只读场景使用 (不查询 SQLite)。只有需要扣减剩余请求数时才开启写事务;
+上游响应不带限流响应头的 Key 之后直接放行 (不查询 SQLite, 直到再次收到限流响应头)。
+存储不可用时直接放行 (fail open)
+"""
+import asyncio
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Lock
+from typing import Any, ClassVar
+
+import httpx
+
+from .config import settings
+from .errors import RateLimitError
+from .logger import get_logger
+from .metrics import metrics
+from .retry import retry_after_from
+
+logger = get_logger(__name__)
+
+# SQLite 写锁等待上限 (秒): 节流是优化手段, 拿不到锁时宁可放行也不阻塞事件循环
+_BUSY_TIMEOUT = 0.05
+
+# 额度按 limit 恢复后, 在响应头给出真实重置时间之前暂定的重置间隔 (秒)
+_PROVISIONAL_RESET = 1.0
+
+# 超过该时长 (秒) 未更新的额度状态不再展示
+_STATS_MAX_AGE = 3600
+
+# 进程内缓存的额度状态上限 (按 (上游, API Key) 计; 超出时淘汰最早更新的)
+_MAX_CACHED_STATES = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ratelimit (
+    upstream TEXT NOT NULL,
+    key_id TEXT NOT NULL,
+    requests_limit INTEGER,
+    requests_remaining INTEGER,
+    requests_reset REAL,
+    tokens_remaining INTEGER,
+    tokens_reset REAL,
+    blocked_until REAL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (upstream, key_id)
+)
+"""
+
+_COLUMNS = (
+    "requests_limit",
+    "requests_remaining",
+    "requests_reset",
+    "tokens_remaining",
+    "tokens_reset",
+    "blocked_until",
+)
+
+# token 额度相关的响应头前缀 (取其中剩余量最小的一组)
+_TOKEN_HEADER_PREFIXES = (
+    "anthropic-ratelimit-tokens",
+    "anthropic-ratelimit-input-tokens",
+    "anthropic-ratelimit-output-tokens",
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+
+@dataclass
+class RateLimitState:
+    """单个 (上游, API Key) 的额度状态, 时间均为 Unix 时间戳"""
+
+    requests_limit: int | None = None
+    requests_remaining: int | None = None
+    requests_reset: float | None = None
+    tokens_remaining: int | None = None
+    tokens_reset: float | None = None
+    blocked_until: float | None = None  # 429 retry-after 截止时间
+
+    def wait_time(self, now: float) -> tuple[float, str | None]:
+        """
+        放行前需要等待的时间
+
+        剩余额度为 0 但重置时间未知或已过期时视为额度已恢复
+
+        Returns:
+            (等待秒数, 原因: retry_after / requests / tokens); 无需等待时为 (0, None)
+        """
+        waits: list[tuple[float, str]] = []
+        if self.blocked_until is not None and self.blocked_until > now:
+            waits.append((self.blocked_until - now, "retry_after"))
+        if (
+            self.requests_remaining is not None
+            and self.requests_remaining <= 0
+            and self.requests_reset is not None
+            and self.requests_reset > now
+        ):
+            waits.append((self.requests_reset - now, "requests"))
+        if (
+            self.tokens_remaining is not None
+            and self.tokens_remaining < settings.pacing_min_tokens
+            and self.tokens_reset is not None
+            and self.tokens_reset > now
+        ):
+            waits.append((self.tokens_reset - now, "tokens"))
+        if not waits:
+            return 0.0, None
+        return max(waits)
+
+
+def key_fingerprint(api_key: str) -> str:
+    """API Key 指纹 (状态存储和日志中不出现明文 Key)"""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+def api_key_from_headers(headers: Mapping[str, str] | None) -> str | None:
+    """从上游请求头中取出 API Key (x-api-key 或 Authorization: Bearer)"""
+    if not headers:
+        return None
+    for name, value in headers.items():
+        lowered = name.lower()
+        if lowered == "x-api-key" and value:
+            return value
+        if lowered == "authorization" and value:
+            return value[7:] if value.startswith("Bearer ") else value
+    return None
+
+
+def _parse_reset(value: str | None, now: float) -> float | None:
+    """解析重置时间: RFC 3339 时间 (Anthropic) 或 "6m0s" 形式的时长 (OpenAI)"""
+    if not value:
+        return None
+    value = value.strip()
+    parts = _DURATION_PART.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return now + sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        return float(value) + now
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def _parse_int(value: str | None) -> int | None:
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def parse_rate_limit_headers(response: httpx.Response, now: float) -> dict[str, float | int]:
+    """
+    从响应头解析额度状态
+
+    Returns:
+        响应中出现的字段 (RateLimitState 字段名 -> 值), 未出现的字段不包含在内
+    """
+    headers = response.headers
+    update: dict[str, float | int] = {}
+
+    requests_remaining = _parse_int(
+        headers.get("anthropic-ratelimit-requests-remaining")
+        or headers.get("x-ratelimit-remaining-requests")
+    )
+    if requests_remaining is not None:
+        update["requests_remaining"] = requests_remaining
+        requests_limit = _parse_int(
+            headers.get("anthropic-ratelimit-requests-limit")
+            or headers.get("x-ratelimit-limit-requests")
+        )
+        if requests_limit is not None:
+            update["requests_limit"] = requests_limit
+        reset = _parse_reset(
+            headers.get("anthropic-ratelimit-requests-reset")
+            or headers.get("x-ratelimit-reset-requests"),
+            now,
+        )
+        if reset is not None:
+            update["requests_reset"] = reset
+
+    token_limits: list[tuple[int, float | None]] = []
+    for prefix in _TOKEN_HEADER_PREFIXES:
+        remaining = _parse_int(headers.get(f"{prefix}-remaining"))
+        if remaining is not None:
+            token_limits.append((remaining, _parse_reset(headers.get(f"{prefix}-reset"), now)))
+    remaining = _parse_int(headers.get("x-ratelimit-remaining-tokens"))
+    if remaining is not None:
+        token_limits.append((remaining, _parse_reset(headers.get("x-ratelimit-reset-tokens"), now)))
+    if token_limits:
+        tokens_remaining, tokens_reset = min(token_limits, key=lambda item: item[0])
+        update["tokens_remaining"] = tokens_remaining
+        if tokens_reset is not None:
+            update["tokens_reset"] = tokens_reset
+
+    if response.status_code == 429:
+        retry_after = retry_after_from(response)
+        if retry_after is not None:
+            update["blocked_until"] = now + retry_after
+
+    return update
+
+
+def _default_state_path() -> str:
+    """默认状态文件路径: 优先使用内存文件系统"""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "cc-proxy-ratelimit.sqlite")
+
+
+class RateLimitPacer:
+    """限流额度节流器 (单例, 额度状态跨 worker 进程共享)"""
+
+    _instance: ClassVar["RateLimitPacer | None"] = None
+    _lock: ClassVar[Lock] = Lock()
+    _conn: sqlite3.Connection | None
+    _pid: int | None
+    _db_lock: Lock
+    _states: dict[tuple[str, str], RateLimitState]
+    _untracked: set[tuple[str, str]]
+
+    def __new__(cls) -> "RateLimitPacer":
+        # 双重检查锁定
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super().__new__(cls)
+                    cls._instance._conn = None
+                    cls._instance._pid = None
+                    # 同一连接在线程池的多个线程中使用, 事务之间需要互斥
+                    cls._instance._db_lock = Lock()
+                    cls._instance._states = {}
+                    cls._instance._untracked = set()
+        return cls._instance
+
+    def _connect(self) -> sqlite3.Connection:
+        """获取当前进程的数据库连接 (fork 之后重新连接)"""
+        pid = os.getpid()
+        if self._conn is None or self._pid != pid:
+            path = settings.pacing_state_path or _default_state_path()
+            conn = sqlite3.connect(
+                path,
+                timeout=_BUSY_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(_SCHEMA)
+            self._conn, self._pid = conn, pid
+            logger.info("pacing_store_opened", path=path)
+        return self._conn
+
+    async def acquire(self, upstream: str, api_key: str | None) -> None:
+        """
+        请求发送前检查额度, 额度耗尽时等待到重置时间
+
+        Args:
+            upstream: 上游名称
+            api_key: 发往上游的 API Key (None 表示不节流)
+
+        Raises:
+            RateLimitError: 需要等待的时间超过 pacing_max_wait
+        """
+        if not settings.pacing_enabled or not api_key:
+            return
+
+        key_id = key_fingerprint(api_key)
+        if (upstream, key_id) in self._untracked:
+            return
+        waited = 0.0
+        while True:
+            wait, reason, state = await asyncio.to_thread(self._try_admit, upstream, key_id)
+            if state is not None:
+                self._cache(upstream, key_id, state)
+            if wait <= 0:
+                break
+            if waited + wait > settings.pacing_max_wait:
+                metrics.inc("pacing_rejected", upstream=upstream, reason=reason)
+                logger.warning(
+                    "pacing_rejected",
+                    upstream=upstream,
+                    key_id=key_id,
+                    reason=reason,
+                    retry_after=round(wait, 2),
+                )
+                raise RateLimitError(
+                    upstream,
+                    retry_after=wait,
+                    message=f"Upstream '{upstream}' rate limit exhausted for this API key",
+                )
+            metrics.inc("pacing_waits", upstream=upstream, reason=reason)
+            # 加少量抖动, 避免所有等待中的请求在重置时刻同时发出
+            delay = wait + random.uniform(0, min(1.0, wait * 0.1))
+            await asyncio.sleep(delay)
+            waited += delay
+
+        if waited:
+            metrics.observe("pacing_wait_ms", waited * 1000, upstream=upstream)
+
+    async def observe(self, upstream: str, api_key: str | None, response: httpx.Response) -> None:
+        """
+        根据上游响应头更新额度状态 (进程内缓存立即更新, SQLite 在线程池中写入)
+
+        Args:
+            upstream: 上游名称
+            api_key: 发往上游的 API Key
+            response: 上游响应 (只读取响应头)
+        """
+        if not settings.pacing_enabled or not api_key:
+            return
+        now = time.time()
+        update = parse_rate_limit_headers(response, now)
+        key_id = key_fingerprint(api_key)
+        if not update:
+            if (upstream, key_id) not in self._states:
+                self._untrack(upstream, key_id)
+            return
+
+        self._untracked.discard((upstream, key_id))
+        state = self._states.get((upstream, key_id)) or RateLimitState()
+        for column, value in update.items():
+            setattr(state, column, value)
+        self._cache(upstream, key_id, state)
+        await asyncio.to_thread(self._store, upstream, key_id, update, now)
+
+    def state(self, upstream: str, api_key: str) -> RateLimitState | None:
+        """
+        本进程最近一次放行或更新时的额度状态 (不查询 SQLite)
+
+        其他 worker 的更新在本进程下一次放行该 Key 的请求时同步; 无记录时返回 None
+        """
+        return self._states.get((upstream, key_fingerprint(api_key)))
+
+    def _cache(self, upstream: str, key_id: str, state: RateLimitState) -> None:
+        """更新进程内缓存的额度状态"""
+        states = self._states
+        states.pop((upstream, key_id), None)
+        states[(upstream, key_id)] = state
+        if len(states) > _MAX_CACHED_STATES:
+            del states[next(iter(states))]
+
+    def _untrack(self, upstream: str, key_id: str) -> None:
+        """记录上游不返回限流响应头的 Key (之后放行时不查询 SQLite)"""
+        if len(self._untracked) >= _MAX_CACHED_STATES:
+            self._untracked.clear()
+        self._untracked.add((upstream, key_id))
+
+    def _store(
+        self, upstream: str, key_id: str, update: dict[str, float | int], now: float
+    ) -> None:
+        """写入响应头中出现的额度字段 (在线程池中执行)"""
+        values = [update.get(column) for column in _COLUMNS]
+        assignments = ", ".join(
+            f"{column} = COALESCE(excluded.{column}, {column})" for column in _COLUMNS
+        )
+        try:
+            with self._db_lock:
+                self._connect().execute(
+                    f"INSERT INTO ratelimit (upstream, key_id, {', '.join(_COLUMNS)}, updated) "
+                    f"VALUES (?, ?, {', '.join('?' * len(_COLUMNS))}, ?) "
+                    f"ON CONFLICT (upstream, key_id) DO UPDATE SET {assignments}, "
+                    "updated = excluded.updated",
+                    (upstream, key_id, *values, now),
+                )
+        except sqlite3.Error as e:
+            metrics.inc("pacing_store_errors", operation="observe")
+            logger.warning("pacing_store_error", operation="observe", error=str(e))
+
+    def _try_admit(
+        self, upstream: str, key_id: str
+    ) -> tuple[float, str | None, RateLimitState | None]:
+        """
+        检查额度并在放行时扣减剩余请求数 (在线程池中执行)
+
+        先只读查询; 只有需要扣减剩余请求数时才开启写事务 (BEGIN IMMEDIATE 在所有 worker
+        之间互斥), 并在事务内重新读取后扣减
+
+        Returns:
+            (需要等待的秒数, 原因, 扣减后的额度状态); 放行时等待秒数为 0、原因为 None,
+            无记录或存储不可用时额度状态为 None
+        """
+        now = time.time()
+        try:
+            with self._db_lock:
+                conn = self._connect()
+                state = self._load(conn, upstream, key_id)
+                if state is None:
+                    return 0.0, None, None
+                wait, reason = state.wait_time(now)
+                if wait > 0 or state.requests_remaining is None:
+                    return wait, reason, state
+
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = self._admit(conn, upstream, key_id, now)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        except sqlite3.Error as e:
+            metrics.inc("pacing_store_errors", operation="admit")
+            logger.warning("pacing_store_error", operation="admit", error=str(e))
+            return 0.0, None, None
+        return result
+
+    @staticmethod
+    def _load(conn: sqlite3.Connection, upstream: str, key_id: str) -> RateLimitState | None:
+        """读取额度状态 (无记录时返回 None)"""
+        row = conn.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM ratelimit WHERE upstream = ? AND key_id = ?",
+            (upstream, key_id),
+        ).fetchone()
+        return RateLimitState(*row) if row is not None else None
+
+    @classmethod
+    def _admit(
+        cls, conn: sqlite3.Connection, upstream: str, key_id: str, now: float
+    ) -> tuple[float, str | None, RateLimitState | None]:
+        """_try_admit 的事务内部分"""
+        state = cls._load(conn, upstream, key_id)
+        if state is None:
+            return 0.0, None, None
+
+        wait, reason = state.wait_time(now)
+        if wait <= 0 and state.requests_remaining is not None:
+            # 预扣一个请求额度, 直到下一个响应头刷新真实值;
+            # 已过重置时间时额度按 limit 恢复 (新的重置时间暂定为
+            # _PROVISIONAL_RESET 秒后), 避免重置后所有 worker 同时涌入
+            remaining, reset = state.requests_remaining, state.requests_reset
+            if reset is not None and reset <= now and state.requests_limit:
+                remaining, reset = state.requests_limit, now + _PROVISIONAL_RESET
+            state.requests_remaining, state.requests_reset = remaining - 1, reset
+            conn.execute(
+                "UPDATE ratelimit SET requests_remaining = ?, requests_reset = ? "
+                "WHERE upstream = ? AND key_id = ?",
+                (state.requests_remaining, reset, upstream, key_id),
+            )
+        return wait, reason, state
+
+    async def stats(self) -> list[dict[str, Any]]:
+        """最近更新过的额度状态 (所有 worker 共享的视图, Key 以指纹展示)"""
+        return await asyncio.to_thread(self._load_stats)
+
+    def _load_stats(self) -> list[dict[str, Any]]:
+        """stats 的查询部分 (在线程池中执行)"""
+        now = time.time()
+        try:
+            with self._db_lock:
+                rows = self._connect().execute(
+                    f"SELECT upstream, key_id, {', '.join(_COLUMNS)}, updated FROM ratelimit "
+                    "WHERE updated > ? ORDER BY upstream, key_id",
+                    (now - _STATS_MAX_AGE,),
+                ).fetchall()
+        except sqlite3.Error as e:
+            return [{"error": str(e)}]
+
+        result: list[dict[str, Any]] = []
+        for upstream, key_id, *values, updated in rows:
+            state = RateLimitState(*values)
+            wait, reason = state.wait_time(now)
+            result.append(
+                {
+                    "upstream": upstream,
+                    "key_id": key_id,
+                    "requests_remaining": state.requests_remaining,
+                    "tokens_remaining": state.tokens_remaining,
+                    "wait_seconds": round(wait, 2),
+                    "wait_reason": reason,
+                    "updated_ago": round(now - updated, 1),
+                }
+            )
+        return result
+
+
+# 全局节流器实例
+pacer = RateLimitPacer()
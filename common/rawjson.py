@@ -0,0 +1,106 @@
+"""
+保留原始字节的 JSON 对象
+
+透传场景 (如官方 Claude Code 客户端的请求) 不修改请求体, 但完整校验 1MB 级别的请求体
+(Pydantic 模型) 再由 httpx 重新序列化是代理的主要 CPU 开销。RawJSON 同时持有原始字节和
+解析结果:
+- 实现 Mapping 接口, body.get("model") 等读取方式不变 (第一次读取时解析, 结果缓存)
+- 转发给上游时发送原始字节 (见 body_kwargs), 不重新序列化, 上游收到的字节与客户端发送的一致
+- 需要修改请求体时 (如流式续写) 展开为 dict 后修改, 修改后的请求体照常编码
+
+非流式上游响应同理: RawJSONResponse 把上游响应体原样返回给客户端, 需要读取响应内容时
+(如记录用量) 才通过 .json 解析
+
+只扫描顶层结构的纯 Python 扫描器在 CPython 中比完整解析 (codec.loads, C 实现) 更慢,
+因此仍完整解析, 节省的是校验和重新序列化
+"""
+from collections.abc import Iterator, Mapping
+from typing import Any
+
+import httpx
+from starlette.responses import Response
+
+from .codec import loads
+from .config import settings
+
+# 原样返回上游响应体时转发的上游响应头
+FORWARDED_HEADERS = ("content-type", "request-id", "x-request-id")
+
+
+class RawJSONError(ValueError):
+    """原始字节不是 JSON 对象"""
+
+
+class RawJSON(Mapping[str, Any]):
+    """
+    原始字节形式的 JSON 对象 (读取字段时解析)
+
+    读取字段时可能抛出 json.JSONDecodeError (不是有效的 JSON) 或 RawJSONError
+    (不是 JSON 对象), 两者都是 ValueError
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self._parsed: dict[str, Any] | None = None
+
+    def parse(self) -> dict[str, Any]:
+        """解析原始字节 (结果缓存)"""
+        if self._parsed is None:
+            value = loads(self.data)
+            if not isinstance(value, dict):
+                raise RawJSONError("Request body is not a JSON object")
+            self._parsed = value
+        return self._parsed
+
+    def __getitem__(self, key: str) -> Any:
+        return self.parse()[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.parse())
+
+    def __len__(self) -> int:
+        return len(self.parse())
+
+
+def field_count(body: Mapping[str, Any], key: str) -> int:
+    """数组 / 对象字段的元素个数 (字段不存在或为标量时返回 0)"""
+    value = body.get(key)
+    return len(value) if isinstance(value, list | dict) else 0
+
+
+def body_kwargs(body: Mapping[str, Any]) -> dict[str, Any]:
+    """上游请求的请求体参数: RawJSON 原样发送原始字节, 否则由 httpx 序列化"""
+    if isinstance(body, RawJSON):
+        return {"content": body.data}
+    return {"json": body if isinstance(body, dict) else dict(body)}
+
+
+class RawJSONResponse(Response):
+    """
+    原样返回上游 JSON 响应体的响应 (不解析 / 重新序列化)
+
+    状态码和 FORWARDED_HEADERS 中的响应头随响应体转发; 需要读取响应内容时通过 .json 按需解析
+    """
+
+    media_type = "application/json"
+
+    def __init__(self, upstream: httpx.Response) -> None:
+        headers = {
+            name: upstream.headers[name] for name in FORWARDED_HEADERS if name in upstream.headers
+        }
+        super().__init__(upstream.content, status_code=upstream.status_code, headers=headers)
+        self.json = RawJSON(upstream.content)
+
+
+def raw_response(upstream: httpx.Response) -> RawJSONResponse | None:
+    """
+    原样返回上游非流式响应
+
+    Returns:
+        未启用 response_passthrough_enabled 或上游响应不是 JSON 时返回 None (由调用方解析)
+    """
+    if not settings.response_passthrough_enabled:
+        return None
+    if "json" not in upstream.headers.get("content-type", ""):
+        return None
+    return RawJSONResponse(upstream)
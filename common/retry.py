@@ -0,0 +1,124 @@
+"""
+上游重试策略
+
+只在响应体的第一个字节转发给客户端之前重试 (连接错误或可重试状态码),
+重试间隔为带抖动的指数退避, 并遵循上游的 retry-after
+
+重试预算 (token bucket) 防止重试在上游故障时放大流量:
+每个原始请求存入 retry_budget_ratio 个令牌, 每次重试消耗 1 个令牌,
+另有 retry_budget_min_per_second 的最低补充速率保证低流量时也能重试
+"""
+import random
+import time
+from email.utils import parsedate_to_datetime
+from threading import Lock
+
+import httpx
+
+from .config import settings
+from .timeouts import UpstreamTimeoutError
+
+# 可重试的网络错误 (均发生在任何字节转发给客户端之前)
+RETRYABLE_ERRORS: tuple[type[Exception], ...] = (
+    httpx.NetworkError,
+    httpx.ConnectTimeout,
+    httpx.RemoteProtocolError,
+    UpstreamTimeoutError,  # 响应头 / 首个 SSE 事件超时
+)
+
+
+class RetryBudget:
+    """重试预算 (令牌桶, 线程安全)"""
+
+    def __init__(
+        self,
+        ratio: float,
+        min_per_second: float,
+        max_tokens: float,
+    ) -> None:
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(self.max_tokens, self._tokens + elapsed * self.min_per_second)
+
+    def deposit(self) -> None:
+        """记录一个原始请求"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        """尝试消耗一次重试的令牌"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    解析 retry-after 响应头
+
+    Args:
+        value: 秒数或 HTTP 日期
+
+    Returns:
+        等待秒数, 无法解析时返回 None
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: float | None = None) -> float | None:
+    """
+    计算第 attempt 次重试前的等待时间
+
+    Args:
+        attempt: 已完成的尝试次数 (从 1 开始)
+        retry_after: 上游要求的等待时间 (秒)
+
+    Returns:
+        等待秒数; 上游要求等待超过 retry_max_retry_after 时返回 None (放弃重试)
+    """
+    cap = min(settings.retry_backoff_max, settings.retry_backoff_base * 2 ** (attempt - 1))
+    delay = random.uniform(0, cap)  # full jitter
+    if retry_after is not None:
+        if retry_after > settings.retry_max_retry_after:
+            return None
+        delay = max(delay, retry_after)
+    return delay
+
+
+def retry_after_from(response: httpx.Response) -> float | None:
+    """从响应头读取 retry-after (兼容 retry-after-ms)"""
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    return parse_retry_after(response.headers.get("retry-after"))
@@ -0,0 +1,245 @@
+"""
+请求调度 (优先级 + 加权公平队列 + 截止时间)
+
+上游并发达到上限后, 排队请求不再按到达顺序放行:
+- 优先级: 来自选中的客户端适配器 (如 ClaudeCodeAdapter 100, CherryStudio 50),
+  请求头 x-proxy-priority 只能降低优先级 (批量任务可以主动让路, 客户端无法自行提升);
+  高优先级类的请求总是先于低优先级类放行
+- 加权公平队列: 同一优先级类内按流 (API Key 指纹, 无 Key 时为客户端 IP) 轮转,
+  每个流按 scheduler_flow_weights 中的权重分配放行份额 (start-time fair queuing),
+  单个流的突发请求不会挤占同类其他流
+- 截止时间: 同一个流内按截止时间从早到晚放行 (EDF); 截止时间默认为
+  concurrency_queue_timeout, 请求头 x-proxy-deadline (秒) 可以缩短
+
+调度信息通过 contextvars 从路由层传递到 HTTP 客户端, 未设置时使用默认值 (优先级 0)
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections.abc import Mapping
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+from .config import settings
+from .pacing import key_fingerprint
+
+# 调度相关的请求头
+PRIORITY_HEADER = "x-proxy-priority"
+DEADLINE_HEADER = "x-proxy-deadline"
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    """单个请求的调度信息"""
+
+    priority: int = 0
+    flow: str = "-"  # 公平队列的流标识
+    deadline: float | None = None  # 最晚放行时间 (monotonic), None 表示使用默认排队时长
+
+    @property
+    def weight(self) -> float:
+        return max(0.01, settings.scheduler_flow_weights.get(self.flow, 1.0))
+
+    def remaining(self, now: float) -> float:
+        """距离截止时间的剩余秒数"""
+        if self.deadline is None:
+            return settings.concurrency_queue_timeout
+        return self.deadline - now
+
+
+_current: ContextVar[RequestContext | None] = ContextVar("request_context", default=None)
+
+
+def current_request_context() -> RequestContext:
+    """当前请求的调度信息"""
+    return _current.get() or RequestContext()
+
+
+def set_request_context(
+    *,
+    priority: int,
+    api_key: str | None,
+    client_ip: str | None,
+    headers: Mapping[str, str],
+) -> RequestContext:
+    """
+    设置当前请求的调度信息 (路由层在适配器选定后调用)
+
+    Args:
+        priority: 选中的适配器优先级
+        api_key: 调用方 API Key (用于公平队列分流)
+        client_ip: 客户端 IP (无 API Key 时用于分流)
+        headers: 原始请求头 (小写 key), 读取 x-proxy-priority / x-proxy-deadline
+
+    Returns:
+        生效的调度信息
+    """
+    requested = _parse_float(headers.get(PRIORITY_HEADER))
+    if requested is not None:
+        priority = min(priority, int(requested))
+
+    now = time.monotonic()
+    timeout = settings.concurrency_queue_timeout
+    requested_deadline = _parse_float(headers.get(DEADLINE_HEADER))
+    if requested_deadline is not None and requested_deadline >= 0:
+        timeout = min(timeout, requested_deadline)
+
+    flow = key_fingerprint(api_key) if api_key else client_ip or "-"
+    context = RequestContext(priority=priority, flow=flow, deadline=now + timeout)
+    _current.set(context)
+    return context
+
+
+def _parse_float(value: str | None) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+@dataclass
+class Waiter:
+    """排队中的请求"""
+
+    context: RequestContext
+    future: "asyncio.Future[None]"
+
+
+class _Flow:
+    """同一优先级类中的一个流"""
+
+    __slots__ = ("heap", "live", "vtime")
+
+    def __init__(self) -> None:
+        self.heap: list[tuple[float, int, Waiter]] = []  # (截止时间, 序号, 请求)
+        self.live = 0
+        self.vtime = 0.0  # 流的虚拟时间: 每放行一个请求增加 1 / weight
+
+
+class _PriorityClass:
+    """一个优先级类 (内部为加权公平队列)"""
+
+    __slots__ = ("flows", "live", "vtime")
+
+    def __init__(self) -> None:
+        self.flows: dict[str, _Flow] = {}
+        self.live = 0
+        self.vtime = 0.0  # 类的虚拟时间: 最近放行的流的虚拟时间
+
+
+class FairQueue:
+    """
+    等待队列: 优先级类之间严格优先, 类内加权公平, 流内 EDF
+
+    已取消的请求留在堆中, 出队时跳过 (惰性删除)
+    """
+
+    def __init__(self) -> None:
+        self._classes: dict[int, _PriorityClass] = {}
+        self._seq = itertools.count()
+        self._live = 0
+
+    def __len__(self) -> int:
+        return self._live
+
+    def push(self, waiter: Waiter) -> None:
+        ctx = waiter.context
+        cls = self._classes.setdefault(ctx.priority, _PriorityClass())
+        flow = cls.flows.get(ctx.flow)
+        if flow is None:
+            flow = cls.flows[ctx.flow] = _Flow()
+        if flow.live == 0:
+            # 空闲的流不能积累放行份额
+            flow.vtime = max(flow.vtime, cls.vtime)
+        deadline = ctx.deadline if ctx.deadline is not None else float("inf")
+        heapq.heappush(flow.heap, (deadline, next(self._seq), waiter))
+        flow.live += 1
+        cls.live += 1
+        self._live += 1
+
+    def discard(self, waiter: Waiter) -> None:
+        """移除排队中的请求 (超时或被取消), 调用方需先完成 waiter.future"""
+        cls = self._classes.get(waiter.context.priority)
+        flow = cls.flows.get(waiter.context.flow) if cls is not None else None
+        if cls is None or flow is None or flow.live == 0:
+            return
+        flow.live -= 1
+        cls.live -= 1
+        self._live -= 1
+        self._compact(waiter.context.priority, waiter.context.flow)
+
+    def pop(self) -> Waiter | None:
+        """取出下一个应放行的请求 (跳过已完成的 future)"""
+        for priority in sorted(self._classes, reverse=True):
+            cls = self._classes[priority]
+            while cls.live > 0:
+                name, flow = min(
+                    ((name, flow) for name, flow in cls.flows.items() if flow.live > 0),
+                    key=lambda item: (item[1].vtime, item[1].heap[0][0]),
+                )
+                waiter = self._pop_live(flow)
+                if waiter is None:
+                    # 堆中只剩已完成的请求 (计数与堆不一致), 以堆为准
+                    cls.live -= flow.live
+                    self._live -= flow.live
+                    flow.live = 0
+                    self._compact(priority, name)
+                    continue
+                cls.vtime = flow.vtime
+                weight = waiter.context.weight
+                flow.vtime += 1 / weight
+                flow.live -= 1
+                cls.live -= 1
+                self._live -= 1
+                self._compact(priority, name)
+                return waiter
+        return None
+
+    def ahead(self, context: RequestContext) -> int:
+        """
+        估算新请求前方的排队数
+
+        高优先级类全部计入; 同一优先级类中每个流最多计入 (该请求所在流的排队数 + 1) 个,
+        即公平轮转下会先于该请求放行的数量
+        """
+        count = sum(
+            cls.live for priority, cls in self._classes.items() if priority > context.priority
+        )
+        cls = self._classes.get(context.priority)
+        if cls is not None:
+            own = cls.flows.get(context.flow)
+            share = (own.live if own is not None else 0) + 1
+            count += sum(min(flow.live, share) for flow in cls.flows.values())
+        return count
+
+    def stats(self) -> dict[str, Any]:
+        """各优先级类的排队数和排队中的流数"""
+        return {
+            str(priority): {
+                "queued": cls.live,
+                "flows": sum(1 for flow in cls.flows.values() if flow.live),
+            }
+            for priority, cls in sorted(self._classes.items(), reverse=True)
+            if cls.live
+        }
+
+    @staticmethod
+    def _pop_live(flow: _Flow) -> Waiter | None:
+        while flow.heap:
+            _, _, waiter = heapq.heappop(flow.heap)
+            if not waiter.future.done():
+                return waiter
+        return None
+
+    def _compact(self, priority: int, name: str) -> None:
+        """清理空的流和优先级类, 避免长期运行时无限增长"""
+        cls = self._classes[priority]
+        flow = cls.flows.get(name)
+        if flow is not None and flow.live == 0:
+            del cls.flows[name]
+        if cls.live == 0 and not cls.flows:
+            del self._classes[priority]
@@ -0,0 +1,297 @@
+"""
+大请求体落盘
+
+携带多张 base64 图片或大段粘贴内容的请求体可达 10-30MB。原先原始字节、解析结果、转换时的
+深拷贝和重新编码的上游请求体同时保存在内存中。Content-Length 超过 request_spool_threshold
+的请求体改为:
+- 边接收边写入临时文件 (在线程池中按批写入; 创建后即删除, 最后一个引用释放时回收磁盘空间),
+  再以只读 mmap 映射
+- 在映射上按引号跳跃扫描字符串 (bytes.find, 不逐字节解释), 长度超过 request_spool_min_string
+  且不含转义的 base64 字符串 (含 data: URL) 替换为占位符后解析其余部分
+- 图片 / 文件数据字段 (Anthropic source 的 data, OpenAI 的 image_url / file_data / url 中的
+  data: URL) 在解析结果中是 Blob (只记录在文件中的位置), 深拷贝返回自身; 其他字段
+  (text、字符串 content 等) 中的字符串读出为 str, 请求校验和转换逻辑照常处理
+- 编码上游请求体时 (upload.iter_json / iter_encoded) Blob 直接从映射分块读取输出
+
+Blob 不是 str: 转换逻辑按原样透传图片数据, 需要字符串值时使用 str(blob)。
+临时目录应位于磁盘 (tmpfs 上的文件同样占用内存)
+"""
+import asyncio
+import hashlib
+import mmap
+import re
+import secrets
+import tempfile
+from collections.abc import Callable, Iterator
+from typing import Any, BinaryIO
+
+from starlette.requests import Request
+
+from .codec import dumps, loads
+from .config import settings
+from .logger import get_logger
+from .metrics import metrics
+
+logger = get_logger(__name__)
+
+# 占位符前缀 (进程内随机, 不会与客户端内容冲突)
+_MARKER = f"spool-blob-{secrets.token_hex(16)}-"
+_MARKER_PATTERN = re.compile(b'"' + _MARKER.encode() + rb'(\d+)"')
+
+# base64 字符串 (可带 data: URL 前缀) 的开头; 只检查开头, 不逐字节检查整个字符串
+_BASE64_PREFIX = re.compile(rb"(?:data:[\w.+-]+/[\w.+-]+;base64,)?[A-Za-z0-9+/]{1024}")
+
+_BACKSLASH = 0x5C
+
+# 值为 data: URL 时保留为 Blob 的字段 (OpenAI input_image / input_file / image_url)
+_DATA_URL_FIELDS = ("image_url", "file_data", "url")
+
+# 接收请求体时每批写入临时文件的字节数
+_WRITE_BATCH = 1024 * 1024
+
+
+class SpooledBody:
+    """落盘的请求体 (临时文件的只读映射)"""
+
+    def __init__(self, data: mmap.mmap) -> None:
+        self.data = data
+        self.blob_count = 0  # 解析后保留为 Blob 的字符串个数
+        self._digest: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def digest(self) -> str:
+        """请求体的 SHA-256 (结果缓存)"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def parse(self) -> Any:
+        """
+        解析请求体, 大 base64 字符串保留为 Blob
+
+        Raises:
+            json.JSONDecodeError: 不是有效的 JSON
+        """
+        data = self.data
+        pieces: list[bytes] = []
+        blobs: list[Blob] = []
+        position = 0
+        for start, end in _scan_blobs(data, settings.request_spool_min_string):
+            pieces.append(data[position:start])
+            pieces.append(f'"{_MARKER}{len(blobs)}"'.encode())
+            blobs.append(Blob(self, start, end))
+            position = end
+        pieces.append(data[position:])
+        value = loads(b"".join(pieces))
+        if not blobs:
+            return value
+        wrapper = [value]
+        self.blob_count = _restore(wrapper, blobs)
+        return wrapper[0]
+
+
+class Blob:
+    """
+    落盘请求体中的大字符串 (只记录 JSON 字符串字面量在文件中的位置, 含引号)
+
+    字面量不含转义, 原始字节即 UTF-8 编码的字符串值
+    """
+
+    __slots__ = ("body", "end", "start")
+
+    def __init__(self, body: SpooledBody, start: int, end: int) -> None:
+        self.body = body
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start - 2
+
+    def __str__(self) -> str:
+        return self.body.data[self.start + 1 : self.end - 1].decode()
+
+    def __repr__(self) -> str:
+        return f"<Blob {len(self)} bytes>"
+
+    def __copy__(self) -> "Blob":
+        return self
+
+    def __deepcopy__(self, memo: dict[int, Any]) -> "Blob":
+        return self
+
+    def chunks(self) -> Iterator[bytes]:
+        """分块读取 JSON 字面量 (含引号)"""
+        size = max(settings.http_stream_upload_chunk_size, 4096)
+        for offset in range(self.start, self.end, size):
+            yield self.body.data[offset : min(offset + size, self.end)]
+
+    def fingerprint(self) -> str:
+        """比较用的标识 (请求体摘要 + 位置, 不读取内容)"""
+        return f"{_MARKER}{self.body.digest()}:{self.start}"
+
+
+def _scan_blobs(data: mmap.mmap, min_size: int) -> Iterator[tuple[int, int]]:
+    """
+    扫描 JSON 文本, 返回需要保留为 Blob 的字符串字面量的位置 [start, end)
+
+    按引号跳跃: 字符串之外不会出现引号, 从一个字符串的结束引号之后找到的第一个引号
+    必然是下一个字符串的开始引号; 字符串内部只需要判断引号前的反斜杠个数
+    """
+    find = data.find
+    start = find(b'"')
+    while start != -1:
+        end = start
+        while True:
+            end = find(b'"', end + 1)
+            if end == -1:
+                return
+            if data[end - 1] != _BACKSLASH:
+                break
+            escape = end - 1
+            while data[escape] == _BACKSLASH:
+                escape -= 1
+            if (end - 1 - escape) % 2 == 0:
+                break
+        end += 1
+        if (
+            end - start - 2 >= min_size
+            and find(b"\\", start, end) == -1
+            and _BASE64_PREFIX.match(data, start + 1)
+            and data[end : end + 64].lstrip()[:1] != b":"  # 键不替换
+        ):
+            yield start, end
+        start = find(b'"', end)
+
+
+def _keep_blob(parent: Any, key: Any, blob: Blob) -> bool:
+    """是否保留为 Blob: 只有图片 / 文件数据字段 (其他字段需要 str 值)"""
+    if not isinstance(parent, dict):
+        return False
+    if key == "data":
+        # Anthropic image / document: {"type": "base64", "media_type": ..., "data": ...}
+        return parent.get("type") == "base64"
+    return key in _DATA_URL_FIELDS and blob.body.data[blob.start + 1 : blob.start + 6] == b"data:"
+
+
+def _restore(value: Any, blobs: list[Blob]) -> int:
+    """
+    把解析结果中的占位符替换为 Blob 或 str (原地修改)
+
+    Returns:
+        保留为 Blob 的个数
+    """
+    kept = 0
+    items = value.items() if isinstance(value, dict) else enumerate(value)
+    for key, item in items:
+        if isinstance(item, str):
+            if item.startswith(_MARKER):
+                blob = blobs[int(item[len(_MARKER) :])]
+                keep = _keep_blob(value, key, blob)
+                value[key] = blob if keep else str(blob)
+                kept += keep
+        elif isinstance(item, dict | list):
+            kept += _restore(item, blobs)
+    return kept
+
+
+def iter_encoded(value: Any, encode: Callable[..., bytes] = dumps) -> Iterator[bytes]:
+    """
+    编码 value, 其中的 Blob 从映射分块输出 (拼接结果与 encode 编码普通字符串相同)
+
+    Args:
+        value: 可能包含 Blob 的值
+        encode: 编码函数 (codec.dumps / codec.encoded / codec.dumps_body), 需支持 default=
+    """
+    blobs: list[Blob] = []
+
+    def default(obj: Any) -> str:
+        if isinstance(obj, Blob):
+            blobs.append(obj)
+            return f"{_MARKER}{len(blobs) - 1}"
+        raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+    data = encode(value, default=default)
+    if not blobs:
+        yield data
+        return
+
+    position = 0
+    for match in _MARKER_PATTERN.finditer(data):
+        yield data[position : match.start()]
+        yield from blobs[int(match[1])].chunks()
+        position = match.end()
+    yield data[position:]
+
+
+def fingerprint(obj: Any) -> str:
+    """codec.dumps 的 default: Blob 编码为标识 (用于生成比较键, 不读取内容)"""
+    if isinstance(obj, Blob):
+        return obj.fingerprint()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _create() -> BinaryIO:
+    """创建临时文件 (在线程池中执行)"""
+    return tempfile.TemporaryFile(dir=settings.request_spool_dir)
+
+
+def _map(file: BinaryIO, batch: list[bytes]) -> mmap.mmap | None:
+    """写入剩余数据并映射文件 (空文件返回 None; 在线程池中执行)"""
+    file.writelines(batch)
+    # 写入页缓存, 不等待落盘
+    file.flush()
+    if file.tell() == 0:
+        return None
+    # mmap 持有文件描述符的副本, 关闭文件对象后映射仍然有效
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def spooled(request: Request) -> SpooledBody | None:
+    """请求的落盘请求体 (未落盘时为 None, 此时可照常 await request.body())"""
+    return getattr(request.state, "spooled_body", None)
+
+
+async def read_body(request: Request) -> bytes | Any:
+    """
+    读取请求体
+
+    Returns:
+        Content-Length 不超过 request_spool_threshold (或未提供) 时为原始字节;
+        否则落盘并解析, 返回解析结果 (图片 / 文件数据字段中的大 base64 字符串为 Blob)
+
+    Raises:
+        json.JSONDecodeError: 落盘的请求体不是有效的 JSON
+    """
+    threshold = settings.request_spool_threshold
+    length = request.headers.get("content-length", "")
+    if threshold <= 0 or not length.isdigit() or int(length) <= threshold:
+        return await request.body()
+
+    # 文件写入在线程池中按批进行, 不阻塞事件循环
+    file = await asyncio.to_thread(_create)
+    try:
+        batch: list[bytes] = []
+        size = 0
+        async for chunk in request.stream():
+            batch.append(chunk)
+            size += len(chunk)
+            if size >= _WRITE_BATCH:
+                await asyncio.to_thread(file.writelines, batch)
+                batch, size = [], 0
+        data = await asyncio.to_thread(_map, file, batch)
+    finally:
+        file.close()
+    if data is None:
+        return b""
+
+    body = SpooledBody(data)
+    request.state.spooled_body = body
+    # 扫描和解析在线程中进行, 期间事件循环照常调度其他请求
+    value = await asyncio.to_thread(body.parse)
+    metrics.inc("request_spooled")
+    logger.info(
+        "request_body_spooled", path=request.url.path, size=len(body), blobs=body.blob_count
+    )
+    return value
@@ -0,0 +1,66 @@
+"""
+上游分阶段超时
+
+单一的 httpx 读超时无法区分 "生成前思考很久" 和 "流中途卡住":
+- connect: 建连 (httpx connect 超时)
+- headers: 收到响应头
+- first_event: 流式请求收到第一个 SSE 事件
+- idle: 响应体数据块之间的间隔 (卡顿检测)
+- total: 请求总时长
+
+headers / first_event 超时发生在任何字节转发给客户端之前, 可以重试;
+idle / total 超时发生在转发过程中, 由调用方中止并返回结构化错误
+"""
+from dataclasses import dataclass
+
+import httpx
+
+from .config import settings
+
+
+@dataclass(frozen=True)
+class PhaseTimeouts:
+    """某个模型生效的分阶段超时 (秒)"""
+
+    connect: float
+    headers: float
+    first_event: float
+    idle: float
+    total: float
+
+
+class UpstreamTimeoutError(httpx.TimeoutException):
+    """上游某个阶段超时"""
+
+    def __init__(self, phase: str, seconds: float, request: httpx.Request | None = None) -> None:
+        self.phase = phase
+        self.seconds = seconds
+        super().__init__(f"Upstream {phase} timeout after {seconds:g}s", request=request)
+
+
+def resolve_timeouts(model: str | None) -> PhaseTimeouts:
+    """
+    解析模型的分阶段超时
+
+    Args:
+        model: 模型名; 按 http_model_timeouts 的最长前缀匹配覆盖全局配置
+
+    Returns:
+        PhaseTimeouts: 生效的超时配置
+    """
+    override = None
+    if model:
+        matched = [prefix for prefix in settings.http_model_timeouts if model.startswith(prefix)]
+        if matched:
+            override = settings.http_model_timeouts[max(matched, key=len)]
+
+    def pick(value: float | None, default: float) -> float:
+        return value if value is not None else default
+
+    return PhaseTimeouts(
+        connect=pick(override and override.connect, settings.http_connect_timeout),
+        headers=pick(override and override.headers, settings.http_headers_timeout),
+        first_event=pick(override and override.first_event, settings.http_first_event_timeout),
+        idle=pick(override and override.idle, settings.http_idle_timeout),
+        total=pick(override and override.total, settings.http_total_timeout),
+    )
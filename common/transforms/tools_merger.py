@@ -22,7 +22,7 @@ class ToolsMergerTransformer(Transformer):
     工具合并转换器
 
     策略:
-    1. 始终以默认工具开始
+    1. 始终以默认工具开始 (共享只读的默认工具对象, 不复制; 见 common.codec.prepare)
     2. 客户端工具直接 append (不过滤、不去重)
 
     逻辑 100% 保留 service-cx/adapters/cherry_studio.py:249-287
@@ -45,8 +45,8 @@ class ToolsMergerTransformer(Transformer):
 
         逻辑 100% 保留原实现
         """
-        # 从默认工具开始
-        merged = copy.deepcopy(self.default_tools)
+        # 从默认工具开始 (默认工具是只读结构, 需要修改时先复制)
+        merged = list(self.default_tools)
 
         # 检查客户端是否提供了工具
         client_tools = data.get("tools")
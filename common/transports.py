@@ -0,0 +1,483 @@
+"""
+上游传输后端
+
+HTTPClient 的每个连接池仍是一个 httpx.AsyncClient (请求构建、分阶段超时、trace、
+响应流包装都不变), 底层传输按连接池选择 (settings.http_transport / HTTPPoolConfig.transport):
+- "http2" (默认): httpx HTTP/2, 同一上游的请求复用少量连接上的多个 stream
+- "http1": httpx HTTP/1.1, 每个在途请求独占一个连接, 单个流的 CPU 开销低于 HTTP/2
+- "aiohttp": aiohttp 客户端 (可选依赖, HTTP/1.1, 协议解析在 C 扩展中完成)
+
+stripes > 1 时连接池拆成 N 个独立的子传输, 新请求交给在途请求最少的子传输:
+HTTP/2 下即 N 条并行连接, 避免单条连接的队头阻塞和单连接流控窗口上限;
+HTTP/1.1 下分散连接池内部的锁竞争。连接数上限在子传输之间平分
+
+dns_cache=True 时新连接通过共享的 DNS 缓存 (common.dns) 解析上游域名,
+在解析出的地址之间轮转, 连接失败时依次尝试其他地址
+
+显式指定 transport 的 httpx.AsyncClient 不再读取代理环境变量, 因此由 create_mounts 按
+HTTPS_PROXY / HTTP_PROXY / ALL_PROXY / NO_PROXY 创建经代理的传输 (与 httpx 默认行为一致);
+经代理的连接不计入 transport_stats
+"""
+import asyncio
+import ipaddress
+import socket
+import ssl
+import urllib.request
+from collections.abc import AsyncIterator, Callable, Iterable
+from typing import Any
+
+import httpcore
+import httpx
+
+from .dns import dns_cache
+from .metrics import metrics
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - 可选依赖
+    aiohttp = None
+
+TRANSPORTS = ("http2", "http1", "aiohttp")
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """响应流关闭时执行一次回调"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]) -> None:
+        self._stream = stream
+        self._on_close: Callable[[], None] | None = on_close
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                on_close, self._on_close = self._on_close, None
+                on_close()
+
+
+class StripedTransport(httpx.AsyncBaseTransport):
+    """把请求分散到 N 个独立子传输 (按在途请求数最少选择)"""
+
+    def __init__(self, transports: list[httpx.AsyncBaseTransport]) -> None:
+        self.transports = transports
+        self.inflight = [0] * len(transports)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        index = min(range(len(self.transports)), key=self.inflight.__getitem__)
+        self.inflight[index] += 1
+        try:
+            response = await self.transports[index].handle_async_request(request)
+        except BaseException:
+            self.inflight[index] -= 1
+            raise
+
+        def release() -> None:
+            self.inflight[index] -= 1
+
+        assert isinstance(response.stream, httpx.AsyncByteStream)
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self) -> None:
+        await asyncio.gather(*(transport.aclose() for transport in self.transports))
+
+    def pool_stats(self) -> dict[str, Any]:
+        stats = [transport_stats(transport) for transport in self.transports]
+        merged: dict[str, Any] = {
+            key: sum(item[key] for item in stats)
+            for key in ("connections", "active", "idle", "queued", "max_connections")
+        }
+        merged["http2_streams"] = [count for item in stats for count in item["http2_streams"]]
+        merged["stripes"] = [item["connections"] for item in stats]
+        return merged
+
+
+class CachedDNSBackend(httpcore.AsyncNetworkBackend):
+    """httpcore 网络后端: 建连前经 DNS 缓存解析, 按轮转顺序尝试各地址"""
+
+    def __init__(self, backend: httpcore.AsyncNetworkBackend) -> None:
+        self._backend = backend
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: float | None = None,
+        local_address: str | None = None,
+        socket_options: Iterable[Any] | None = None,
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            addresses = await dns_cache.targets(host)
+        except OSError as e:
+            raise httpcore.ConnectError(str(e)) from e
+
+        for index, address in enumerate(addresses):
+            try:
+                # TLS SNI / 证书校验使用请求 URL 中的域名, 不受连接地址影响
+                return await self._backend.connect_tcp(
+                    address,
+                    port,
+                    timeout=timeout,
+                    local_address=local_address,
+                    socket_options=socket_options,
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout):
+                if index == len(addresses) - 1:
+                    raise
+                metrics.inc("dns_connect_failover", host=host)
+        raise httpcore.ConnectError(f"No address to connect for {host}")  # pragma: no cover
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: float | None = None,
+        socket_options: Iterable[Any] | None = None,
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(
+            path, timeout=timeout, socket_options=socket_options
+        )
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+if aiohttp is not None:
+
+    class _CachedResolver(aiohttp.abc.AbstractResolver):
+        """aiohttp 解析器: 使用共享 DNS 缓存 (返回地址顺序即轮转顺序)"""
+
+        async def resolve(
+            self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET
+        ) -> list[dict[str, Any]]:
+            return [
+                {
+                    "hostname": host,
+                    "host": address,
+                    "port": port,
+                    "family": socket.AF_INET6 if ":" in address else socket.AF_INET,
+                    "proto": 0,
+                    "flags": socket.AI_NUMERICHOST,
+                }
+                for address in await dns_cache.targets(host)
+            ]
+
+        async def close(self) -> None:
+            pass
+
+
+class _AiohttpStream(httpx.AsyncByteStream):
+    """aiohttp 响应体 (网络错误转换为对应的 httpx 异常, 重试和续写逻辑无需区分后端)"""
+
+    def __init__(self, response: "aiohttp.ClientResponse", request: httpx.Request) -> None:
+        self._response = response
+        self._request = request
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._response.content.iter_any():
+                yield chunk
+        except aiohttp.ClientError as e:
+            raise _map_aiohttp_error(e, self._request) from e
+
+    async def aclose(self) -> None:
+        if self._response.content.at_eof():
+            self._response.release()
+        else:
+            # 响应体未读完 (如客户端断开): 关闭连接而不是放回连接池
+            self._response.close()
+
+
+class AiohttpTransport(httpx.AsyncBaseTransport):
+    """
+    aiohttp 传输 (HTTP/1.1)
+
+    响应体以原始字节交给 httpx (不在 aiohttp 中解压), httpx 的 trace 回调
+    映射到 aiohttp 的建连事件, 建连耗时指标与 httpx 后端一致
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int,
+        keepalive_expiry: float,
+        verify: ssl.SSLContext | bool = True,
+        dns_cache: bool = False,
+        proxy: str | None = None,
+    ) -> None:
+        if aiohttp is None:
+            raise RuntimeError("aiohttp transport requires the 'aiohttp' package")
+        self._max_connections = max_connections
+        self._keepalive_expiry = keepalive_expiry
+        self._verify = verify
+        self._dns_cache = dns_cache
+        self._proxy = proxy
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> "aiohttp.ClientSession":
+        # ClientSession 需要在事件循环内创建
+        if self._session is None or self._session.closed:
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_start.append(_trace("connection.connect_tcp.started"))
+            trace.on_connection_create_end.append(_trace("connection.connect_tcp.complete"))
+            trace.on_request_headers_sent.append(_trace("http11.send_request_headers.complete"))
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._max_connections,
+                    keepalive_timeout=self._keepalive_expiry,
+                    ssl=self._verify,
+                    # 使用共享 DNS 缓存时关闭 aiohttp 自带的 (按连接器独立的) 缓存
+                    resolver=_CachedResolver() if self._dns_cache else None,
+                    use_dns_cache=not self._dns_cache,
+                ),
+                auto_decompress=False,
+                trace_configs=[trace],
+            )
+        return self._session
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        timeouts = request.extensions.get("timeout", {})
+        headers = [
+            (name.decode("latin-1"), value.decode("latin-1"))
+            for name, value in request.headers.raw
+            if name.lower() not in (b"transfer-encoding", b"content-length")
+        ]
+        if isinstance(request.stream, httpx.ByteStream):
+            data: Any = await request.aread()
+        else:
+            data = _iterate(request.stream)
+
+        try:
+            response = await self._get_session().request(
+                request.method,
+                str(request.url),
+                headers=headers,
+                data=data,
+                proxy=self._proxy,
+                allow_redirects=False,
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    connect=timeouts.get("pool"),
+                    sock_connect=timeouts.get("connect"),
+                    sock_read=timeouts.get("read"),
+                ),
+                trace_request_ctx=request.extensions.get("trace"),
+            )
+        except (TimeoutError, aiohttp.ClientError) as e:
+            raise _map_aiohttp_error(e, request) from e
+
+        return httpx.Response(
+            status_code=response.status,
+            headers=list(response.raw_headers),
+            stream=_AiohttpStream(response, request),
+            extensions={"http_version": b"HTTP/1.1"},
+        )
+
+    async def aclose(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+    def pool_stats(self) -> dict[str, Any]:
+        connector = self._session.connector if self._session is not None else None
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        active = len(getattr(connector, "_acquired", ()))
+        return {
+            "connections": idle + active,
+            "active": active,
+            "idle": idle,
+            "queued": sum(len(waiters) for waiters in getattr(connector, "_waiters", {}).values()),
+            "max_connections": self._max_connections,
+            "http2_streams": [],
+        }
+
+
+def _trace(event_name: str) -> Callable[..., Any]:
+    """aiohttp trace 回调 -> httpx trace 回调 (请求的 extensions["trace"])"""
+
+    async def callback(session: Any, context: Any, params: Any) -> None:
+        trace = context.trace_request_ctx
+        if trace is not None:
+            await trace(event_name, {})
+
+    return callback
+
+
+async def _iterate(stream: httpx.AsyncByteStream) -> AsyncIterator[bytes]:
+    async for chunk in stream:
+        yield chunk
+
+
+def _map_aiohttp_error(error: BaseException, request: httpx.Request) -> httpx.TransportError:
+    """aiohttp 异常 -> httpx 异常"""
+    message = str(error) or type(error).__name__
+    if isinstance(error, getattr(aiohttp, "ConnectionTimeoutError", ())):
+        return httpx.ConnectTimeout(message, request=request)
+    if isinstance(error, aiohttp.ServerTimeoutError):
+        return httpx.ReadTimeout(message, request=request)
+    if isinstance(error, asyncio.TimeoutError):
+        return httpx.ConnectTimeout(message, request=request)
+    if isinstance(error, aiohttp.ClientConnectorError):
+        return httpx.ConnectError(message, request=request)
+    if isinstance(error, aiohttp.ClientOSError):
+        return httpx.ReadError(message, request=request)
+    return httpx.RemoteProtocolError(message, request=request)
+
+
+def create_transport(
+    name: str,
+    *,
+    stripes: int = 1,
+    max_connections: int,
+    max_keepalive: int,
+    keepalive_expiry: float,
+    verify: ssl.SSLContext | bool = True,
+    dns_cache: bool = False,
+    proxy: str | None = None,
+) -> httpx.AsyncBaseTransport:
+    """
+    创建传输后端
+
+    Args:
+        name: "http2" / "http1" / "aiohttp"
+        stripes: 子传输数 (>1 时使用 StripedTransport)
+        max_connections: 连接数上限 (在子传输之间平分)
+        max_keepalive: 空闲连接数上限 (在子传输之间平分)
+        keepalive_expiry: 空闲连接过期时间 (秒)
+        verify: TLS 证书校验 (同 httpx 的 verify 参数)
+        dns_cache: 新连接经共享 DNS 缓存解析并在各地址之间轮转
+        proxy: 代理 URL (None 表示直连)
+
+    Raises:
+        ValueError: 未知的传输后端
+    """
+    if name not in TRANSPORTS:
+        raise ValueError(f"Unknown HTTP transport '{name}', expected one of {TRANSPORTS}")
+
+    stripes = max(1, stripes)
+    per_stripe = max(1, max_connections // stripes)
+    keepalive = max(1, max_keepalive // stripes)
+
+    def build() -> httpx.AsyncBaseTransport:
+        if name == "aiohttp":
+            return AiohttpTransport(
+                max_connections=per_stripe,
+                keepalive_expiry=keepalive_expiry,
+                verify=verify,
+                dns_cache=dns_cache,
+                proxy=proxy,
+            )
+        transport = httpx.AsyncHTTPTransport(
+            http2=name == "http2",
+            verify=verify,
+            proxy=proxy,
+            limits=httpx.Limits(
+                max_connections=per_stripe,
+                max_keepalive_connections=keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+        )
+        if dns_cache:
+            # httpcore 连接池没有公开的网络后端参数, 替换内部后端 (其余行为不变)
+            pool = transport._pool
+            pool._network_backend = CachedDNSBackend(pool._network_backend)
+        return transport
+
+    if stripes == 1:
+        return build()
+    return StripedTransport([build() for _ in range(stripes)])
+
+
+def environment_proxies() -> dict[str, str | None]:
+    """
+    代理环境变量 (HTTPS_PROXY / HTTP_PROXY / ALL_PROXY / NO_PROXY, 不区分大小写)
+
+    Returns:
+        httpx mounts 的 URL 模式 -> 代理 URL (None 表示直连); NO_PROXY=* 时为空
+    """
+    proxies = urllib.request.getproxies()
+    result: dict[str, str | None] = {}
+    for scheme in ("all", "http", "https"):
+        url = proxies.get(scheme)
+        if url:
+            result[f"{scheme}://"] = url if "://" in url else f"http://{url}"
+    if not result:
+        return result
+
+    for host in proxies.get("no", "").split(","):
+        host = host.strip()
+        if host == "*":
+            return {}
+        if not host:
+            continue
+        if "://" in host:
+            result[host] = None
+            continue
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            # 同 httpx: "example.com" 匹配自身及子域名, ".example.com" 只匹配子域名
+            result[f"all://*{host}"] = None
+        else:
+            result[f"all://[{host}]" if address.version == 6 else f"all://{host}"] = None
+    return result
+
+
+def create_mounts(name: str, **options: Any) -> dict[str, httpx.AsyncBaseTransport | None]:
+    """
+    按代理环境变量创建经代理的传输 (httpx.AsyncClient 的 mounts 参数)
+
+    Args:
+        name: 传输后端 (同 create_transport)
+        **options: create_transport 的其他参数
+
+    Returns:
+        URL 模式 -> 经代理的传输; 值为 None 的模式 (NO_PROXY) 使用客户端的默认传输直连
+    """
+    return {
+        pattern: create_transport(name, proxy=proxy, **options) if proxy is not None else None
+        for pattern, proxy in environment_proxies().items()
+    }
+
+
+def transport_stats(transport: httpx.AsyncBaseTransport) -> dict[str, Any]:
+    """
+    连接池实时状态 (httpx 传输读取 httpcore 内部状态, 非公开 API, 读取失败时返回空统计)
+
+    Returns:
+        connections / active / idle / queued / max_connections / http2_streams
+    """
+    pool_stats = getattr(transport, "pool_stats", None)
+    if pool_stats is not None:
+        return pool_stats()
+
+    stats: dict[str, Any] = {
+        "connections": 0,
+        "active": 0,
+        "idle": 0,
+        "queued": 0,
+        "max_connections": 0,
+        "http2_streams": [],
+    }
+    pool = getattr(transport, "_pool", None)
+    if pool is None:
+        return stats
+
+    stats["max_connections"] = pool._max_connections
+    requests = pool._requests
+    stats["queued"] = sum(1 for request in requests if request.is_queued())
+    for connection in pool.connections:
+        if connection.is_closed():
+            continue
+        stats["connections"] += 1
+        if connection.is_idle():
+            stats["idle"] += 1
+        else:
+            stats["active"] += 1
+        inner = getattr(connection, "_connection", None)
+        if inner is not None and type(inner).__name__ == "AsyncHTTP2Connection":
+            stats["http2_streams"].append(inner._request_count)
+    return stats
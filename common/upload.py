@@ -0,0 +1,102 @@
+"""
+上游请求体流式上传
+
+转换后的请求体 (可达数 MB) 原本一次性序列化为完整 bytes 后才开始发送。
+请求体超过 http_stream_upload_chunk_size 时改为分块增量编码:
+- 按顶层字段及其列表元素 (messages / input / tools 中的每一项) 逐段序列化,
+  每段使用 codec.dumps (静态内容直接拼接预先编码的结果, 见 codec.prepare),
+  拼接结果与整体编码逐字节一致
+- 落盘请求体中的大字符串 (spool.Blob) 直接从映射文件分块输出, 不转换为 str
+- 每凑满一块就交给 httpx 发送 (chunked 传输 / HTTP/2 DATA 帧), 编码与上传交替进行,
+  同时不再需要在内存中保留完整的编码结果
+- 请求体对象可重复迭代: 重试 / 对冲的每次尝试重新编码, 互不影响
+"""
+import asyncio
+from collections.abc import AsyncIterator, Iterator
+from typing import Any
+
+from .codec import dumps, dumps_body, encoded, with_content
+from .config import settings
+from .spool import iter_encoded
+
+
+def _segment(prefix: bytes, value: Any) -> Iterator[bytes]:
+    """编码一段 (不含 Blob 时为一个片段)"""
+    pieces = iter_encoded(value, encoded)
+    yield prefix + next(pieces)
+    yield from pieces
+
+
+def iter_json(body: Any) -> Iterator[bytes]:
+    """
+    分段序列化 JSON (拼接结果与 codec.dumps 相同)
+
+    顶层对象按字段拆分, 列表字段再按元素拆分; 其余值整体序列化
+    """
+    if not isinstance(body, dict):
+        yield from iter_encoded(body)
+        return
+
+    yield b"{"
+    for index, (key, value) in enumerate(body.items()):
+        prefix = b"," if index else b""
+        if not isinstance(value, list) or not value:
+            yield from _segment(prefix + dumps(key) + b":", value)
+            continue
+        yield prefix + dumps(key) + b":["
+        for position, item in enumerate(value):
+            yield from _segment(b"," if position else b"", item)
+        yield b"]"
+    yield b"}"
+
+
+class JSONUploadStream:
+    """可重复迭代的分块 JSON 请求体 (传给 httpx 的 content=)"""
+
+    def __init__(self, body: Any, chunk_size: int) -> None:
+        self.body = body
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        parts: list[bytes] = []
+        size = 0
+        for piece in iter_json(self.body):
+            parts.append(piece)
+            size += len(piece)
+            if size >= self.chunk_size:
+                yield b"".join(parts)
+                parts, size = [], 0
+                # 让出事件循环, 大请求体编码期间其他请求照常推进
+                await asyncio.sleep(0)
+        if parts:
+            yield b"".join(parts)
+
+
+def stream_upload(kwargs: dict[str, Any]) -> dict[str, Any]:
+    """
+    把 json= 请求体改为分块上传
+
+    Args:
+        kwargs: 请求参数
+
+    Returns:
+        请求参数; 没有 JSON 请求体时原样返回。未启用或请求体不超过一块时
+        一次性编码为 content= bytes (携带 Content-Length)
+    """
+    body = kwargs.get("json")
+    if body is None:
+        return kwargs
+    if not settings.http_stream_upload_enabled:
+        return with_content(kwargs, b"".join(iter_encoded(body, dumps_body)))
+
+    parts: list[bytes] = []
+    size = 0
+    for piece in iter_json(body):
+        parts.append(piece)
+        size += len(piece)
+        if size >= settings.http_stream_upload_chunk_size:
+            break
+    else:
+        return with_content(kwargs, b"".join(parts))
+
+    return with_content(kwargs, JSONUploadStream(body, settings.http_stream_upload_chunk_size))
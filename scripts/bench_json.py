@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+JSON 编解码基准: 标准库 json 与 common.codec 对比
+
+以仓库中的 Python 源码作为工具结果, 构造接近 Claude Code / Codex 的对话请求体和长文本响应体,
+按请求经过的四条路径分别统计每 MB 的 CPU 耗时 (process_time):
+- ingress: 解析客户端请求体 (原 request.json())
+- upstream: 编码上游请求体 (原 httpx json=)
+- response: 解析上游非流式响应 (原 response.json())
+- render: 返回给客户端 (原 FastAPI jsonable_encoder + JSONResponse)
+
+用法:
+    uv run python scripts/bench_json.py
+    uv run python scripts/bench_json.py --size 4 --rounds 20
+
+codec 列使用当前安装的实现 (orjson 未安装时与标准库基本一致)
+"""
+import argparse
+import json
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import httpx  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from common import codec  # noqa: E402
+
+
+def _sources() -> list[str]:
+    return [path.read_text(encoding="utf-8") for path in sorted(project_root.glob("**/*.py"))]
+
+
+def _conversation(size: int) -> dict[str, Any]:
+    """约 size 字节的对话请求体 (工具调用读取源码文件)"""
+    sources = _sources()
+    messages: list[dict[str, Any]] = []
+    total = 0
+    index = 0
+    while total < size:
+        text = sources[index % len(sources)]
+        messages.append(
+            {
+                "role": "assistant",
+                "content": [
+                    {"type": "text", "text": "让我看一下这个文件。"},
+                    {
+                        "type": "tool_use",
+                        "id": f"toolu_{index}",
+                        "name": "Read",
+                        "input": {"file_path": f"/repo/file_{index}.py"},
+                    },
+                ],
+            }
+        )
+        messages.append(
+            {
+                "role": "user",
+                "content": [
+                    {"type": "tool_result", "tool_use_id": f"toolu_{index}", "content": text}
+                ],
+            }
+        )
+        total += len(text.encode()) + 200
+        index += 1
+    return {
+        "model": "claude-sonnet-4-5",
+        "max_tokens": 32000,
+        "system": [{"type": "text", "text": sources[0]}],
+        "messages": messages,
+        "temperature": 1,
+        "stream": False,
+    }
+
+
+def _response(size: int) -> dict[str, Any]:
+    """约 size 字节的非流式响应体 (多个长文本块)"""
+    sources = _sources()
+    blocks: list[dict[str, Any]] = []
+    total = 0
+    while total < size:
+        text = sources[len(blocks) % len(sources)]
+        blocks.append({"type": "text", "text": text})
+        total += len(text.encode())
+    return {
+        "id": "msg_bench",
+        "type": "message",
+        "role": "assistant",
+        "model": "claude-sonnet-4-5",
+        "content": blocks,
+        "stop_reason": "end_turn",
+        "usage": {"input_tokens": 1000, "output_tokens": 8000},
+    }
+
+
+def _cpu_ms(func: Callable[[], Any], rounds: int) -> float:
+    """单次调用的平均 CPU 耗时 (毫秒)"""
+    func()
+    started = time.process_time()
+    for _ in range(rounds):
+        func()
+    return (time.process_time() - started) / rounds * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--size", type=float, default=1.0, help="请求体 / 响应体大小 (MB)")
+    parser.add_argument("--rounds", type=int, default=30, help="每条路径的重复次数")
+    args = parser.parse_args()
+
+    size = int(args.size * 1024 * 1024)
+    request = _conversation(size)
+    response = _response(size)
+    request_bytes = json.dumps(request, ensure_ascii=False).encode()
+    response_bytes = json.dumps(response, ensure_ascii=False).encode()
+
+    paths: list[tuple[str, int, Callable[[], Any], Callable[[], Any]]] = [
+        (
+            "ingress",
+            len(request_bytes),
+            lambda: json.loads(request_bytes),
+            lambda: codec.loads(request_bytes),
+        ),
+        (
+            "upstream",
+            len(request_bytes),
+            lambda: httpx.Request("POST", "http://upstream/v1/messages", json=request).read(),
+            lambda: codec.dumps(request),
+        ),
+        (
+            "response",
+            len(response_bytes),
+            lambda: json.loads(response_bytes),
+            lambda: codec.loads(response_bytes),
+        ),
+        (
+            "render",
+            len(response_bytes),
+            lambda: JSONResponse(jsonable_encoder(response)).body,
+            lambda: codec.CompactJSONResponse(response).body,
+        ),
+    ]
+
+    print(f"codec backend: {codec.backend}, {args.rounds} rounds\n")
+    print(f"{'path':<10}{'MB':>7}{'json ms/MB':>12}{'codec ms/MB':>13}{'saved ms/MB':>13}{'x':>7}")
+    total_stdlib = total_codec = 0.0
+    for name, nbytes, stdlib, fast in paths:
+        mb = nbytes / 1024 / 1024
+        stdlib_ms = _cpu_ms(stdlib, args.rounds) / mb
+        codec_ms = _cpu_ms(fast, args.rounds) / mb
+        total_stdlib += stdlib_ms
+        total_codec += codec_ms
+        print(
+            f"{name:<10}{mb:>7.2f}{stdlib_ms:>12.2f}{codec_ms:>13.2f}"
+            f"{stdlib_ms - codec_ms:>13.2f}{stdlib_ms / codec_ms:>7.1f}"
+        )
+    print(
+        f"{'total':<10}{'':>7}{total_stdlib:>12.2f}{total_codec:>13.2f}"
+        f"{total_stdlib - total_codec:>13.2f}{total_stdlib / total_codec:>7.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
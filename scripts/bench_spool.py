@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+大请求体落盘基准: 内存中解析与落盘解析 (common.spool) 对比
+
+构造携带多张 base64 图片的对话请求体, 按请求经过的步骤 (解析 -> 转换时深拷贝 -> 编码上游请求体)
+统计 Python 堆的峰值 (tracemalloc) 和耗时:
+- memory: 原始字节 + codec.loads + copy.deepcopy + 整体编码 (关闭分块上传时)
+- spool: 临时文件 mmap + SpooledBody.parse + copy.deepcopy + upload.iter_json 分块编码
+
+mmap 映射的文件页属于页缓存 (可回收), 不计入 Python 堆
+
+用法:
+    uv run python scripts/bench_spool.py
+    uv run python scripts/bench_spool.py --images 6 --image-size 5
+"""
+import argparse
+import base64
+import copy
+import gc
+import mmap
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from common import codec  # noqa: E402
+from common.spool import SpooledBody  # noqa: E402
+from common.upload import iter_json  # noqa: E402
+
+
+def _request(images: int, image_size: int) -> bytes:
+    """携带 images 张约 image_size 字节图片的请求体"""
+    paths = sorted(project_root.glob("common/*.py"))
+    sources = [path.read_text(encoding="utf-8") for path in paths]
+    messages: list[dict[str, Any]] = [
+        {"role": "user", "content": [{"type": "text", "text": text}]} for text in sources
+    ]
+    messages.append(
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "source": {
+                        "type": "base64",
+                        "media_type": "image/png",
+                        "data": base64.b64encode(os.urandom(image_size)).decode(),
+                    },
+                }
+                for _ in range(images)
+            ]
+            + [{"type": "text", "text": "描述这些图片"}],
+        }
+    )
+    return codec.dumps({"model": "claude-sonnet-4-5", "max_tokens": 4096, "messages": messages})
+
+
+def _in_memory(raw: bytes) -> int:
+    body = codec.loads(raw)
+    transformed = copy.deepcopy(body)
+    return len(codec.dumps(transformed))
+
+
+def _spooled(raw: bytes) -> int:
+    with tempfile.TemporaryFile() as file:
+        file.write(raw)
+        file.flush()
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    body = SpooledBody(data).parse()
+    transformed = copy.deepcopy(body)
+    return sum(len(piece) for piece in iter_json(transformed))
+
+
+def _measure(func: Callable[[bytes], int], raw: bytes) -> tuple[float, float, int]:
+    """(峰值 MB, 耗时 ms, 编码结果大小); 原始字节在测量前已存在, 不计入峰值"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = func(raw)
+    elapsed = (time.perf_counter() - started) * 1000
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return peak, elapsed, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--images", type=int, default=4, help="图片数量")
+    parser.add_argument("--image-size", type=float, default=5.0, help="每张图片的大小 (MB)")
+    args = parser.parse_args()
+
+    raw = _request(args.images, int(args.image_size * 1024 * 1024))
+    print(f"codec backend: {codec.backend}, request body {len(raw) / 1024 / 1024:.1f} MB\n")
+    print(f"{'path':<10}{'peak MB':>10}{'ms':>10}{'encoded MB':>12}")
+    for name, func in (("memory", _in_memory), ("spool", _spooled)):
+        peak, elapsed, size = _measure(func, raw)
+        print(f"{name:<10}{peak:>10.1f}{elapsed:>10.0f}{size / 1024 / 1024:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
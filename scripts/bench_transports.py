@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+上游传输后端对比基准
+
+在子进程中启动本地 TLS mock 上游 (ALPN 协商 HTTP/2 或 HTTP/1.1, 返回 SSE 流),
+对每个传输后端 (common.transports) 并发发起流式请求, 统计:
+- CPU ms/MB: 客户端进程 CPU 时间 / 收到的流式数据量 (mock 上游的 CPU 不计入)
+- 事件延迟 p50 / p99: mock 上游写出事件到客户端收到完整事件的时间
+
+用法:
+    uv run python scripts/bench_transports.py
+    uv run python scripts/bench_transports.py --streams 100 --transports http2,http2x4,http1
+
+传输名后缀 xN 表示拆分为 N 个子传输 (如 http2x4); aiohttp 未安装时跳过
+"""
+import argparse
+import asyncio
+import multiprocessing
+import re
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+import h2.config  # noqa: E402
+import h2.connection  # noqa: E402
+import h2.events  # noqa: E402
+import h2.exceptions  # noqa: E402
+import httpx  # noqa: E402
+
+from common.transports import aiohttp, create_transport  # noqa: E402
+
+_TIMESTAMP = re.compile(rb'"t":(\d+)')
+
+
+# ---------------------------------------------------------------------------
+# mock 上游 (子进程)
+# ---------------------------------------------------------------------------
+
+
+def _event(size: int) -> bytes:
+    """一个 SSE 事件 (携带写出时间, 填充到 size 字节)"""
+    head = b'data: {"t":%d,"pad":"' % time.monotonic_ns()
+    tail = b'"}\n\n'
+    return head + b"x" * max(0, size - len(head) - len(tail)) + tail
+
+
+async def _serve_h1(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, args: argparse.Namespace
+) -> None:
+    while True:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+        headers = {
+            name.strip().lower(): value.strip()
+            for name, _, value in (line.partition(b":") for line in head.split(b"\r\n")[1:])
+            if name
+        }
+        if b"content-length" in headers:
+            await reader.readexactly(int(headers[b"content-length"]))
+        elif headers.get(b"transfer-encoding") == b"chunked":
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).strip(), 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\n"
+            b"transfer-encoding: chunked\r\n\r\n"
+        )
+        for _ in range(args.events):
+            payload = _event(args.event_size)
+            writer.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            await writer.drain()
+            await asyncio.sleep(args.interval)
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+async def _respond_h2(
+    conn: h2.connection.H2Connection,
+    writer: asyncio.StreamWriter,
+    stream_id: int,
+    window: asyncio.Event,
+    args: argparse.Namespace,
+) -> None:
+    try:
+        conn.send_headers(stream_id, [(":status", "200"), ("content-type", "text/event-stream")])
+        writer.write(conn.data_to_send())
+        for _ in range(args.events):
+            payload = _event(args.event_size)
+            while conn.local_flow_control_window(stream_id) < len(payload):
+                window.clear()
+                await window.wait()
+            conn.send_data(stream_id, payload)
+            writer.write(conn.data_to_send())
+            await writer.drain()
+            await asyncio.sleep(args.interval)
+        conn.end_stream(stream_id)
+        writer.write(conn.data_to_send())
+    except (h2.exceptions.StreamClosedError, ConnectionError):
+        pass
+
+
+async def _serve_h2(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, args: argparse.Namespace
+) -> None:
+    conn = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False))
+    conn.initiate_connection()
+    writer.write(conn.data_to_send())
+    window = asyncio.Event()
+    tasks: set[asyncio.Task[None]] = set()
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        for event in conn.receive_data(data):
+            if isinstance(event, h2.events.DataReceived):
+                conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                task = asyncio.create_task(
+                    _respond_h2(conn, writer, event.stream_id, window, args)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            elif isinstance(event, h2.events.WindowUpdated):
+                window.set()
+        writer.write(conn.data_to_send())
+    for task in tasks:
+        task.cancel()
+
+
+def _run_upstream(
+    cert: str, key: str, args: argparse.Namespace, ports: "multiprocessing.Queue[int]"
+) -> None:
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        protocol = writer.get_extra_info("ssl_object").selected_alpn_protocol()
+        try:
+            if protocol == "h2":
+                await _serve_h2(reader, writer, args)
+            else:
+                await _serve_h1(reader, writer, args)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def main() -> None:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        context.set_alpn_protocols(["h2", "http/1.1"])
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=context)
+        ports.put(server.sockets[0].getsockname()[1])
+        await server.serve_forever()
+
+    asyncio.run(main())
+
+
+# ---------------------------------------------------------------------------
+# 客户端
+# ---------------------------------------------------------------------------
+
+
+async def _consume(
+    client: httpx.AsyncClient, url: str, body: bytes, latencies: list[float]
+) -> int:
+    """发起一个流式请求, 记录每个完整事件的延迟, 返回收到的字节数"""
+    received = 0
+    buffer = b""
+    async with client.stream("POST", url, content=body) as response:
+        async for chunk in response.aiter_raw():
+            now = time.monotonic_ns()
+            received += len(chunk)
+            buffer += chunk
+            *events, buffer = buffer.split(b"\n\n")
+            for event in events:
+                match = _TIMESTAMP.search(event)
+                if match is not None:
+                    latencies.append((now - int(match.group(1))) / 1e6)
+    return received
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else float("nan")
+
+
+async def _bench(name: str, port: int, cert: str, args: argparse.Namespace) -> dict[str, float]:
+    kind, _, stripes = name.partition("x")
+    transport = create_transport(
+        kind,
+        stripes=int(stripes or 1),
+        max_connections=args.streams,
+        max_keepalive=args.streams,
+        keepalive_expiry=30.0,
+        verify=ssl.create_default_context(cafile=cert),
+    )
+    url = f"https://127.0.0.1:{port}/v1/messages"
+    body = b'{"model":"bench","stream":true,"pad":"' + b"x" * args.body_size + b'"}'
+    latencies: list[float] = []
+    async with httpx.AsyncClient(transport=transport, timeout=60) as client:
+        # 预热: 建立连接, 不计入统计
+        await asyncio.gather(
+            *(_consume(client, url, body, []) for _ in range(min(4, args.streams)))
+        )
+
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        received = await asyncio.gather(
+            *(_consume(client, url, body, latencies) for _ in range(args.streams))
+        )
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+
+    megabytes = sum(received) / 1e6
+    return {
+        "mb": megabytes,
+        "cpu_s": cpu,
+        "cpu_ms_per_mb": cpu * 1000 / megabytes,
+        "p50_ms": _percentile(latencies, 0.5),
+        "p99_ms": _percentile(latencies, 0.99),
+        "wall_s": wall,
+    }
+
+
+def _self_signed(directory: str) -> tuple[str, str]:
+    cert, key = f"{directory}/cert.pem", f"{directory}/key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+            "-addext", "subjectAltName=IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter
+    )
+    parser.add_argument("--transports", default="http2,http2x4,http1,aiohttp")
+    parser.add_argument("--streams", type=int, default=50, help="并发流数")
+    parser.add_argument("--events", type=int, default=400, help="每个流的事件数")
+    parser.add_argument("--event-size", type=int, default=1024, help="每个事件的字节数")
+    parser.add_argument("--interval", type=float, default=0.002, help="事件间隔 (秒)")
+    parser.add_argument("--body-size", type=int, default=2048, help="请求体大小 (字节)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = _self_signed(directory)
+        ports: multiprocessing.Queue[int] = multiprocessing.Queue()
+        upstream = multiprocessing.Process(
+            target=_run_upstream, args=(cert, key, args, ports), daemon=True
+        )
+        upstream.start()
+        port = ports.get(timeout=10)
+
+        print(
+            f"{args.streams} streams x {args.events} events x {args.event_size} B, "
+            f"interval {args.interval * 1000:.1f} ms\n"
+        )
+        print(
+            f"{'transport':<12}{'MB':>8}{'CPU s':>8}{'CPU ms/MB':>11}"
+            f"{'p50 ms':>9}{'p99 ms':>9}{'wall s':>8}"
+        )
+        try:
+            for name in args.transports.split(","):
+                if name.startswith("aiohttp") and aiohttp is None:
+                    print(f"{name:<12}skipped (aiohttp not installed)")
+                    continue
+                result = asyncio.run(_bench(name, port, cert, args))
+                print(
+                    f"{name:<12}{result['mb']:>8.1f}{result['cpu_s']:>8.2f}"
+                    f"{result['cpu_ms_per_mb']:>11.1f}{result['p50_ms']:>9.2f}"
+                    f"{result['p99_ms']:>9.2f}{result['wall_s']:>8.2f}"
+                )
+        finally:
+            upstream.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+预先编码的静态内容验证脚本
+
+注入上游请求体的静态内容 (CLAUDE_CODE_SYSTEM / CODEX_INSTRUCTIONS / CODEX_DEFAULT_TOOLS) 启动时
+编码一次, 编码请求体时直接拼接 (见 common.codec.prepare)。本脚本验证:
+1. 静态内容已登记, 且登记的编码结果与当前内容一致 (未被修改)
+2. CherryStudio 请求经过 service-cc / service-cx 适配器转换后, 拼接编码 (dumps_body)
+   和分块上传编码 (upload.iter_json) 与整体编码 (codec.dumps) 逐字节一致,
+   并与标准库 json 的紧凑编码一致
+3. 多次转换后静态内容保持不变 (转换不修改共享的静态对象)
+
+用法:
+    uv run python scripts/validate_fragments.py
+"""
+import importlib
+import json
+import sys
+from pathlib import Path
+from typing import Any
+
+# 添加项目根目录到 Python 路径
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from common import codec  # noqa: E402
+from common.adapters import AdapterContext  # noqa: E402
+from common.upload import iter_json  # noqa: E402
+
+# 服务目录名带连字符, 通过 importlib 导入
+claude_code = importlib.import_module("service-cc.formats.claude_code")
+codex_instructions = importlib.import_module("service-cx.formats.codex_instructions")
+codex_tools = importlib.import_module("service-cx.formats.codex_tools")
+cc_adapter = importlib.import_module("service-cc.adapters.cherry_studio")
+cx_adapter = importlib.import_module("service-cx.adapters.cherry_studio")
+
+HEADERS = {"user-agent": "CherryStudio/1.6.5"}
+
+CLAUDE_REQUESTS: list[dict[str, Any]] = [
+    {"model": "claude-sonnet-4-5", "messages": [{"role": "user", "content": "你好"}]},
+    {
+        "model": "claude-sonnet-4-5",
+        "system": "Answer in \"quotes\" and 中文.\n",
+        "stream": True,
+        "max_tokens": 4096,
+        "temperature": 0.7,
+        "thinking": {"type": "enabled", "budget_tokens": 2048},
+        "tools": [
+            {
+                "name": "get_weather",
+                "description": "查询天气",
+                "input_schema": {"type": "object", "properties": {"city": {"type": "string"}}},
+            }
+        ],
+        "messages": [
+            {"role": "user", "content": [{"type": "text", "text": "北京天气?"}]},
+            {"role": "assistant", "content": "让我查一下   \\ /"},
+            {"role": "user", "content": [{"type": "text", "text": "谢谢"}]},
+        ],
+    },
+]
+
+CODEX_REQUESTS: list[dict[str, Any]] = [
+    {"model": "gpt-5-codex", "input": "Hello"},
+    {
+        "model": "gpt-5-codex",
+        "stream": True,
+        "reasoning": {"effort": "high"},
+        "tool_choice": "auto",
+        "tools": [
+            {
+                "type": "function",
+                "name": "lookup",
+                "description": "查询 \"内部\" 文档",
+                "parameters": {"type": "object", "properties": {"q": {"type": "string"}}},
+            }
+        ],
+        "input": [
+            {"role": "system", "content": "Be brief."},
+            {"role": "user", "content": [{"type": "input_text", "text": "列出 ~/src 下的文件"}]},
+        ],
+    },
+]
+
+
+def _stdlib(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def validate_registered() -> None:
+    """静态内容已登记, 且编码结果与当前内容一致"""
+    statics = {
+        "CLAUDE_CODE_SYSTEM": claude_code.CLAUDE_CODE_SYSTEM,
+        "CODEX_INSTRUCTIONS": codex_instructions.CODEX_INSTRUCTIONS,
+        "CODEX_DEFAULT_TOOLS": codex_tools.CODEX_DEFAULT_TOOLS,
+    }
+    registered = {id(value): data for value, data in codec.prepared()}
+    for name, value in statics.items():
+        assert id(value) in registered, f"{name} 未登记"
+    for value, data in codec.prepared():
+        assert data == codec.dumps(value), f"登记后被修改: {str(value)[:80]}"
+    print(f"registered: {len(registered)} values, {sum(map(len, registered.values()))} bytes")
+
+
+def _check(name: str, body: dict[str, Any]) -> int:
+    """验证单个转换后请求体的编码, 返回拼接的静态内容数"""
+    expected = codec.dumps(body)
+    assert codec.dumps_body(body) == expected, f"{name}: dumps_body 与 dumps 不一致"
+    assert b"".join(iter_json(body)) == expected, f"{name}: iter_json 与 dumps 不一致"
+    assert expected == _stdlib(body), f"{name}: 与标准库编码不一致"
+
+    registered = {id(value) for value, _ in codec.prepared()}
+    spliced = 0
+    for value in body.values():
+        if id(value) in registered:
+            spliced += 1
+        elif isinstance(value, list):
+            spliced += sum(1 for item in value if id(item) in registered)
+    return spliced
+
+
+def validate_requests() -> None:
+    """适配器转换后的请求体编码逐字节一致"""
+    adapters = (
+        ("service-cc", cc_adapter.CherryStudioAdapter(), CLAUDE_REQUESTS, "system"),
+        ("service-cx", cx_adapter.CherryStudioAdapter(), CODEX_REQUESTS, "instructions"),
+    )
+    for service, adapter, requests, field in adapters:
+        for index, request in enumerate(requests):
+            # 转换两次: 第二次验证第一次转换没有修改共享的静态内容
+            for attempt in range(2):
+                result = adapter.transform(
+                    AdapterContext(raw_body=json.loads(json.dumps(request)), raw_headers=HEADERS)
+                )
+                assert field in result.body, f"{service}[{index}]: 未注入 {field}"
+                spliced = _check(f"{service}[{index}]#{attempt}", result.body)
+                assert spliced > 0, f"{service}[{index}]: 没有拼接静态内容"
+            print(
+                f"{service}[{index}]: {len(codec.dumps(result.body))} bytes identical, "
+                f"{spliced} static fragments spliced"
+            )
+
+
+def main() -> None:
+    print(f"codec backend: {codec.backend}")
+    validate_registered()
+    validate_requests()
+    # 转换后再次确认静态内容未被修改
+    validate_registered()
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()
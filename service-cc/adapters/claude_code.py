@@ -7,6 +7,7 @@ Claude Code CLI 客户端适配器
 
 from common.adapters import AdapterContext, ClientAdapter, TransformResult
 from common.logger import get_logger
+from common.rawjson import field_count
 
 logger = get_logger(__name__)
 
@@ -17,6 +18,7 @@ class ClaudeCodeAdapter(ClientAdapter):
     name = "claude_code"
     priority = 100  # 最高优先级 (官方客户端)
     version = "1.0.0"
+    passthrough = True  # 原始请求字节直接转发, 不解析 / 重新序列化
 
     def detect(self, ctx: AdapterContext) -> bool:
         """
@@ -69,8 +71,8 @@ class ClaudeCodeAdapter(ClientAdapter):
         logger.info(
             "claude_code_passthrough",
             adapter=self.name,
-            system_blocks=len(body.get("system", [])),
-            tools_count=len(body.get("tools", [])),
+            system_blocks=field_count(body, "system"),
+            tools_count=field_count(body, "tools"),
             thinking_enabled=thinking_enabled,
             has_metadata=has_metadata,
             user_id=body.get("metadata", {}).get("user_id") if has_metadata else None,
@@ -74,8 +74,21 @@ class AdapterManager:
         Returns:
             转换结果 (包含 body + extra_headers + metadata)
         """
-        adapter = self.select_adapter(ctx)
+        return self.apply(self.select_adapter(ctx), ctx)
+
+    def apply(self, adapter: ClientAdapter, ctx: AdapterContext) -> TransformResult:
+        """
+        应用指定适配器的转换 (适配器已由 select_adapter 选出)
+
+        Args:
+            adapter: 适配器
+            ctx: 适配器上下文
+
+        Returns:
+            转换结果 (包含 body + extra_headers + metadata)
+        """
         result = adapter.transform(ctx)
+        result.priority = adapter.priority
 
         logger.info(
             "request_transformed",
@@ -0,0 +1,301 @@
+"""
+Claude 流式响应续写
+
+上游连接在流式响应中途断开 (或返回 overloaded_error 等错误事件) 时, 以已转发给
+客户端的文本作为 assistant prefill 重新请求, 并将续写结果拼接到同一个客户端 SSE 流中:
+- 丢弃续写流的 message_start, 合并续写流第一个文本块到客户端当前未结束的文本块
+- 重写 content block 索引, 使客户端看到连续的索引
+- 重写 message_delta 的 usage: output_tokens 加上中断前已生成的 token 数
+  (由续写请求与原请求输入 token 数之差估算), 输入 token 数保持为原请求的值
+
+仅在已转发的内容全部为文本块、且请求未启用 extended thinking / 强制工具调用时续写
+"""
+from typing import Any
+
+from common import codec
+from common.config import settings
+from common.rawjson import RawJSON
+from common.types import JSONData
+
+# 可续写的上游错误事件类型
+RESUMABLE_ERROR_TYPES = frozenset({"overloaded_error", "api_error"})
+
+# 计入输入 token 总数的 usage 字段
+_INPUT_USAGE_KEYS = ("input_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+class StreamInterruptedError(Exception):
+    """上游流在 message_stop 之前中断 (可续写)"""
+
+    def __init__(self, reason: str) -> None:
+        self.reason = reason
+        super().__init__(f"Upstream stream interrupted: {reason}")
+
+
+def _parse_event(raw: bytes) -> tuple[str | None, JSONData | None]:
+    """解析单个 SSE 事件, 返回 (事件类型, data JSON)"""
+    event_type: str | None = None
+    data_lines: list[bytes] = []
+    for line in raw.split(b"\n"):
+        if line.startswith(b"event:"):
+            event_type = line[6:].strip().decode("utf-8", errors="ignore")
+        elif line.startswith(b"data:"):
+            data_lines.append(line[6:] if line[5:6] == b" " else line[5:])
+    if not data_lines:
+        return event_type, None
+    try:
+        data = codec.loads(b"\n".join(data_lines))
+    except ValueError:
+        return event_type, None
+    if not isinstance(data, dict):
+        return event_type, None
+    return event_type or data.get("type"), data
+
+
+def _render_event(event_type: str, data: JSONData) -> bytes:
+    """渲染 SSE 事件 (与 Anthropic 相同的紧凑 JSON 格式)"""
+    return b"event: " + event_type.encode() + b"\ndata: " + codec.dumps(data) + b"\n\n"
+
+
+def _total_input(usage: dict[str, Any]) -> int:
+    """输入 token 总数 (含缓存读写)"""
+    return sum(int(usage.get(key) or 0) for key in _INPUT_USAGE_KEYS)
+
+
+class StreamContinuation:
+    """
+    跟踪客户端已收到的 SSE 内容, 并在中断后把续写流拼接进来
+
+    首次请求的事件原样转发 (字节不变); 续写请求的事件经过重写后转发
+    """
+
+    def __init__(self, body: JSONData | RawJSON) -> None:
+        self.body = body
+        self.request_body: JSONData | RawJSON = body
+        self.resumes = 0
+        self.started = False
+        self.complete = False
+        self.stop_reason: str | None = None
+
+        self._buffer = b""
+        self._pending: list[bytes] = []  # 中断前已处理、尚未转发的事件
+        self._usage: dict[str, Any] = {}
+        self._blocks: list[dict[str, Any]] = []  # 客户端可见的 content block
+        self._open_index: int | None = None
+
+        # 续写状态
+        self._resuming = False
+        self._index_map: dict[int, int] = {}
+        self._output_offset = 0
+        self._pending_whitespace = ""
+
+        thinking = body.get("thinking")
+        tool_choice = body.get("tool_choice")
+        self._body_resumable = not (
+            (isinstance(thinking, dict) and thinking.get("type") == "enabled")
+            or (isinstance(tool_choice, dict) and tool_choice.get("type") in ("any", "tool"))
+        )
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """
+        处理上游数据块
+
+        Returns:
+            需要转发给客户端的完整 SSE 事件 (不完整的事件留在缓冲区)
+
+        Raises:
+            StreamInterruptedError: 上游返回可续写的错误事件 (同一数据块中错误事件之前的事件
+                已计入客户端可见的内容, 需先通过 take_pending 取出并转发)
+        """
+        self._buffer += chunk
+        if b"\n\n" not in self._buffer:
+            return []
+
+        *events, self._buffer = self._buffer.split(b"\n\n")
+        output: list[bytes] = []
+        try:
+            for raw in events:
+                if raw.strip():
+                    output.extend(self._process(raw + b"\n\n"))
+        except StreamInterruptedError:
+            self._pending = output
+            raise
+        return output
+
+    def take_pending(self) -> list[bytes]:
+        """取出中断时已处理但尚未转发的事件 (续写前转发, 使 prefill 与客户端收到的内容一致)"""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def flush(self) -> bytes:
+        """取出缓冲区中剩余的不完整数据 (上游流结束且无法续写时原样转发)"""
+        remaining, self._buffer = self._buffer, b""
+        return remaining
+
+    def can_resume(self) -> bool:
+        """当前是否可以续写"""
+        return (
+            settings.stream_resume_enabled
+            and self._body_resumable
+            and self.started
+            and not self.complete
+            and self.stop_reason is None
+            and self.resumes < settings.stream_resume_max_attempts
+            and all(block["type"] == "text" for block in self._blocks)
+        )
+
+    def prepare_resume(self) -> JSONData:
+        """
+        准备续写请求
+
+        Returns:
+            续写请求体 (已转发的文本作为 assistant prefill)
+        """
+        text = "".join(block["text"] for block in self._blocks)
+        prefill = text.rstrip()
+        # prefill 不能以空白结尾; 已转发的尾部空白在续写开头去重
+        self._pending_whitespace = text[len(prefill):]
+
+        self.resumes += 1
+        self._resuming = True
+        self._index_map = {}
+        self._buffer = b""
+        self.request_body = {
+            **self.body,
+            "messages": _with_prefill(self.body.get("messages", []), prefill),
+        }
+        return self.request_body
+
+    def finish_event(self) -> bytes:
+        """message_delta 之后中断时补发的 message_stop 事件"""
+        self.complete = True
+        return _render_event("message_stop", {"type": "message_stop"})
+
+    @property
+    def streamed_chars(self) -> int:
+        """已转发的文本字符数"""
+        return sum(len(block["text"]) for block in self._blocks)
+
+    def _process(self, raw: bytes) -> list[bytes]:
+        event_type, data = _parse_event(raw)
+
+        if event_type == "error" and data is not None:
+            error_type = (data.get("error") or {}).get("type")
+            if error_type in RESUMABLE_ERROR_TYPES and self.can_resume():
+                raise StreamInterruptedError(error_type)
+            return [raw]
+
+        if data is None or event_type is None:
+            return [raw]
+        if not self._resuming:
+            self._observe(event_type, data)
+            return [raw]
+        return self._splice(event_type, data, raw)
+
+    def _splice(self, event_type: str, data: JSONData, raw: bytes) -> list[bytes]:
+        """重写续写流的事件"""
+        if event_type == "message_start":
+            usage = (data.get("message") or {}).get("usage") or {}
+            # 续写请求多出的输入 token 即中断前已生成的输出 token
+            self._output_offset = max(0, _total_input(usage) - _total_input(self._usage))
+            return []
+
+        output: list[bytes] = []
+        if event_type == "content_block_start":
+            index = data.get("index", 0)
+            block = data.get("content_block") or {}
+            if (
+                not self._index_map
+                and block.get("type") == "text"
+                and self._open_index is not None
+                and self._blocks[self._open_index]["type"] == "text"
+            ):
+                # 续写的第一个文本块并入客户端当前的文本块
+                self._index_map[index] = self._open_index
+                return []
+            if self._open_index is not None:
+                stop = {"type": "content_block_stop", "index": self._open_index}
+                self._observe("content_block_stop", stop)
+                output.append(_render_event("content_block_stop", stop))
+            self._index_map[index] = len(self._blocks)
+            data = {**data, "index": self._index_map[index]}
+
+        elif event_type in ("content_block_delta", "content_block_stop"):
+            index = data.get("index", 0)
+            data = {**data, "index": self._index_map.get(index, index)}
+            delta = data.get("delta") or {}
+            if event_type == "content_block_delta" and delta.get("type") == "text_delta":
+                text = self._dedupe_whitespace(delta.get("text", ""))
+                if not text:
+                    return []
+                data["delta"] = {**delta, "text": text}
+
+        elif event_type == "message_delta":
+            usage = dict(data.get("usage") or {})
+            if "output_tokens" in usage:
+                usage["output_tokens"] = int(usage["output_tokens"] or 0) + self._output_offset
+            for key in _INPUT_USAGE_KEYS:
+                if key in usage and key in self._usage:
+                    usage[key] = self._usage[key]
+            data = {**data, "usage": usage}
+
+        else:
+            # ping / message_stop 等事件原样转发
+            self._observe(event_type, data)
+            return [raw]
+
+        self._observe(event_type, data)
+        output.append(_render_event(event_type, data))
+        return output
+
+    def _dedupe_whitespace(self, text: str) -> str:
+        """去掉续写开头与已转发尾部空白重复的部分"""
+        while self._pending_whitespace and text and text[0] == self._pending_whitespace[0]:
+            text = text[1:]
+            self._pending_whitespace = self._pending_whitespace[1:]
+        if text:
+            self._pending_whitespace = ""
+        return text
+
+    def _observe(self, event_type: str, data: JSONData) -> None:
+        """更新客户端可见的消息状态"""
+        if event_type == "message_start":
+            self.started = True
+            self._usage = dict((data.get("message") or {}).get("usage") or {})
+        elif event_type == "content_block_start":
+            block = data.get("content_block") or {}
+            self._blocks.append({"type": block.get("type"), "text": block.get("text") or ""})
+            self._open_index = len(self._blocks) - 1
+        elif event_type == "content_block_delta":
+            delta = data.get("delta") or {}
+            index = data.get("index", 0)
+            if delta.get("type") == "text_delta" and index < len(self._blocks):
+                self._blocks[index]["text"] += delta.get("text", "")
+        elif event_type == "content_block_stop":
+            self._open_index = None
+        elif event_type == "message_delta":
+            self.stop_reason = (data.get("delta") or {}).get("stop_reason")
+        elif event_type == "message_stop":
+            self.complete = True
+
+
+def _with_prefill(messages: list[JSONData], prefill: str) -> list[JSONData]:
+    """在消息列表末尾追加 (或合并到已有的) assistant prefill"""
+    if not prefill:
+        return messages
+
+    last = messages[-1] if messages else None
+    if last is None or last.get("role") != "assistant":
+        return [*messages, {"role": "assistant", "content": prefill}]
+
+    content = last.get("content")
+    if isinstance(content, str):
+        merged: str | list[Any] = content + prefill
+    else:
+        blocks = list(content or [])
+        if blocks and isinstance(blocks[-1], dict) and blocks[-1].get("type") == "text":
+            blocks[-1] = {**blocks[-1], "text": blocks[-1].get("text", "") + prefill}
+        else:
+            blocks.append({"type": "text", "text": prefill})
+        merged = blocks
+    return [*messages[:-1], {**last, "content": merged}]
@@ -2,6 +2,7 @@
 Claude Code CLI 2.0.24 官方格式定义
 包含 System 提示词和标准请求头
 """
+from common.codec import prepare
 
 # Claude Code 官方 System 提示词
 CLAUDE_CODE_SYSTEM = [
@@ -12,6 +13,9 @@ CLAUDE_CODE_SYSTEM = [
     }
 ]
 
+# 启动时编码一次并转换为只读结构, 所有请求共享 (见 common.codec.prepare)
+CLAUDE_CODE_SYSTEM = prepare(CLAUDE_CODE_SYSTEM)
+
 # Claude Code 官方请求头
 CLAUDE_CODE_HEADERS = {
     "anthropic-version": "2023-06-01",
@@ -2,16 +2,29 @@
 Claude Service 主应用
 处理 Claude API 请求转换和代理
 """
+import os
 from contextlib import asynccontextmanager
 from typing import Any
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from common import codec
+from common.balancer import get_upstream_groups
+from common.coalescing import coalescer
+from common.compression import compressor
 from common.config import settings
+from common.disconnect import CancelOnDisconnectMiddleware
+from common.dns import dns_cache
 from common.http_client import http_client
+from common.idempotency import idempotency
+from common.key_pool import get_key_pools
 from common.logger import configure_logging, get_logger
+from common.memory_budget import MemoryBudgetMiddleware, memory_budget
+from common.metrics import metrics
+from common.pacing import pacer
 
+from .proxy import anthropic_upstream
 from .router import router as claude_router
 
 # 配置日志系统
@@ -26,12 +39,20 @@ async def lifespan(app: FastAPI):
         "claude_service_starting",
         app_name="Claude Service",
         version=settings.app_version,
-        anthropic_base_url=settings.anthropic_base_url,
+        endpoints=anthropic_upstream.base_urls,
+        json_backend=codec.backend,
     )
 
+    # 预热上游连接并保持连接池常热 (避免重启后首个请求承担建连开销)
+    await http_client.prewarm(anthropic_upstream.base_urls)
+    http_client.start_keepwarm(anthropic_upstream.base_urls)
+    # 多端点时探测长时间没有流量的端点
+    anthropic_upstream.start_probing(http_client.ping)
+
     yield
 
     # 关闭时的清理逻辑
+    anthropic_upstream.stop_probing()
     logger.info("claude_service_shutdown")
     await http_client.close()
 
@@ -44,6 +65,7 @@ app = FastAPI(
     docs_url="/docs" if settings.debug else None,
     redoc_url="/redoc" if settings.debug else None,
     lifespan=lifespan,
+    default_response_class=codec.CompactJSONResponse,
 )
 
 # CORS 中间件
@@ -56,6 +78,12 @@ app.add_middleware(
     expose_headers=["*"],
 )
 
+# 客户端断开时立即取消请求处理 (释放上游流和连接)
+app.add_middleware(CancelOnDisconnectMiddleware)
+
+# 按进程内存预算准入请求 (最外层, 在读取请求体之前拒绝或排队)
+app.add_middleware(MemoryBudgetMiddleware)
+
 
 @app.get("/", tags=["Root"])
 async def root() -> dict[str, Any]:
@@ -78,6 +106,31 @@ async def health() -> dict[str, str]:
     }
 
 
+@app.get("/stats", tags=["Health"])
+async def stats() -> dict[str, Any]:
+    """
+    运行时统计 (仅当前 worker 进程)
+
+    包含各连接池占用 (连接数、等待队列、HTTP/2 stream 数、连接抖动)、并发限制器状态、各 API Key 的限流额度、租户 Key 池、请求体压缩协商状态、内存预算和指标快照
+    """
+    return {
+        "service": "claude-service",
+        "pid": os.getpid(),
+        "pools": http_client.pool_stats(),
+        "warmup": http_client.warm_stats,
+        "upstreams": {name: group.stats() for name, group in get_upstream_groups().items()},
+        "limiters": http_client.limiter_stats(),
+        "ratelimits": await pacer.stats(),
+        "key_pools": {name: pools.stats() for name, pools in get_key_pools().items()},
+        "compression": compressor.stats(),
+        "dns": dns_cache.stats(),
+        "idempotency": idempotency.stats(),
+        "coalescing": coalescer.stats(),
+        "memory": memory_budget.stats(),
+        "metrics": metrics.snapshot(),
+    }
+
+
 # 注册路由
 app.include_router(claude_router, tags=["claude"])
 
@@ -2,57 +2,81 @@
 Claude API 代理逻辑
 负责转发请求到 Anthropic API
 """
+import json
 from collections.abc import AsyncIterator
+from contextlib import aclosing
 
 import httpx
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 
+from common import codec
+from common.balancer import UpstreamGroup
 from common.config import settings
-from common.errors import ServiceUnavailableError
+from common.errors import GatewayTimeoutError, ProxyError, ServiceUnavailableError
 from common.http_client import http_client
+from common.key_pool import KeyPool, KeyPools
 from common.logger import get_logger
+from common.metrics import metrics
+from common.rawjson import RawJSON, body_kwargs, field_count, raw_response
+from common.timeouts import UpstreamTimeoutError
 from common.types import JSONData
 
+from .continuation import StreamContinuation, StreamInterruptedError
 from .formats.claude_code import build_claude_code_headers
 
 logger = get_logger(__name__)
 
+# Anthropic 上游端点组 (多端点时按延迟负载均衡)
+anthropic_upstream = UpstreamGroup("anthropic", settings.anthropic_endpoints)
+
+# 内部租户的上游 Key 池 (调用方 Key 属于某个租户时替换为池中的 Key)
+anthropic_key_pools = KeyPools(anthropic_upstream.name, settings.anthropic_key_pools)
+
 
 async def proxy_to_anthropic(
-    body: JSONData,
+    body: JSONData | RawJSON,
     api_key: str,
     stream: bool = False,
-) -> StreamingResponse | JSONData:
+) -> StreamingResponse | Response | JSONData:
     """
     代理请求到 Anthropic API
 
     Args:
-        body: 请求体 (已经过适配器转换)
+        body: 请求体 (已经过适配器转换; RawJSON 原样转发原始字节)
         api_key: Anthropic API Key
         stream: 是否流式响应
 
     Returns:
-        StreamingResponse (流式) 或 JSONData (非流式)
+        StreamingResponse (流式); 非流式时为原样返回上游响应体的 RawJSONResponse,
+        未启用 response_passthrough_enabled 时为解析后的 JSONData
 
     Raises:
         ServiceUnavailableError: 服务不可用
         httpx.HTTPStatusError: HTTP 错误
     """
-    url = f"{settings.anthropic_base_url}/v1/messages"
+    path = "/v1/messages"
     headers = build_claude_code_headers(api_key)
+    key_pool = anthropic_key_pools.for_client(api_key)
 
     logger.info(
         "proxy_request_start",
-        url=url,
+        upstream=anthropic_upstream.name,
+        path=path,
         stream=stream,
         model=body.get("model"),
-        message_count=len(body.get("messages", [])),
+        message_count=field_count(body, "messages"),
+        key_pool=key_pool.tenant if key_pool is not None else None,
     )
 
     try:
         if stream:
+            # 所有端点均熔断 (503) 或并发排队已满 (429) 时直接返回错误, 而不是在流中返回错误事件
+            anthropic_upstream.check_available()
+            http_client.check_capacity(anthropic_upstream)
+            if key_pool is not None:
+                key_pool.check_available()
             return StreamingResponse(
-                _stream_anthropic_response(url, body, headers),
+                _stream_anthropic_response(path, body, headers, key_pool),
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -62,8 +86,11 @@ async def proxy_to_anthropic(
             )
         response = await http_client.request(
             "POST",
-            url,
-            json=body,
+            path,
+            upstream=anthropic_upstream,
+            model=body.get("model"),
+            key_pool=key_pool,
+            **body_kwargs(body),
             headers=headers,
         )
 
@@ -73,7 +100,7 @@ async def proxy_to_anthropic(
             response_size=len(response.content),
         )
 
-        return response.json()
+        return raw_response(response) or codec.loads(response.content)
 
     except httpx.HTTPStatusError as e:
         logger.error(
@@ -84,35 +111,39 @@ async def proxy_to_anthropic(
         )
         raise
 
+    except ProxyError:
+        raise
+
+    except UpstreamTimeoutError as e:
+        logger.error("proxy_timeout", phase=e.phase, timeout=e.seconds)
+        raise GatewayTimeoutError("anthropic", e.phase, e.seconds) from e
+
     except Exception as e:
         logger.error("proxy_error", error=str(e), error_type=type(e).__name__)
         raise ServiceUnavailableError("anthropic") from e
 
 
 async def _stream_anthropic_response(
-    url: str,
-    body: JSONData,
+    path: str,
+    body: JSONData | RawJSON,
     headers: dict[str, str],
+    key_pool: KeyPool | None = None,
 ) -> AsyncIterator[bytes]:
     """
     流式代理 Anthropic API 响应
 
     Args:
-        url: API URL
+        path: API 路径 (端点由负载均衡选择)
         body: 请求体
         headers: 请求头
+        key_pool: 租户上游 Key 池
 
     Yields:
         SSE 事件数据块
     """
     chunk_count = 0
     try:
-        async for chunk in http_client.stream_request(
-            "POST",
-            url,
-            json=body,
-            headers=headers,
-        ):
+        async for chunk in _stream_with_resume(path, body, headers, key_pool):
             chunk_count += 1
             yield chunk
 
@@ -130,6 +161,16 @@ async def _stream_anthropic_response(
         error_event = f'event: error\ndata: {{"error": "HTTP {e.response.status_code}: {e!s}"}}\n\n'
         yield error_event.encode("utf-8")
 
+    except UpstreamTimeoutError as e:
+        # 分阶段超时 (响应头 / 首个事件 / 卡顿 / 总时长), 返回 Anthropic 格式的错误事件
+        logger.error(
+            "stream_upstream_timeout",
+            phase=e.phase,
+            timeout=e.seconds,
+            chunks_received=chunk_count,
+        )
+        yield _error_event("timeout_error", str(e))
+
     except httpx.ReadTimeout as e:
         # 读取超时错误
         logger.error(
@@ -152,6 +193,16 @@ async def _stream_anthropic_response(
         error_event = 'event: error\ndata: {"error": "Network error during streaming"}\n\n'
         yield error_event.encode("utf-8")
 
+    except ProxyError as e:
+        # 代理侧错误 (如并发排队超时), 返回 Anthropic 格式的错误事件
+        logger.error(
+            "stream_proxy_error",
+            error=e.message,
+            error_type=e.error_type,
+            chunks_received=chunk_count,
+        )
+        yield _error_event(e.error_type, e.message)
+
     except Exception as e:
         # 其他未预期的错误
         logger.error(
@@ -163,3 +214,89 @@ async def _stream_anthropic_response(
         # 发送 SSE 错误事件
         error_event = 'event: error\ndata: {"error": "Stream interrupted unexpectedly"}\n\n'
         yield error_event.encode("utf-8")
+
+
+def _error_event(error_type: str, message: str) -> bytes:
+    """构建 Anthropic 格式的 SSE 错误事件"""
+    payload = {"type": "error", "error": {"type": error_type, "message": message}}
+    return f"event: error\ndata: {json.dumps(payload)}\n\n".encode()
+
+
+async def _stream_with_resume(
+    path: str,
+    body: JSONData | RawJSON,
+    headers: dict[str, str],
+    key_pool: KeyPool | None = None,
+) -> AsyncIterator[bytes]:
+    """
+    转发上游 SSE 流, 中途中断时续写 (见 continuation 模块)
+
+    Yields:
+        SSE 事件数据块
+
+    Raises:
+        无法续写时抛出原始异常, 由调用方转换为 SSE 错误事件
+    """
+    if not settings.stream_resume_enabled:
+        async for chunk in http_client.stream_request(
+            "POST",
+            path,
+            upstream=anthropic_upstream,
+            model=body.get("model"),
+            key_pool=key_pool,
+            **body_kwargs(body),
+            headers=headers,
+        ):
+            yield chunk
+        return
+
+    continuation = StreamContinuation(body)
+    while True:
+        try:
+            async with aclosing(
+                http_client.stream_request(
+                    "POST",
+                    path,
+                    upstream=anthropic_upstream,
+                    model=body.get("model"),
+                    key_pool=key_pool,
+                    **body_kwargs(continuation.request_body),
+                    headers=headers,
+                )
+            ) as chunks:
+                async for chunk in chunks:
+                    for event in continuation.feed(chunk):
+                        yield event
+
+            if continuation.complete:
+                break
+            if continuation.stop_reason is not None:
+                # message_delta 已收到, 只缺 message_stop
+                yield continuation.finish_event()
+                break
+            if not continuation.can_resume():
+                remaining = continuation.flush()
+                if remaining:
+                    yield remaining
+                break
+            reason = "incomplete_stream"
+
+        except (httpx.TransportError, StreamInterruptedError) as e:
+            for event in continuation.take_pending():
+                yield event
+            if continuation.stop_reason is not None and not continuation.complete:
+                yield continuation.finish_event()
+                break
+            total_timeout = isinstance(e, UpstreamTimeoutError) and e.phase == "total"
+            if total_timeout or not continuation.can_resume():
+                raise
+            reason = e.reason if isinstance(e, StreamInterruptedError) else type(e).__name__
+
+        metrics.inc("stream_resumes", upstream=anthropic_upstream.name, reason=reason)
+        logger.warning(
+            "stream_resume",
+            reason=reason,
+            attempt=continuation.resumes + 1,
+            streamed_chars=continuation.streamed_chars,
+        )
+        continuation.prepare_resume()
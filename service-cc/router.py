@@ -4,15 +4,21 @@ Claude Service FastAPI 路由
 """
 from typing import Any
 
-from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi import APIRouter, Header, HTTPException, Request, Response
 
 from common.adapters import AdapterContext
+from common.coalescing import coalescer
+from common.codec import CompactJSONResponse
 from common.config import settings
-from common.errors import AuthenticationError, InvalidRequestError
+from common.errors import AuthenticationError, InvalidRequestError, ProxyError
+from common.idempotency import idempotency
 from common.logger import get_logger
+from common.rawjson import RawJSON, field_count
+from common.scheduler import set_request_context
+from common.spool import read_body
 
 from .adapters.manager import adapter_manager
-from .proxy import proxy_to_anthropic
+from .proxy import anthropic_key_pools, anthropic_upstream, proxy_to_anthropic
 from .schemas.base import ClaudeRequestBase
 
 logger = get_logger(__name__)
@@ -51,6 +57,29 @@ def extract_api_key(
     raise AuthenticationError("Missing API Key")
 
 
+def _sniff_passthrough(body: RawJSON) -> bool | None:
+    """
+    透传请求的最小校验 (只检查 model / messages / stream, 不构建 Pydantic 模型)
+
+    Returns:
+        stream 字段的值; 请求体无法解析或必需字段无效时返回 None (退回完整校验)
+    """
+    try:
+        model = body.get("model")
+        messages = body.get("messages")
+        stream = body.get("stream", False)
+        if (
+            isinstance(model, str)
+            and isinstance(messages, list)
+            and messages
+            and isinstance(stream, bool)
+        ):
+            return stream
+    except ValueError:
+        pass
+    return None
+
+
 @router.post("/v1/messages")
 async def create_message(
     request: Request,
@@ -75,50 +104,84 @@ async def create_message(
         # 1. 提取 API Key
         api_key = extract_api_key(x_api_key, authorization)
 
-        # 2. 解析请求体
-        body = await request.json()
+        # 2. 读取请求体并选择适配器 (官方客户端按请求头识别, 不需要解析请求体)
+        # 超过 request_spool_threshold 的请求体落盘解析, 得到的是解析结果 (见 common.spool)
         headers = dict(request.headers)
+        data = await read_body(request)
+        raw_body = RawJSON(data) if isinstance(data, bytes) else data
+        ctx = AdapterContext(
+            raw_body=raw_body,
+            raw_headers=headers,
+        )
+        adapter = adapter_manager.select_adapter(ctx)
+
+        # 3. 验证请求体
+        # 透传适配器只检查必需的顶层字段, 原始字节直接转发给上游 (不重新序列化);
+        # 其他适配器 (或必需字段无效时) 使用 Pydantic 模型完整校验
+        body: dict[str, Any] | RawJSON
+        spooled = not isinstance(raw_body, RawJSON)
+        stream: bool | None = None
+        if settings.request_passthrough_enabled and adapter.passthrough:
+            stream = _sniff_passthrough(raw_body)
+        if stream is not None:
+            body = raw_body
+        else:
+            ctx.raw_body = body = raw_body if spooled else raw_body.parse()
+            try:
+                stream = ClaudeRequestBase(**body).stream
+            except Exception as e:
+                logger.error("request_validation_error", error=str(e))
+                raise InvalidRequestError(
+                    f"Invalid request body: {e!s}",
+                    details={"validation_error": str(e)},
+                ) from e
 
         # 记录请求信息 (根据环境决定是否记录详细内容)
         log_data = {
             "model": body.get("model"),
-            "stream": body.get("stream", False),
-            "message_count": len(body.get("messages", [])),
+            "stream": stream,
+            "message_count": field_count(body, "messages"),
             "user_agent": headers.get("user-agent", "unknown"),
+            "passthrough": body is raw_body,
+            "spooled": spooled,
         }
 
         # 测试环境记录详细请求体
         if settings.is_test_environment:
-            log_data["request_body"] = body
+            log_data["request_body"] = dict(body)
 
         logger.info("claude_request", **log_data)
 
-        # 3. 验证请求体
-        try:
-            claude_request = ClaudeRequestBase(**body)
-        except Exception as e:
-            logger.error("request_validation_error", error=str(e))
-            raise InvalidRequestError(
-                f"Invalid request body: {e!s}",
-                details={"validation_error": str(e)},
-            ) from e
-
-        # 4. 构建适配器上下文
-        ctx = AdapterContext(
-            raw_body=body,
-            raw_headers=headers,
+        # 4. 应用适配器转换
+        result = adapter_manager.apply(adapter, ctx)
+        set_request_context(
+            priority=result.priority,
+            api_key=api_key,
+            client_ip=request.client.host if request.client else None,
+            headers=headers,
         )
 
-        # 5. 应用适配器转换
-        result = adapter_manager.transform(ctx)
-
-        # 6. 代理到 Anthropic
-        response = await proxy_to_anthropic(
-            result.body,
+        # 5. 代理到 Anthropic
+        # 携带 Idempotency-Key 的重复请求、以及 (启用合并时) 相同的并发请求复用同一个上游响应
+        response = await idempotency.handle(
+            request,
             api_key,
-            stream=claude_request.stream,
+            lambda: coalescer.handle(
+                result.body,
+                upstream=anthropic_upstream.name,
+                api_key=api_key,
+                key_pools=anthropic_key_pools,
+                call=lambda: proxy_to_anthropic(
+                    result.body,
+                    api_key,
+                    stream=stream,
+                ),
+            ),
         )
 
+        # 非流式响应直接序列化返回 (不经过 FastAPI 的 jsonable_encoder)
+        if not isinstance(response, Response):
+            response = CompactJSONResponse(content=response)
         return response
 
     except AuthenticationError as e:
@@ -129,6 +192,14 @@ async def create_message(
         logger.error("invalid_request_error", error=e.message)
         raise HTTPException(status_code=e.status_code, detail=e.to_dict()) from e
 
+    except ProxyError as e:
+        logger.error("proxy_error", error_type=e.error_type, error=e.message)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.to_dict(),
+            headers=e.headers or None,
+        ) from e
+
     except HTTPException:
         # FastAPI 异常直接抛出
         raise
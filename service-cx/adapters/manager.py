@@ -74,6 +74,7 @@ class AdapterManager:
         """
         adapter = self.select_adapter(ctx)
         result = adapter.transform(ctx)
+        result.priority = adapter.priority
 
         logger.info(
             "request_transformed",
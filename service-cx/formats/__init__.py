@@ -5,6 +5,7 @@ from .openai_responses import (
     build_request_body,
     build_responses_headers,
     format_input,
+    is_complete_response,
     parse_response,
 )
 
@@ -12,5 +13,6 @@ __all__ = [
     "build_request_body",
     "build_responses_headers",
     "format_input",
+    "is_complete_response",
     "parse_response",
 ]
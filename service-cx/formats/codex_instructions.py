@@ -4,6 +4,7 @@ Codex 官方 Instructions (系统提示词)
 从成功请求中提取的完整 instructions
 88code API 会校验此内容,必须保持一致
 """
+from common.codec import prepare
 
 CODEX_INSTRUCTIONS = """You are Codex, based on GPT-5. You are running as a coding agent in the Codex CLI on a user's computer.
 
@@ -112,3 +113,6 @@ You are producing plain text that will later be styled by the CLI. Follow these
   * Do not provide range of lines
   * Examples: src/app.ts, src/app.ts:42, b/server/index.js#L10, C:\\repo\\project\\main.rs:12:5
 """
+
+# 启动时编码一次, 注入上游请求体时直接拼接编码结果 (见 common.codec.prepare)
+CODEX_INSTRUCTIONS = prepare(CODEX_INSTRUCTIONS)
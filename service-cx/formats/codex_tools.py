@@ -8,6 +8,8 @@ from __future__ import annotations
 
 from typing import Any
 
+from common.codec import prepare
+
 # Codex CLI 默认内置工具 (保持与官方 CLI 完全一致)
 CODEX_DEFAULT_TOOLS: list[dict[str, Any]] = [
     {
@@ -214,5 +216,8 @@ CODEX_DEFAULT_TOOLS: list[dict[str, Any]] = [
     },
 ]
 
+# 启动时编码一次并转换为只读结构, 所有请求共享 (见 common.codec.prepare)
+CODEX_DEFAULT_TOOLS = prepare(CODEX_DEFAULT_TOOLS)
+
 __all__ = ["CODEX_DEFAULT_TOOLS"]
 
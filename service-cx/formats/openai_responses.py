@@ -127,6 +127,15 @@ def build_request_body(
     return body
 
 
+# parse_response 补全的必需字段
+RESPONSE_REQUIRED_FIELDS = ("id", "object", "created_at", "status", "output", "usage")
+
+
+def is_complete_response(response_data: dict[str, Any]) -> bool:
+    """响应是否已包含全部必需字段 (parse_response 不会补全任何字段, 可原样返回)"""
+    return all(field in response_data for field in RESPONSE_REQUIRED_FIELDS)
+
+
 def parse_response(response_data: dict[str, Any]) -> dict[str, Any]:
     """
     解析 OpenAI Responses API 响应
@@ -9,17 +9,34 @@ from pathlib import Path
 from uuid import uuid4
 
 import httpx
+from fastapi.responses import Response
 
+from common import codec
+from common.balancer import UpstreamGroup
 from common.config import settings
-from common.errors import InvalidRequestError, ServiceUnavailableError
+from common.errors import (
+    GatewayTimeoutError,
+    InvalidRequestError,
+    ProxyError,
+    ServiceUnavailableError,
+)
 from common.http_client import http_client
+from common.key_pool import KeyPools
 from common.logger import get_logger
+from common.rawjson import raw_response
+from common.timeouts import UpstreamTimeoutError
 from common.types import JSONData
 
-from .formats import build_responses_headers, parse_response
+from .formats import build_responses_headers, is_complete_response, parse_response
 
 logger = get_logger(__name__)
 
+# OpenAI 上游端点组 (多端点时按延迟负载均衡)
+openai_upstream = UpstreamGroup("openai", settings.openai_endpoints)
+
+# 内部租户的上游 Key 池 (调用方 Key 属于某个租户时替换为池中的 Key)
+openai_key_pools = KeyPools(openai_upstream.name, settings.openai_key_pools)
+
 
 def _maybe_dump_request(stage: str, body: JSONData, headers: dict[str, str]) -> None:
     """根据配置将请求写入本地文件,便于分析"""
@@ -44,6 +61,7 @@ def _maybe_dump_request(stage: str, body: JSONData, headers: dict[str, str]) ->
                 fp,
                 ensure_ascii=False,
                 indent=2,
+                default=str,  # 落盘请求体中的 spool.Blob
             )
 
         logger.info("codex_request_dumped", stage=stage, path=str(file_path))
@@ -55,7 +73,7 @@ async def proxy_to_openai(
     body: JSONData,
     api_key: str,
     extra_headers: dict[str, str] | None = None,
-) -> JSONData:
+) -> Response | JSONData:
     """
     代理请求到 OpenAI Responses API
 
@@ -65,19 +83,23 @@ async def proxy_to_openai(
         extra_headers: 需要附加到请求的头部信息
 
     Returns:
-        JSONData: OpenAI API 响应
+        原样返回上游响应体的 RawJSONResponse; 未启用 response_passthrough_enabled、
+        上游响应不是 JSON 或缺少必需字段 (需要 parse_response 补全) 时为补全后的 JSONData
 
     Raises:
         InvalidRequestError: 请求参数无效
         ServiceUnavailableError: OpenAI 服务不可用
     """
-    url = f"{settings.openai_base_url}/v1/responses"
+    path = "/v1/responses"
+    key_pool = openai_key_pools.for_client(api_key)
 
     logger.info(
         "proxy_request_start",
-        url=url,
+        upstream=openai_upstream.name,
+        path=path,
         model=body.get("model"),
         tool_choice=body.get("tool_choice"),
+        key_pool=key_pool.tenant if key_pool is not None else None,
         stream=bool(body.get("stream")),
         has_instructions=bool(body.get("instructions")),
         instructions_length=len(body.get("instructions", "")) if body.get("instructions") else 0,
@@ -97,30 +119,37 @@ async def proxy_to_openai(
         # 发送请求
         response = await http_client.request(
             "POST",
-            url,
+            path,
+            upstream=openai_upstream,
+            model=body.get("model"),
+            key_pool=key_pool,
             json=body,
             headers=headers,
         )
 
         # 记录原始响应内容用于调试
-        response_text = response.text
         logger.debug(
             "proxy_response_raw",
             status=response.status_code,
             content_type=response.headers.get("content-type"),
-            body_preview=response_text[:500] if response_text else "(empty)",
+            body_preview=response.content[:500].decode("utf-8", errors="replace") or "(empty)",
         )
 
         # 解析响应
-        if not response_text:
+        if not response.content:
             raise InvalidRequestError(
                 message="API returned empty response",
                 details={"status_code": response.status_code},
             )
 
+        # 已包含全部必需字段的响应原样返回 (只解析检查, 不重新序列化)
+        passthrough = raw_response(response)
         try:
-            response_data = response.json()
+            response_data = (
+                passthrough.json.parse() if passthrough is not None else codec.loads(response.content)
+            )
         except Exception as e:
+            response_text = response.text
             logger.error(
                 "proxy_response_parse_error",
                 status=response.status_code,
@@ -132,6 +161,17 @@ async def proxy_to_openai(
                 details={"response_text": response_text[:500]},
             ) from e
 
+        if passthrough is not None and is_complete_response(response_data):
+            _maybe_dump_request("response", response_data, dict(response.headers))
+            logger.info(
+                "proxy_request_success",
+                response_id=response_data.get("id"),
+                status=response_data.get("status"),
+                output_count=len(response_data.get("output", [])),
+                passthrough=True,
+            )
+            return passthrough
+
         parsed_response = parse_response(response_data)
         _maybe_dump_request("response", parsed_response, dict(response.headers))
 
@@ -150,7 +190,7 @@ async def proxy_to_openai(
         error_body = {}
 
         try:
-            error_body = e.response.json()
+            error_body = codec.loads(e.response.content)
         except Exception:
             error_body = {"message": e.response.text}
 
@@ -173,20 +213,28 @@ async def proxy_to_openai(
             details=error_body,
         ) from e
 
+    except UpstreamTimeoutError as e:
+        # 分阶段超时
+        logger.error("proxy_request_timeout", path=path, phase=e.phase, timeout=e.seconds)
+        raise GatewayTimeoutError("openai", e.phase, e.seconds) from e
+
     except httpx.RequestError as e:
         # 网络错误
         logger.error(
             "proxy_request_network_error",
-            url=url,
+            path=path,
             error=str(e),
         )
         raise ServiceUnavailableError("openai") from e
 
+    except ProxyError:
+        raise
+
     except Exception as e:
         # 其他错误
         logger.error(
             "proxy_request_unexpected_error",
-            url=url,
+            path=path,
             error=str(e),
             error_type=type(e).__name__,
         )
@@ -216,39 +264,46 @@ async def proxy_to_openai_stream(
         InvalidRequestError: 请求参数无效
         ServiceUnavailableError: OpenAI 服务不可用
     """
-    url = f"{settings.openai_base_url}/v1/responses"
+    path = "/v1/responses"
+    key_pool = openai_key_pools.for_client(api_key)
 
     logger.info(
         "proxy_stream_request_start",
-        url=url,
+        upstream=openai_upstream.name,
+        path=path,
         model=body.get("model"),
         tool_choice=body.get("tool_choice"),
+        key_pool=key_pool.tenant if key_pool is not None else None,
     )
 
     headers = build_responses_headers(api_key, extra_headers)
 
-    stream_context = http_client.client.stream(
-        "POST",
-        url,
-        json=body,
-        headers=headers,
-    )
-
     try:
-        response = await stream_context.__aenter__()
+        response = await http_client.open_stream(
+            "POST",
+            path,
+            upstream=openai_upstream,
+            model=body.get("model"),
+            key_pool=key_pool,
+            json=body,
+            headers=headers,
+        )
+    except UpstreamTimeoutError as e:
+        logger.error("proxy_stream_timeout", path=path, phase=e.phase, timeout=e.seconds)
+        raise GatewayTimeoutError("openai", e.phase, e.seconds) from e
     except httpx.RequestError as e:
-        await stream_context.__aexit__(type(e), e, e.__traceback__)
         logger.error(
             "proxy_stream_connection_error",
-            url=url,
+            path=path,
             error=str(e),
         )
         raise ServiceUnavailableError("openai") from e
+    except ProxyError:
+        raise
     except Exception as e:
-        await stream_context.__aexit__(type(e), e, e.__traceback__)
         logger.error(
             "proxy_stream_unexpected_error",
-            url=url,
+            path=path,
             error=str(e),
             error_type=type(e).__name__,
         )
@@ -261,12 +316,39 @@ async def proxy_to_openai_stream(
     request_id = response.headers.get("x-request-id")
     status_code = response.status_code
 
+    await _raise_for_stream_status(response)
+
+    passthrough_headers: dict[str, str] = {}
+    if request_id:
+        passthrough_headers["x-request-id"] = request_id
+    cache_control = response.headers.get("cache-control")
+    if cache_control:
+        passthrough_headers["cache-control"] = cache_control
+
+    _maybe_dump_request(
+        "stream_response_headers",
+        {"status": status_code},
+        dict(response.headers),
+    )
+
+    return _forward_stream(response), passthrough_headers, content_type
+
+
+async def _raise_for_stream_status(response: httpx.Response) -> None:
+    """
+    上游流式响应为错误状态码时读取错误响应体, 关闭响应并抛出对应的代理错误
+
+    Raises:
+        InvalidRequestError: 400 或其他错误状态码
+        ServiceUnavailableError: 502 / 503 / 504
+    """
+    status_code = response.status_code
     try:
         response.raise_for_status()
     except httpx.HTTPStatusError as e:
         error_bytes = await response.aread()
         error_text = error_bytes.decode("utf-8", errors="ignore")
-        await stream_context.__aexit__(type(e), e, e.__traceback__)
+        await response.aclose()
 
         if status_code == 400:
             raise InvalidRequestError(
@@ -280,66 +362,73 @@ async def proxy_to_openai_stream(
             details={"response": error_text[:500]},
         ) from e
 
-    passthrough_headers: dict[str, str] = {}
-    if request_id:
-        passthrough_headers["x-request-id"] = request_id
-    cache_control = response.headers.get("cache-control")
-    if cache_control:
-        passthrough_headers["cache-control"] = cache_control
-
-    _maybe_dump_request(
-        "stream_response_headers",
-        {"status": status_code},
-        dict(response.headers),
-    )
 
-    async def stream_iterator() -> AsyncIterator[bytes]:
-        chunk_count = 0
-        try:
-            async for chunk in response.aiter_bytes():
-                if chunk:
-                    chunk_count += 1
-                    yield chunk
-        except httpx.ReadTimeout as e:
-            # 读取超时错误
-            logger.error(
-                "proxy_stream_timeout_error",
-                error=str(e),
-                chunks_received=chunk_count,
-            )
-            # 发送 SSE 错误事件
-            error_event = 'event: error\ndata: {"error": "Stream read timeout"}\n\n'
-            yield error_event.encode("utf-8")
-        except httpx.NetworkError as e:
-            # 网络错误
-            logger.error(
-                "proxy_stream_network_error",
-                error=str(e),
-                chunks_received=chunk_count,
-            )
-            # 发送 SSE 错误事件
-            error_event = 'event: error\ndata: {"error": "Network error during streaming"}\n\n'
-            yield error_event.encode("utf-8")
-        except Exception as e:
-            # 其他未预期的错误
-            logger.error(
-                "proxy_stream_forward_error",
-                error=str(e),
-                error_type=type(e).__name__,
-                chunks_received=chunk_count,
-            )
-            # 发送 SSE 错误事件
-            error_event = 'event: error\ndata: {"error": "Stream interrupted unexpectedly"}\n\n'
-            yield error_event.encode("utf-8")
-        finally:
-            await stream_context.__aexit__(None, None, None)
-            logger.info(
-                "proxy_stream_request_complete",
-                status=status_code,
-                chunks=chunk_count,
-            )
+async def _forward_stream(response: httpx.Response) -> AsyncIterator[bytes]:
+    """
+    转发上游 SSE 流, 中途出错时返回 SSE 错误事件
 
-    return stream_iterator(), passthrough_headers, content_type
+    Yields:
+        SSE 事件数据块
+    """
+    chunk_count = 0
+    try:
+        async for chunk in response.aiter_bytes():
+            if chunk:
+                chunk_count += 1
+                yield chunk
+    except UpstreamTimeoutError as e:
+        # 卡顿 / 总时长超时, 返回 Responses API 格式的错误事件
+        logger.error(
+            "proxy_stream_upstream_timeout",
+            phase=e.phase,
+            timeout=e.seconds,
+            chunks_received=chunk_count,
+        )
+        error_payload = {
+            "type": "error",
+            "code": "upstream_timeout",
+            "message": str(e),
+            "param": None,
+        }
+        yield f"event: error\ndata: {json.dumps(error_payload)}\n\n".encode()
+    except httpx.ReadTimeout as e:
+        # 读取超时错误
+        logger.error(
+            "proxy_stream_timeout_error",
+            error=str(e),
+            chunks_received=chunk_count,
+        )
+        # 发送 SSE 错误事件
+        error_event = 'event: error\ndata: {"error": "Stream read timeout"}\n\n'
+        yield error_event.encode("utf-8")
+    except httpx.NetworkError as e:
+        # 网络错误
+        logger.error(
+            "proxy_stream_network_error",
+            error=str(e),
+            chunks_received=chunk_count,
+        )
+        # 发送 SSE 错误事件
+        error_event = 'event: error\ndata: {"error": "Network error during streaming"}\n\n'
+        yield error_event.encode("utf-8")
+    except Exception as e:
+        # 其他未预期的错误
+        logger.error(
+            "proxy_stream_forward_error",
+            error=str(e),
+            error_type=type(e).__name__,
+            chunks_received=chunk_count,
+        )
+        # 发送 SSE 错误事件
+        error_event = 'event: error\ndata: {"error": "Stream interrupted unexpectedly"}\n\n'
+        yield error_event.encode("utf-8")
+    finally:
+        await response.aclose()
+        logger.info(
+            "proxy_stream_request_complete",
+            status=response.status_code,
+            chunks=chunk_count,
+        )
 
 
 async def validate_request_body(body: JSONData) -> None:
@@ -5,14 +5,26 @@ Codex 服务路由
 from typing import Any
 
 from fastapi import APIRouter, Header, HTTPException, Request, Response, status
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import StreamingResponse
 
+from common import codec
 from common.adapters import AdapterContext
+from common.coalescing import coalescer
+from common.codec import CompactJSONResponse
 from common.errors import AuthenticationError, InvalidRequestError, ProxyError
+from common.idempotency import idempotency
 from common.logger import get_logger
+from common.scheduler import set_request_context
+from common.spool import read_body
 
 from .adapters import adapter_manager
-from .proxy import proxy_to_openai, proxy_to_openai_stream, validate_request_body
+from .proxy import (
+    openai_key_pools,
+    openai_upstream,
+    proxy_to_openai,
+    proxy_to_openai_stream,
+    validate_request_body,
+)
 
 logger = get_logger(__name__)
 
@@ -61,7 +73,7 @@ async def create_response(
         authorization: Authorization header
 
     Returns:
-        JSONResponse: OpenAI API 响应
+        Response: OpenAI API 响应 (非流式响应原样返回上游响应体)
 
     Raises:
         HTTPException: 各种错误情况
@@ -70,13 +82,20 @@ async def create_response(
         # 1. 提取 API Key
         api_key = extract_api_key(authorization)
 
-        # 2. 解析请求体
-        body = await request.json()
+        # 2. 解析请求体 (超过 request_spool_threshold 的请求体落盘解析, 见 common.spool)
+        data = await read_body(request)
+        body = codec.loads(data) if isinstance(data, bytes) else data
         headers = {k.lower(): v for k, v in request.headers.items()}
 
         # 3. 适配器转换
         ctx = AdapterContext(raw_body=body, raw_headers=headers)
         result = adapter_manager.transform(ctx)
+        set_request_context(
+            priority=result.priority,
+            api_key=api_key,
+            client_ip=request.client.host if request.client else None,
+            headers=headers,
+        )
         transformed_body = result.body
         extra_headers = result.extra_headers
 
@@ -84,32 +103,48 @@ async def create_response(
         await validate_request_body(transformed_body)
 
         # 5. 代理转发到真实 API
-        if bool(transformed_body.get("stream")):
-            stream_iterator, passthrough_headers, media_type = await proxy_to_openai_stream(
-                transformed_body,
-                api_key,
-                extra_headers,
-            )
+        async def forward() -> Response:
+            if bool(transformed_body.get("stream")):
+                stream_iterator, passthrough_headers, media_type = await proxy_to_openai_stream(
+                    transformed_body,
+                    api_key,
+                    extra_headers,
+                )
+
+                response_headers = {
+                    "cache-control": "no-cache",
+                    "connection": "keep-alive",
+                    "x-accel-buffering": "no",
+                }
+                response_headers.update(passthrough_headers)
 
-            headers = {
-                "cache-control": "no-cache",
-                "connection": "keep-alive",
-                "x-accel-buffering": "no",
-            }
-            headers.update(passthrough_headers)
-
-            return StreamingResponse(
-                stream_iterator,
-                media_type=media_type or "text/event-stream; charset=utf-8",
-                headers=headers,
+                return StreamingResponse(
+                    stream_iterator,
+                    media_type=media_type or "text/event-stream; charset=utf-8",
+                    headers=response_headers,
+                    status_code=status.HTTP_200_OK,
+                )
+
+            response_data = await proxy_to_openai(transformed_body, api_key, extra_headers)
+            if isinstance(response_data, Response):
+                return response_data
+
+            return CompactJSONResponse(
+                content=response_data,
                 status_code=status.HTTP_200_OK,
             )
 
-        response_data = await proxy_to_openai(transformed_body, api_key, extra_headers)
-
-        return JSONResponse(
-            content=response_data,
-            status_code=status.HTTP_200_OK,
+        # 携带 Idempotency-Key 的重复请求、以及 (启用合并时) 相同的并发请求复用同一个上游响应
+        return await idempotency.handle(
+            request,
+            api_key,
+            lambda: coalescer.handle(
+                transformed_body,
+                upstream=openai_upstream.name,
+                api_key=api_key,
+                key_pools=openai_key_pools,
+                call=forward,
+            ),
         )
 
     except AuthenticationError as e:
@@ -131,6 +166,7 @@ async def create_response(
         raise HTTPException(
             status_code=e.status_code,
             detail=e.to_dict(),
+            headers=e.headers or None,
         ) from e
 
     except ProxyError as e:
@@ -143,6 +179,7 @@ async def create_response(
         raise HTTPException(
             status_code=e.status_code,
             detail=e.to_dict(),
+            headers=e.headers or None,
         ) from e
 
     except Exception as e:
@@ -0,0 +1,77 @@
+"""
+测试公共配置
+
+服务目录名带连字符 (service-cc / service-cx), 测试中通过 importlib 导入
+"""
+import inspect
+import sys
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+
+# 添加项目根目录到 Python 路径
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from common.config import settings
+from common.http_client import HTTPClient
+
+
+class ChunkStream(httpx.AsyncByteStream):
+    """按块返回的响应体 (与网络响应一样按流读取, 读完时关闭)"""
+
+    def __init__(self, chunks: list[bytes]) -> None:
+        self.chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for chunk in self.chunks:
+            yield chunk
+
+
+class MockUpstream:
+    """模拟上游 (httpx.MockTransport 的 handler): 记录收到的请求, 按 respond 返回响应"""
+
+    def __init__(self) -> None:
+        self.requests: list[httpx.Request] = []
+        # 普通函数或协程函数, 可以抛出 httpx 网络错误
+        self.respond: Callable[[httpx.Request], Any] = lambda request: httpx.Response(200)
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = self.respond(request)
+        if inspect.isawaitable(response):
+            response = await response
+        if isinstance(response.stream, httpx.ByteStream):
+            # httpx 会预先读取 content= 响应体, 改为按流返回
+            return httpx.Response(
+                response.status_code,
+                headers=response.headers,
+                stream=ChunkStream([response.content]),
+            )
+        return response
+
+
+@pytest.fixture
+def upstream() -> MockUpstream:
+    return MockUpstream()
+
+
+@pytest.fixture
+async def client(
+    upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> AsyncIterator[HTTPClient]:
+    """连接到模拟上游的独立 HTTPClient 实例 (不读写限流额度状态, 重试不等待)"""
+    monkeypatch.setattr(settings, "pacing_enabled", False)
+    monkeypatch.setattr(settings, "retry_backoff_base", 0.0)
+    monkeypatch.setattr(
+        HTTPClient,
+        "_create_client",
+        lambda self, pool=None: httpx.AsyncClient(transport=httpx.MockTransport(upstream)),
+    )
+    HTTPClient.reset_instance()
+    instance = HTTPClient()
+    yield instance
+    await instance.close()
+    HTTPClient.reset_instance()
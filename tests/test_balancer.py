@@ -0,0 +1,104 @@
+"""上游负载均衡 (common/balancer.py)"""
+import httpx
+import pytest
+
+from common.balancer import UpstreamGroup
+from common.config import settings
+from common.errors import CircuitOpenError
+from common.http_client import HTTPClient
+
+from .conftest import MockUpstream
+
+
+@pytest.fixture
+def group() -> UpstreamGroup:
+    return UpstreamGroup("test-lb", ["https://relay-a/api/", "https://relay-b/api"])
+
+
+def test_pick_prefers_lower_cost(group: UpstreamGroup) -> None:
+    fast, slow = group.endpoints
+    fast.observe(0.2)
+    slow.observe(1.0)
+    assert all(group.pick() is fast for _ in range(20))
+
+    # 在途请求数计入代价: 0.2 × 6 > 1.0 × 1
+    for _ in range(5):
+        group.begin(fast)
+    assert group.pick() is slow
+
+
+def test_endpoint_without_samples_is_tried_first(group: UpstreamGroup) -> None:
+    group.endpoints[0].observe(0.1)
+    assert group.pick() is group.endpoints[1]
+    assert group.endpoints[1].url("/v1/messages") == "https://relay-b/api/v1/messages"
+    assert group.base_urls == ["https://relay-a/api", "https://relay-b/api"]
+
+
+def test_pick_excludes_failed_endpoints(group: UpstreamGroup) -> None:
+    first, second = group.endpoints
+    first.observe(0.1)
+    second.observe(5.0)
+    assert group.pick(exclude=[first]) is second
+    # 全部被排除时忽略排除条件
+    assert group.pick(exclude=[first, second]) is first
+
+
+def test_failure_penalty_and_outstanding(group: UpstreamGroup) -> None:
+    endpoint = group.endpoints[0]
+    group.begin(endpoint)
+    group.end(endpoint, None, ok=False)
+    assert endpoint.outstanding == 0
+    assert endpoint.failures == 1
+    assert endpoint.ewma_ttfb == settings.lb_failure_penalty
+
+    group.begin(endpoint)
+    group.end(endpoint, 0.5, ok=True)
+    alpha = settings.lb_ewma_alpha
+    expected = (1 - alpha) * settings.lb_failure_penalty + alpha * 0.5
+    assert endpoint.ewma_ttfb == pytest.approx(expected)
+
+
+def test_open_breakers_are_skipped(group: UpstreamGroup, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "breaker_min_requests", 1)
+    first, second = group.endpoints
+    first.breaker.record(failed=True)
+    assert all(group.pick() is second for _ in range(10))
+
+    second.breaker.record(failed=True)
+    with pytest.raises(CircuitOpenError) as info:
+        group.pick()
+    assert info.value.status_code == 503
+
+
+async def test_probe_pulls_idle_endpoint_towards_best(group: UpstreamGroup) -> None:
+    best, idle = group.endpoints
+    best.observe(0.5)
+    idle.observe(settings.lb_failure_penalty)
+
+    async def probe(base_url: str) -> float:
+        return 0.05
+
+    await group._probe(idle, probe)
+    assert idle.last_probe_ms == 50.0
+    assert idle.ewma_ttfb < settings.lb_failure_penalty
+
+    async def unreachable(base_url: str) -> float:
+        raise httpx.ConnectError("refused")
+
+    before = idle.ewma_ttfb
+    await group._probe(idle, unreachable)
+    assert idle.failures == 1
+    assert idle.ewma_ttfb > before
+
+
+async def test_requests_are_sent_to_the_picked_endpoint(
+    client: HTTPClient, upstream: MockUpstream, group: UpstreamGroup
+) -> None:
+    group.endpoints[0].observe(0.1)
+    group.endpoints[1].observe(1.0)
+    await client.request("POST", "/v1/messages", upstream=group, json={})
+
+    assert str(upstream.requests[0].url) == "https://relay-a/api/v1/messages"
+    endpoint = group.endpoints[0]
+    assert endpoint.requests == 1
+    assert endpoint.outstanding == 0
@@ -0,0 +1,113 @@
+"""上游熔断器 (common/circuit_breaker.py)"""
+import time
+
+import pytest
+
+from common.circuit_breaker import CircuitBreaker, CircuitState
+from common.config import settings
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    """可拨动的 time.monotonic (clock[0] 为当前时间)"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(monkeypatch: pytest.MonkeyPatch) -> CircuitBreaker:
+    monkeypatch.setattr(settings, "breaker_enabled", True)
+    monkeypatch.setattr(settings, "breaker_min_requests", 4)
+    monkeypatch.setattr(settings, "breaker_error_rate", 0.5)
+    monkeypatch.setattr(settings, "breaker_slow_call_seconds", 10.0)
+    monkeypatch.setattr(settings, "breaker_slow_call_rate", 0.75)
+    monkeypatch.setattr(settings, "breaker_open_seconds", 15.0)
+    monkeypatch.setattr(settings, "breaker_half_open_probes", 2)
+    return CircuitBreaker("test")
+
+
+def trip(breaker: CircuitBreaker) -> None:
+    for _ in range(settings.breaker_min_requests):
+        breaker.record(failed=True)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_trips_after_min_requests(breaker: CircuitBreaker, clock: list[float]) -> None:
+    for _ in range(3):
+        breaker.record(failed=True)
+    assert breaker.state == CircuitState.CLOSED
+
+    breaker.record(failed=False)
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.available()
+    assert not breaker.acquire()
+    assert breaker.retry_after() == 15.0
+
+
+def test_stays_closed_below_error_rate(breaker: CircuitBreaker, clock: list[float]) -> None:
+    for failed in (True, False, False, False, False):
+        breaker.record(failed=failed)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.to_dict()["window_failures"] == 1
+
+
+def test_trips_on_slow_calls(breaker: CircuitBreaker, clock: list[float]) -> None:
+    for latency in (11.0, 12.0, 1.0):
+        breaker.record(failed=False, latency=latency)
+    assert breaker.state == CircuitState.CLOSED
+    breaker.record(failed=False, latency=15.0)
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_old_samples_leave_the_window(breaker: CircuitBreaker, clock: list[float]) -> None:
+    for _ in range(3):
+        breaker.record(failed=True)
+    clock[0] += settings.breaker_window + 1
+    breaker.record(failed=True)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.to_dict()["window_requests"] == 1
+
+
+def test_half_open_probes_close_the_breaker(breaker: CircuitBreaker, clock: list[float]) -> None:
+    trip(breaker)
+    clock[0] += settings.breaker_open_seconds
+    assert breaker.available()
+
+    # 最多放行 breaker_half_open_probes 个探测请求
+    assert breaker.acquire() and breaker.acquire()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not breaker.acquire()
+
+    breaker.record(failed=False)
+    assert breaker.state == CircuitState.HALF_OPEN
+    breaker.record(failed=False)
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.to_dict()["window_requests"] == 0
+
+
+def test_failed_probe_reopens(breaker: CircuitBreaker, clock: list[float]) -> None:
+    trip(breaker)
+    clock[0] += settings.breaker_open_seconds
+    assert breaker.acquire()
+    breaker.record(failed=True)
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.retry_after() == settings.breaker_open_seconds
+
+
+def test_released_probe_frees_its_slot(breaker: CircuitBreaker, clock: list[float]) -> None:
+    trip(breaker)
+    clock[0] += settings.breaker_open_seconds
+    assert breaker.acquire() and breaker.acquire()
+    breaker.release()
+    assert breaker.available()
+    assert breaker.acquire()
+
+
+def test_disabled_breaker_always_admits(
+    breaker: CircuitBreaker, clock: list[float], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    trip(breaker)
+    monkeypatch.setattr(settings, "breaker_enabled", False)
+    assert breaker.available()
+    assert breaker.acquire()
@@ -0,0 +1,182 @@
+"""相同请求合并 (common/coalescing.py, common/fanout.py)"""
+import asyncio
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+from fastapi.responses import Response, StreamingResponse
+
+from common import coalescing
+from common.coalescing import Coalescer, coalescer
+from common.config import KeyPoolConfig, settings
+from common.key_pool import KeyPools
+from common.memory_budget import memory_budget
+from common.rawjson import RawJSON
+
+BODY = {
+    "model": "claude-haiku-4-5",
+    "temperature": 0,
+    "messages": [{"role": "user", "content": "ping"}],
+}
+
+
+class Upstream:
+    """模拟上游调用: 记录调用次数, 流式响应逐个发出 events, 在 release 之后结束"""
+
+    def __init__(self, streaming: bool = False) -> None:
+        self.streaming = streaming
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def __call__(self) -> Response | Any:
+        self.calls += 1
+        if not self.streaming:
+            await self.release.wait()
+            return {"id": f"msg_{self.calls}"}
+        return StreamingResponse(self._events(), media_type="text/event-stream")
+
+    async def _events(self) -> AsyncIterator[bytes]:
+        try:
+            yield b"event: message_start\n\n"
+            await self.release.wait()
+            yield b"event: message_stop\n\n"
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+STREAM = b"event: message_start\n\nevent: message_stop\n\n"
+
+
+async def read(response: Response) -> bytes:
+    if isinstance(response, StreamingResponse):
+        return b"".join([chunk async for chunk in response.body_iterator])  # type: ignore[misc]
+    return bytes(response.body)
+
+
+@pytest.fixture
+def pools() -> KeyPools:
+    return KeyPools(
+        "test-coalesce",
+        {"team": KeyPoolConfig(client_keys=["sk-team-1", "sk-team-2"], upstream_keys=["sk-up"])},
+    )
+
+
+@pytest.fixture
+def merger(monkeypatch: pytest.MonkeyPatch) -> Coalescer:
+    monkeypatch.setattr(settings, "coalesce_enabled", True)
+    monkeypatch.setattr(settings, "coalesce_max_temperature", 0.0)
+    monkeypatch.setattr(coalescing, "_ORPHAN_GRACE", 0.05)
+    monkeypatch.setattr(coalescer, "_inflight", {})
+    return coalescer
+
+
+async def handle(
+    merger: Coalescer,
+    pools: KeyPools,
+    upstream: Upstream,
+    body: Any = BODY,
+    api_key: str = "sk-a",
+) -> Response | Any:
+    return await merger.handle(
+        body, upstream="test-coalesce", api_key=api_key, key_pools=pools, call=upstream
+    )
+
+
+async def test_identical_requests_share_one_call(merger: Coalescer, pools: KeyPools) -> None:
+    upstream = Upstream()
+    reordered = {key: BODY[key] for key in reversed(BODY)}
+    tasks = [
+        asyncio.create_task(handle(merger, pools, upstream, body)) for body in (BODY, reordered)
+    ]
+    await asyncio.sleep(0)
+    assert merger.stats() == {"inflight": 1, "subscribers": 2}
+    upstream.release.set()
+
+    responses = await asyncio.gather(*tasks)
+    assert [await read(response) for response in responses] == [b'{"id":"msg_1"}'] * 2
+    assert upstream.calls == 1
+    assert merger.stats()["inflight"] == 0
+
+    # 上游响应结束后到达的请求重新执行
+    await handle(merger, pools, upstream)
+    assert upstream.calls == 2
+
+
+async def test_requests_that_are_not_coalesced(
+    merger: Coalescer, pools: KeyPools, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    upstream = Upstream()
+    upstream.release.set()
+
+    # 采样请求
+    await asyncio.gather(*(handle(merger, pools, upstream, {"model": "x"}) for _ in range(2)))
+    assert upstream.calls == 2
+
+    # 不同的调用方凭据
+    await asyncio.gather(
+        handle(merger, pools, upstream), handle(merger, pools, upstream, api_key="sk-b")
+    )
+    assert upstream.calls == 4
+
+    monkeypatch.setattr(settings, "coalesce_enabled", False)
+    assert await asyncio.gather(*(handle(merger, pools, upstream) for _ in range(2))) == [
+        {"id": "msg_5"},
+        {"id": "msg_6"},
+    ]
+
+
+async def test_same_tenant_pool_is_coalesced(merger: Coalescer, pools: KeyPools) -> None:
+    upstream = Upstream()
+    upstream.release.set()
+    raw = RawJSON(b'{"model":"claude-haiku-4-5","temperature":0}')
+    await asyncio.gather(
+        handle(merger, pools, upstream, raw, api_key="sk-team-1"),
+        handle(merger, pools, upstream, raw, api_key="sk-team-2"),
+    )
+    assert upstream.calls == 1
+
+
+async def test_stream_fans_out_to_late_joiner(merger: Coalescer, pools: KeyPools) -> None:
+    upstream = Upstream(streaming=True)
+    first = await handle(merger, pools, upstream)
+    reading = asyncio.create_task(read(first))
+    await asyncio.sleep(0.01)
+
+    # 后加入的客户端先收到已转发的事件
+    second = await handle(merger, pools, upstream)
+    upstream.release.set()
+    assert await asyncio.gather(reading, read(second)) == [STREAM, STREAM]
+    assert upstream.calls == 1
+
+
+async def test_disconnected_client_does_not_affect_others(
+    merger: Coalescer, pools: KeyPools
+) -> None:
+    upstream = Upstream(streaming=True)
+    leaving, staying = [await handle(merger, pools, upstream) for _ in range(2)]
+    iterator = leaving.body_iterator.__aiter__()  # type: ignore[union-attr]
+    assert await anext(iterator) == b"event: message_start\n\n"
+    await iterator.aclose()  # type: ignore[attr-defined]
+
+    reading = asyncio.create_task(read(staying))
+    await asyncio.sleep(0.1)
+    upstream.release.set()
+    assert await reading == STREAM
+    assert not upstream.cancelled
+
+
+async def test_upstream_cancelled_when_all_clients_leave(
+    merger: Coalescer, pools: KeyPools
+) -> None:
+    upstream = Upstream(streaming=True)
+    response = await handle(merger, pools, upstream)
+    iterator = response.body_iterator.__aiter__()  # type: ignore[union-attr]
+    await anext(iterator)
+    await iterator.aclose()  # type: ignore[attr-defined]
+
+    await asyncio.sleep(0.1)
+    assert upstream.cancelled
+    assert merger.stats() == {"inflight": 0, "subscribers": 0}
+    assert memory_budget.stats()["shared"] == 0
@@ -0,0 +1,210 @@
+"""JSON 编解码 (common/codec.py)"""
+import copy
+import importlib
+import json
+import math
+from typing import Any
+
+import pytest
+
+from common import codec
+from common.adapters import AdapterContext
+from common.upload import iter_json
+
+orjson = pytest.importorskip("orjson")
+
+claude_code = importlib.import_module("service-cc.formats.claude_code")
+codex_instructions = importlib.import_module("service-cx.formats.codex_instructions")
+codex_tools = importlib.import_module("service-cx.formats.codex_tools")
+cc_adapter = importlib.import_module("service-cc.adapters.cherry_studio")
+cx_adapter = importlib.import_module("service-cx.adapters.cherry_studio")
+
+CLIENT_TOOL = {
+    "type": "function",
+    "name": "lookup",
+    "description": "查询 \"内部\" 文档",
+    "parameters": {"type": "object", "properties": {"q": {"type": "string"}}},
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def backend(request: pytest.FixtureRequest, monkeypatch: pytest.MonkeyPatch) -> str:
+    """两种实现都验证 (标准库 json 时 dumps_body 逐字段拼接)"""
+    if request.param == "json":
+        monkeypatch.setattr(codec, "orjson", None)
+        monkeypatch.setattr(codec, "backend", "json")
+    return str(request.param)
+
+
+# ---------------------------------------------------------------- 编解码
+
+
+def test_dumps_is_compact_utf8(backend: str) -> None:
+    value = {"text": "你好 \"x\"\n", "n": [1, 2.5, None, True], "e": {}}
+    assert codec.backend == backend
+    assert codec.dumps(value) == json.dumps(
+        value, ensure_ascii=False, separators=(",", ":")
+    ).encode()
+    assert codec.dumps({"b": 1, "a": {"d": 2, "c": 3}}, sort_keys=True) == (
+        b'{"a":{"c":3,"d":2},"b":1}'
+    )
+
+
+def test_values_orjson_rejects_fall_back(backend: str) -> None:
+    assert codec.dumps({"big": 2**70}) == b'{"big":1180591620717411303424}'
+    assert codec.dumps({1: "a"}) == b'{"1":"a"}'
+    assert math.isnan(codec.loads(b"[NaN]")[0])
+
+
+def test_dumps_default(backend: str) -> None:
+    class Token:
+        pass
+
+    assert codec.dumps({"t": Token()}, default=lambda obj: "token") == b'{"t":"token"}'
+    with pytest.raises(TypeError):
+        codec.dumps({"t": Token()})
+
+
+def test_loads(backend: str) -> None:
+    assert codec.loads(b'{"a":"\\u4f60"}') == {"a": "你"}
+    assert codec.loads('{"a": [1, 2]}') == {"a": [1, 2]}
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads(b"{broken")
+
+
+def test_with_content() -> None:
+    kwargs = {"json": {"a": 1}, "headers": {"Content-Type": "text/plain", "Content-Length": "9"}}
+    assert codec.with_content(kwargs, b'{"a":1}') == {
+        "headers": {"content-type": "application/json"},
+        "content": b'{"a":1}',
+    }
+
+
+def test_compact_json_response(backend: str) -> None:
+    response = codec.CompactJSONResponse({"text": "你好", "n": 1})
+    assert response.body == '{"text":"你好","n":1}'.encode()
+    assert response.headers["content-type"] == "application/json"
+
+
+# ---------------------------------------------------------------- 静态内容拼接
+
+
+def _plain(body: dict[str, Any]) -> bytes:
+    """不含任何已登记对象的等价请求体的 orjson 编码"""
+    return orjson.dumps(copy.deepcopy(body))
+
+
+def test_static_fragments_registered() -> None:
+    registered = {id(value) for value, _ in codec.prepared()}
+    assert id(claude_code.CLAUDE_CODE_SYSTEM) in registered
+    assert id(codex_instructions.CODEX_INSTRUCTIONS) in registered
+    assert id(codex_tools.CODEX_DEFAULT_TOOLS) in registered
+
+
+def test_claude_system_prompt_spliced(backend: str) -> None:
+    body = {
+        "model": "claude-sonnet-4-5",
+        "system": claude_code.CLAUDE_CODE_SYSTEM,
+        "messages": [{"role": "user", "content": "你好"}],
+    }
+    assert codec.dumps_body(body) == _plain(body)
+    assert b"".join(iter_json(body)) == _plain(body)
+
+
+def test_codex_instructions_and_tools_spliced(backend: str) -> None:
+    body = {
+        "model": "gpt-5-codex",
+        "instructions": codex_instructions.CODEX_INSTRUCTIONS,
+        # 默认工具 + 客户端工具: 逐个元素拼接
+        "tools": [*codex_tools.CODEX_DEFAULT_TOOLS, CLIENT_TOOL],
+        "input": [{"role": "user", "content": [{"type": "input_text", "text": "ls"}]}],
+    }
+    assert codec.dumps_body(body) == _plain(body)
+    assert codec.dumps_body({**body, "tools": codex_tools.CODEX_DEFAULT_TOOLS}) == _plain(
+        {**body, "tools": codex_tools.CODEX_DEFAULT_TOOLS}
+    )
+
+
+@pytest.mark.parametrize(
+    ("adapter", "request_body"),
+    [
+        (
+            cc_adapter.CherryStudioAdapter(),
+            {
+                "model": "claude-sonnet-4-5",
+                "system": "Answer in \"quotes\".",
+                "messages": [{"role": "user", "content": [{"type": "text", "text": "北京?"}]}],
+            },
+        ),
+        (
+            cx_adapter.CherryStudioAdapter(),
+            {"model": "gpt-5-codex", "tools": [CLIENT_TOOL], "input": "Hello"},
+        ),
+    ],
+)
+def test_adapter_output_matches_plain_encoding(
+    adapter: Any, request_body: dict[str, Any], backend: str
+) -> None:
+    context = AdapterContext(
+        raw_body=json.loads(json.dumps(request_body)),
+        raw_headers={"user-agent": "CherryStudio/1.6.5"},
+    )
+    body = adapter.transform(context).body
+    assert codec.dumps_body(body) == _plain(body)
+
+
+def test_splicing_skips_prepared_values(backend: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    encoded: list[Any] = []
+    dumps = codec.dumps
+
+    def spy(value: Any, **kwargs: Any) -> bytes:
+        encoded.append(value)
+        return dumps(value, **kwargs)
+
+    monkeypatch.setattr(codec, "dumps", spy)
+    body = {"model": "m", "tools": [*codex_tools.CODEX_DEFAULT_TOOLS, CLIENT_TOOL]}
+    codec.dumps_body(body)
+    if backend == "orjson":
+        # orjson 整体编码更快, 不拼接
+        assert encoded == [body]
+    else:
+        assert CLIENT_TOOL in encoded
+        assert not any(item is codex_tools.CODEX_DEFAULT_TOOLS[0] for item in encoded)
+
+
+def test_prepared_values_are_read_only() -> None:
+    tools = codec.prepare([{"name": "a", "parameters": {"type": "object"}}, {"name": "b"}])
+    with pytest.raises(TypeError):
+        tools[0]["parameters"]["required"] = ["x"]
+    with pytest.raises(TypeError):
+        tools.append({"name": "c"})
+    with pytest.raises(TypeError):
+        tools[1].update(description="changed")
+    assert orjson.dumps(tools) == b'[{"name":"a","parameters":{"type":"object"}},{"name":"b"}]'
+
+    # 复制得到可修改的普通对象
+    copied = copy.deepcopy(tools)
+    copied[0]["parameters"]["required"] = ["x"]
+    assert type(copied[0]) is dict
+    assert "required" not in tools[0]["parameters"]
+    shallow = copy.copy(tools[1])
+    shallow["description"] = "changed"
+    assert type(shallow) is dict
+
+
+def test_default_tools_shared_but_not_modified() -> None:
+    adapter = cx_adapter.CherryStudioAdapter()
+    context = AdapterContext(
+        raw_body={"model": "gpt-5-codex", "tools": [CLIENT_TOOL], "input": "Hello"},
+        raw_headers={"user-agent": "CherryStudio/1.6.5"},
+    )
+    tools = adapter.transform(context).body["tools"]
+    assert tools[0] is codex_tools.CODEX_DEFAULT_TOOLS[0]
+    with pytest.raises(TypeError):
+        tools[0]["strict"] = True
+
+
+def test_dumps_body_without_prepared_values(backend: str) -> None:
+    body = {"model": "m", "stream": True, "messages": [{"role": "user", "content": "hi"}]}
+    assert codec.dumps_body(body) == orjson.dumps(body)
+    assert codec.dumps_body([1, 2]) == b"[1,2]"
@@ -0,0 +1,134 @@
+"""上游请求体压缩 (common/compression.py)"""
+import gzip
+import json
+
+import httpx
+import pytest
+
+from common import compression
+from common.balancer import UpstreamGroup
+from common.compression import RequestCompressor, compressor
+from common.config import settings
+from common.http_client import HTTPClient
+
+from .conftest import MockUpstream
+
+BODY = {"model": "claude-sonnet-4", "messages": [{"role": "user", "content": "x" * 200}]}
+
+
+@pytest.fixture
+def negotiation(monkeypatch: pytest.MonkeyPatch) -> RequestCompressor:
+    """对上游 test-gzip 启用 gzip 压缩 (协商状态从空开始)"""
+    monkeypatch.setattr(settings, "http_request_compression", {"test-gzip": "gzip"})
+    monkeypatch.setattr(settings, "http_compression_min_bytes", 100)
+    monkeypatch.setattr(compressor, "_negotiations", {})
+    return compressor
+
+
+@pytest.fixture
+def group() -> UpstreamGroup:
+    return UpstreamGroup("test-gzip", ["https://relay-a/api"])
+
+
+def decoded(request: httpx.Request) -> object:
+    body = request.content
+    if request.headers.get("content-encoding") == "gzip":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+
+async def test_compress_json_body(negotiation: RequestCompressor) -> None:
+    kwargs = {"json": BODY, "headers": {"Content-Type": "application/json", "x-api-key": "sk"}}
+    result = await negotiation.compress("test-gzip", kwargs)
+
+    assert result is not None
+    assert "json" not in result
+    assert result["headers"] == {
+        "x-api-key": "sk",
+        "content-type": "application/json",
+        "content-encoding": "gzip",
+    }
+    assert json.loads(gzip.decompress(result["content"])) == BODY
+
+
+async def test_small_or_unconfigured_bodies_are_not_compressed(
+    negotiation: RequestCompressor,
+) -> None:
+    assert await negotiation.compress("test-gzip", {"json": {"model": "x"}}) is None
+    assert await negotiation.compress("other", {"json": BODY}) is None
+    assert await negotiation.compress("test-gzip", {"params": {}}) is None
+
+    raw = json.dumps(BODY).encode()
+    result = await negotiation.compress("test-gzip", {"content": raw})
+    assert result is not None and gzip.decompress(result["content"]) == raw
+
+
+def test_zstd_falls_back_to_gzip(
+    negotiation: RequestCompressor, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "http_request_compression", {"test-gzip": "zstd"})
+    monkeypatch.setattr(compression, "zstandard", None)
+    assert negotiation.encoding_for("test-gzip") == "gzip"
+
+
+def test_maybe_rejected(negotiation: RequestCompressor) -> None:
+    assert negotiation.maybe_rejected("test-gzip", "gzip", 415)
+    assert negotiation.maybe_rejected("test-gzip", "gzip", 400)
+    assert not negotiation.maybe_rejected("test-gzip", "gzip", 500)
+
+    # 已确认支持后 400 只是普通的错误请求
+    negotiation.record("test-gzip", "gzip", supported=True)
+    assert not negotiation.maybe_rejected("test-gzip", "gzip", 400)
+    assert negotiation.maybe_rejected("test-gzip", "gzip", 415)
+
+
+async def test_compressed_request_success_confirms_support(
+    client: HTTPClient, upstream: MockUpstream, group: UpstreamGroup, negotiation: RequestCompressor
+) -> None:
+    await client.request("POST", "/v1/messages", upstream=group, json=BODY)
+
+    request = upstream.requests[0]
+    assert request.headers["content-encoding"] == "gzip"
+    assert decoded(request) == BODY
+    assert negotiation.stats() == {"test-gzip/gzip": {"supported": True, "disabled_seconds": 0.0}}
+
+
+async def test_rejected_compression_is_retried_uncompressed(
+    client: HTTPClient, upstream: MockUpstream, group: UpstreamGroup, negotiation: RequestCompressor
+) -> None:
+    upstream.respond = lambda request: httpx.Response(
+        400 if "content-encoding" in request.headers else 200
+    )
+    response = await client.request("POST", "/v1/messages", upstream=group, json=BODY)
+
+    assert response.status_code == 200
+    assert [request.headers.get("content-encoding") for request in upstream.requests] == [
+        "gzip",
+        None,
+    ]
+    assert decoded(upstream.requests[1]) == BODY
+    assert negotiation.encoding_for("test-gzip") is None
+
+    # 不支持期间直接发送未压缩请求体
+    await client.request("POST", "/v1/messages", upstream=group, json=BODY)
+    assert len(upstream.requests) == 3
+    assert "content-encoding" not in upstream.requests[2].headers
+
+
+async def test_plain_bad_request_keeps_compression(
+    client: HTTPClient, upstream: MockUpstream, group: UpstreamGroup, negotiation: RequestCompressor
+) -> None:
+    upstream.respond = lambda request: httpx.Response(400)
+    response = await client.open_stream("POST", "/v1/messages", upstream=group, json=BODY)
+    await response.aclose()
+
+    # 未压缩重发同样返回 400: 不是压缩导致的拒绝
+    assert response.status_code == 400
+    assert len(upstream.requests) == 2
+    assert negotiation.encoding_for("test-gzip") == "gzip"
+
+    # 已确认支持时 400 不再重发
+    negotiation.record("test-gzip", "gzip", supported=True)
+    response = await client.open_stream("POST", "/v1/messages", upstream=group, json=BODY)
+    await response.aclose()
+    assert len(upstream.requests) == 3
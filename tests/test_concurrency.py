@@ -0,0 +1,142 @@
+"""上游自适应并发限制 (common/concurrency.py)"""
+import asyncio
+
+import pytest
+
+from common.concurrency import AdaptiveLimiter
+from common.config import settings
+from common.errors import RateLimitError
+
+
+@pytest.fixture
+def limiter(monkeypatch: pytest.MonkeyPatch) -> AdaptiveLimiter:
+    """上限为 2 的限制器"""
+    monkeypatch.setattr(settings, "concurrency_limit_enabled", True)
+    monkeypatch.setattr(settings, "concurrency_initial_limit", 2)
+    monkeypatch.setattr(settings, "concurrency_min_limit", 1)
+    return AdaptiveLimiter("test")
+
+
+def test_initial_limit_defaults_to_pool_size(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "concurrency_initial_limit", None)
+    monkeypatch.setattr(settings, "http_max_connections", 150)
+    assert AdaptiveLimiter("test").limit == 150
+
+    # 限制在 [concurrency_min_limit, concurrency_max_limit] 内
+    monkeypatch.setattr(settings, "http_max_connections", 500)
+    assert AdaptiveLimiter("test").limit == settings.concurrency_max_limit
+    monkeypatch.setattr(settings, "concurrency_initial_limit", 1)
+    assert AdaptiveLimiter("test").limit == settings.concurrency_min_limit
+
+
+async def test_requests_over_limit_queue_in_order(limiter: AdaptiveLimiter) -> None:
+    first = await limiter.acquire()
+    await limiter.acquire()
+    order: list[int] = []
+
+    async def queued(index: int) -> None:
+        await limiter.acquire()
+        order.append(index)
+
+    tasks = [asyncio.create_task(queued(index)) for index in range(3)]
+    await asyncio.sleep(0)
+    assert limiter.to_dict()["queued"] == 3
+    assert order == []
+
+    limiter.release(first)
+    await asyncio.sleep(0)
+    assert order == [0]
+    assert limiter.inflight == 2
+
+    for _ in range(2):
+        limiter.release(first)
+    await asyncio.gather(*tasks)
+    assert order == [0, 1, 2]
+
+
+async def test_full_queue_rejects(
+    limiter: AdaptiveLimiter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "concurrency_max_queue", 1)
+    await limiter.acquire()
+    await limiter.acquire()
+    waiting = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(RateLimitError) as info:
+        limiter.check()
+    assert info.value.status_code == 429
+    with pytest.raises(RateLimitError):
+        await limiter.acquire()
+
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    assert limiter.to_dict()["queued"] == 0
+
+
+async def test_queue_timeout_rejects(
+    limiter: AdaptiveLimiter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "concurrency_queue_timeout", 0.02)
+    await limiter.acquire()
+    await limiter.acquire()
+    with pytest.raises(RateLimitError):
+        await limiter.acquire()
+    assert limiter.to_dict()["queued"] == 0
+    assert limiter.inflight == 2
+
+
+async def test_estimated_wait_beyond_deadline_rejects(
+    limiter: AdaptiveLimiter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "concurrency_queue_timeout", 1.0)
+    acquired = await limiter.acquire()
+    limiter.release(acquired - 10)  # 平均持有 10 秒
+    await limiter.acquire()
+    await limiter.acquire()
+
+    # (0 + 1) / 2 × 10 秒 > 1 秒
+    assert limiter.estimated_wait() == pytest.approx(5.0, abs=0.1)
+    with pytest.raises(RateLimitError):
+        await limiter.acquire()
+
+
+def test_overload_shrinks_limit(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "concurrency_initial_limit", 100)
+    limiter = AdaptiveLimiter("test")
+    limiter.record(None, dropped=True)
+    assert limiter.limit == 100 * settings.concurrency_backoff_ratio
+
+
+def test_limit_grows_only_under_load(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "concurrency_initial_limit", 10)
+    limiter = AdaptiveLimiter("test")
+    limiter.record(None, dropped=False)
+    assert limiter.limit == 10
+
+    limiter.inflight = 8
+    limiter.record(None, dropped=False)
+    assert limiter.limit == pytest.approx(10.1)
+
+
+def test_gradient_follows_latency(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "concurrency_initial_limit", 100)
+    limiter = AdaptiveLimiter("test")
+    limiter.inflight = 100
+    limiter.record(1.0, dropped=False)
+    grown = limiter.limit
+    assert grown > 100
+
+    # 首字节耗时远高于长期水平时收缩
+    for _ in range(5):
+        limiter.record(10.0, dropped=False)
+    assert limiter.limit < grown
+
+
+async def test_disabled_limiter_never_queues(
+    limiter: AdaptiveLimiter, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "concurrency_limit_enabled", False)
+    for _ in range(5):
+        await limiter.acquire()
+    assert limiter.inflight == 5
@@ -0,0 +1,133 @@
+"""流式响应续写 (service-cc/continuation.py)"""
+import importlib
+import json
+from typing import Any
+
+import pytest
+
+continuation = importlib.import_module("service-cc.continuation")
+StreamContinuation = continuation.StreamContinuation
+StreamInterruptedError = continuation.StreamInterruptedError
+
+BODY = {"model": "claude-x", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+
+
+def event(event_type: str, **data: Any) -> bytes:
+    payload = json.dumps({"type": event_type, **data}, separators=(",", ":"))
+    return f"event: {event_type}\ndata: {payload}\n\n".encode()
+
+
+def message_start(input_tokens: int) -> bytes:
+    return event("message_start", message={"id": "m", "usage": {"input_tokens": input_tokens}})
+
+
+def text_start(index: int = 0) -> bytes:
+    return event("content_block_start", index=index, content_block={"type": "text", "text": ""})
+
+
+def text_delta(text: str, index: int = 0) -> bytes:
+    return event("content_block_delta", index=index, delta={"type": "text_delta", "text": text})
+
+
+OVERLOADED = event("error", error={"type": "overloaded_error", "message": "Overloaded"})
+
+
+def parse(events: list[bytes]) -> list[tuple[str, dict[str, Any]]]:
+    result = []
+    for raw in events:
+        lines = raw.decode().strip().split("\n")
+        result.append((lines[0][len("event: ") :], json.loads(lines[1][len("data: ") :])))
+    return result
+
+
+def test_events_before_resumable_error_are_forwarded() -> None:
+    stream = StreamContinuation(BODY)
+    chunk = message_start(5) + text_start() + text_delta("Hello") + OVERLOADED
+
+    with pytest.raises(StreamInterruptedError) as info:
+        stream.feed(chunk)
+    assert info.value.reason == "overloaded_error"
+
+    # 错误事件之前的事件已计入 prefill, 必须先转发给客户端
+    pending = stream.take_pending()
+    assert [name for name, _ in parse(pending)] == [
+        "message_start",
+        "content_block_start",
+        "content_block_delta",
+    ]
+    assert stream.take_pending() == []
+    assert stream.prepare_resume()["messages"][-1] == {"role": "assistant", "content": "Hello"}
+
+
+def test_resumed_stream_is_spliced() -> None:
+    stream = StreamContinuation(BODY)
+    first = stream.feed(message_start(5) + text_start() + text_delta("Hello "))
+    assert len(first) == 3
+    assert stream.can_resume()
+
+    body = stream.prepare_resume()
+    assert body["messages"][-1] == {"role": "assistant", "content": "Hello"}
+    assert stream.request_body is body
+
+    resumed = stream.feed(
+        message_start(8)
+        + text_start()
+        + text_delta(" world")
+        + event("content_block_stop", index=0)
+        + event("message_delta", delta={"stop_reason": "end_turn"}, usage={"output_tokens": 2})
+        + event("message_stop")
+    )
+    events = parse(resumed)
+    # 续写的 message_start 和第一个 content_block_start 被丢弃, 文本并入原文本块
+    assert [name for name, _ in events] == [
+        "content_block_delta",
+        "content_block_stop",
+        "message_delta",
+        "message_stop",
+    ]
+    # 已转发的尾部空白在续写开头去重
+    assert events[0][1]["delta"]["text"] == "world"
+    # 中断前已生成的 token (续写请求多出的输入 token) 计入输出
+    assert events[2][1]["usage"]["output_tokens"] == 5
+    assert stream.complete
+
+
+def test_incomplete_events_stay_buffered() -> None:
+    stream = StreamContinuation(BODY)
+    raw = message_start(5)
+    assert stream.feed(raw[:10]) == []
+    assert stream.feed(raw[10:]) == [raw]
+    assert stream.flush() == b""
+
+
+def test_non_resumable_requests() -> None:
+    thinking = StreamContinuation({**BODY, "thinking": {"type": "enabled", "budget_tokens": 1024}})
+    thinking.feed(message_start(5) + text_start() + text_delta("Hi"))
+    assert not thinking.can_resume()
+    # 无法续写时错误事件原样转发
+    assert thinking.feed(OVERLOADED) == [OVERLOADED]
+
+    tool = StreamContinuation(BODY)
+    tool.feed(
+        message_start(5)
+        + event(
+            "content_block_start",
+            index=0,
+            content_block={"type": "tool_use", "id": "t", "name": "x", "input": {}},
+        )
+    )
+    assert not tool.can_resume()
+
+
+def test_stop_reason_received_only_needs_message_stop() -> None:
+    stream = StreamContinuation(BODY)
+    stream.feed(
+        message_start(5)
+        + text_start()
+        + text_delta("done")
+        + event("message_delta", delta={"stop_reason": "end_turn"}, usage={"output_tokens": 1})
+    )
+    assert stream.stop_reason == "end_turn"
+    assert not stream.can_resume()
+    assert parse([stream.finish_event()]) == [("message_stop", {"type": "message_stop"})]
+    assert stream.complete
@@ -0,0 +1,106 @@
+"""客户端断开检测 (common/disconnect.py)"""
+import asyncio
+
+from starlette.types import Message, Receive, Scope, Send
+
+from common.disconnect import CancelOnDisconnectMiddleware
+from common.metrics import metrics
+
+SCOPE: Scope = {"type": "http", "path": "/test-disconnect"}
+
+
+def make_receive(disconnect: asyncio.Event) -> Receive:
+    """先返回完整请求体, 之后在 disconnect 被设置时返回 http.disconnect"""
+    messages: list[Message] = [{"type": "http.request", "body": b"{}", "more_body": False}]
+
+    async def receive() -> Message:
+        if messages:
+            return messages.pop(0)
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    return receive
+
+
+async def test_disconnect_cancels_waiting_handler() -> None:
+    metrics.reset()
+    cancelled = asyncio.Event()
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        assert (await receive())["body"] == b"{}"
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    disconnect = asyncio.Event()
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    task = asyncio.create_task(
+        CancelOnDisconnectMiddleware(app)(SCOPE, make_receive(disconnect), send)
+    )
+    await asyncio.sleep(0.01)
+    disconnect.set()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert cancelled.is_set()
+    assert sent == []
+    assert metrics.get_counter(
+        "client_disconnects", path="/test-disconnect", phase="waiting"
+    ) == 1
+
+
+async def test_disconnect_cancels_streaming_response() -> None:
+    metrics.reset()
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        while True:
+            await send({"type": "http.response.body", "body": b"data: {}\n\n", "more_body": True})
+            await asyncio.sleep(0.005)
+
+    disconnect = asyncio.Event()
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    task = asyncio.create_task(
+        CancelOnDisconnectMiddleware(app)(SCOPE, make_receive(disconnect), send)
+    )
+    await asyncio.sleep(0.02)
+    disconnect.set()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert sent[0]["type"] == "http.response.start"
+    assert metrics.get_counter(
+        "client_disconnects", path="/test-disconnect", phase="streaming"
+    ) == 1
+
+
+async def test_completed_request_is_not_cancelled() -> None:
+    metrics.reset()
+
+    async def app(scope: Scope, receive: Receive, send: Send) -> None:
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    sent: list[Message] = []
+
+    async def send(message: Message) -> None:
+        sent.append(message)
+
+    # 从不断开: 处理完成后 watcher 被取消
+    await asyncio.wait_for(
+        CancelOnDisconnectMiddleware(app)(SCOPE, make_receive(asyncio.Event()), send),
+        timeout=1,
+    )
+    assert [message["type"] for message in sent] == ["http.response.start", "http.response.body"]
+    assert metrics.get_counter("client_disconnects", path="/test-disconnect", phase="waiting") == 0
+
@@ -0,0 +1,125 @@
+"""上游 DNS 缓存 (common/dns.py)"""
+import asyncio
+import socket
+import time
+from typing import Any
+
+import httpcore
+import pytest
+
+from common import dns
+from common.config import settings
+from common.dns import dns_cache
+from common.transports import CachedDNSBackend
+
+
+class FakeResolver:
+    """替代 getaddrinfo: 返回 addresses (为 None 时解析失败), 记录解析次数"""
+
+    def __init__(self) -> None:
+        self.addresses: list[str] | None = ["10.0.0.1", "10.0.0.2"]
+        self.calls = 0
+
+    async def __call__(self, host: str) -> list[str]:
+        self.calls += 1
+        await asyncio.sleep(0)
+        if self.addresses is None:
+            raise socket.gaierror(socket.EAI_AGAIN, "temporary failure")
+        return list(self.addresses)
+
+
+@pytest.fixture
+def resolver(monkeypatch: pytest.MonkeyPatch) -> FakeResolver:
+    fake = FakeResolver()
+    monkeypatch.setattr(dns, "aiodns", None)
+    monkeypatch.setattr(dns, "_getaddrinfo", fake)
+    monkeypatch.setattr(dns_cache, "_entries", {})
+    monkeypatch.setattr(dns_cache, "_pending", {})
+    return fake
+
+
+async def test_ip_is_not_resolved(resolver: FakeResolver) -> None:
+    assert await dns_cache.targets("10.1.2.3") == ["10.1.2.3"]
+    assert await dns_cache.targets("::1") == ["::1"]
+    assert resolver.calls == 0
+
+
+async def test_cached_addresses_rotate(resolver: FakeResolver) -> None:
+    assert await dns_cache.targets("relay-a") == ["10.0.0.1", "10.0.0.2"]
+    assert await dns_cache.targets("relay-a") == ["10.0.0.2", "10.0.0.1"]
+    assert await dns_cache.targets("relay-a") == ["10.0.0.1", "10.0.0.2"]
+    assert resolver.calls == 1
+    assert dns_cache.stats()["relay-a"]["ttl"] == settings.dns_default_ttl
+
+
+async def test_concurrent_lookups_share_one_resolve(resolver: FakeResolver) -> None:
+    results = await asyncio.gather(*(dns_cache.targets("relay-a") for _ in range(5)))
+    assert {tuple(sorted(result)) for result in results} == {("10.0.0.1", "10.0.0.2")}
+    assert resolver.calls == 1
+
+
+async def test_refresh_ahead_does_not_block(resolver: FakeResolver) -> None:
+    await dns_cache.targets("relay-a")
+    dns_cache._entries["relay-a"].refresh_at = 0
+    resolver.addresses = ["10.0.0.3"]
+
+    # 使用当前结果, 后台刷新
+    assert sorted(await dns_cache.targets("relay-a")) == ["10.0.0.1", "10.0.0.2"]
+    await asyncio.gather(*dns_cache._pending.values())
+    assert await dns_cache.targets("relay-a") == ["10.0.0.3"]
+    assert resolver.calls == 2
+
+
+async def test_stale_addresses_used_when_resolve_fails(resolver: FakeResolver) -> None:
+    await dns_cache.targets("relay-a")
+    entry = dns_cache._entries["relay-a"]
+    resolver.addresses = None
+
+    # 过期不超过 dns_stale_ttl: 继续使用过期结果
+    entry.expires = time.monotonic() - 1
+    assert sorted(await dns_cache.targets("relay-a")) == ["10.0.0.1", "10.0.0.2"]
+
+    entry.expires -= settings.dns_stale_ttl
+    with pytest.raises(OSError):
+        await dns_cache.targets("relay-a")
+    with pytest.raises(OSError):
+        await dns_cache.targets("relay-b")
+
+
+async def test_record_ttl_is_clamped(
+    resolver: FakeResolver, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "dns_min_ttl", 5.0)
+    monkeypatch.setattr(settings, "dns_max_ttl", 60.0)
+
+    async def query(host: str) -> tuple[list[str], float]:
+        return ["10.0.0.1"], 3600.0 if host == "relay-a" else 1.0
+
+    # 安装 aiodns 时使用记录的 TTL
+    monkeypatch.setattr(dns, "aiodns", object())
+    monkeypatch.setattr(dns_cache, "_query", query)
+    await dns_cache.targets("relay-a")
+    await dns_cache.targets("relay-b")
+    assert dns_cache.stats()["relay-a"]["ttl"] == 60.0
+    assert dns_cache.stats()["relay-b"]["ttl"] == 5.0
+    assert resolver.calls == 0
+
+
+async def test_backend_fails_over_to_next_address(resolver: FakeResolver) -> None:
+    attempts: list[str] = []
+
+    class Backend(httpcore.AsyncNetworkBackend):
+        async def connect_tcp(self, host: str, port: int, **kwargs: Any) -> Any:
+            attempts.append(host)
+            if host == "10.0.0.1":
+                raise httpcore.ConnectError("connection refused")
+            return host
+
+    backend = CachedDNSBackend(Backend())
+    assert await backend.connect_tcp("relay-a", 443) == "10.0.0.2"
+    assert attempts == ["10.0.0.1", "10.0.0.2"]
+
+    resolver.addresses = ["10.0.0.1"]
+    dns_cache._entries.clear()
+    with pytest.raises(httpcore.ConnectError):
+        await backend.connect_tcp("relay-a", 443)
@@ -0,0 +1,88 @@
+"""对冲请求 (common/http_client.py HTTPClient._race)"""
+import asyncio
+
+import httpx
+import pytest
+
+from common.balancer import UpstreamGroup
+from common.config import settings
+from common.http_client import HTTPClient
+from common.metrics import metrics
+
+from .conftest import MockUpstream
+
+
+@pytest.fixture
+def group(monkeypatch: pytest.MonkeyPatch) -> UpstreamGroup:
+    """两个端点的上游组, 已有足够的首字节耗时样本 (对冲延迟 50ms)"""
+    monkeypatch.setattr(settings, "hedge_enabled", True)
+    monkeypatch.setattr(settings, "hedge_min_samples", 3)
+    monkeypatch.setattr(settings, "hedge_min_delay", 0.05)
+    metrics.reset()
+    group = UpstreamGroup("test-hedge", ["https://relay-a/api", "https://relay-b/api"])
+    group.endpoints[0].observe(0.1)
+    group.endpoints[1].observe(1.0)
+    for _ in range(3):
+        metrics.observe("upstream_ttfb_ms", 10, upstream=group.name, model="-", stream=False)
+    return group
+
+
+async def test_hedge_wins_over_slow_primary(
+    client: HTTPClient, upstream: MockUpstream, group: UpstreamGroup
+) -> None:
+    async def respond(request: httpx.Request) -> httpx.Response:
+        if request.url.host == "relay-a":
+            await asyncio.sleep(10)
+        return httpx.Response(200, json={"host": request.url.host})
+
+    upstream.respond = respond
+    response = await client.request("POST", "/v1/messages", upstream=group, json={})
+
+    assert response.json() == {"host": "relay-b"}
+    assert [request.url.host for request in upstream.requests] == ["relay-a", "relay-b"]
+    assert metrics.get_counter("upstream_hedges", upstream=group.name) == 1
+    assert metrics.get_counter("upstream_hedge_wins", upstream=group.name) == 1
+    await asyncio.sleep(0)
+    assert [endpoint.outstanding for endpoint in group.endpoints] == [0, 0]
+
+
+async def test_fast_primary_is_not_hedged(
+    client: HTTPClient, upstream: MockUpstream, group: UpstreamGroup
+) -> None:
+    await client.request("POST", "/v1/messages", upstream=group, json={})
+    assert len(upstream.requests) == 1
+    assert metrics.get_counter("upstream_hedges", upstream=group.name) == 0
+
+
+async def test_no_hedge_without_samples(
+    client: HTTPClient,
+    upstream: MockUpstream,
+    group: UpstreamGroup,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "hedge_min_samples", 4)
+    assert client._hedge_delay(group.name, None, False) is None
+
+    monkeypatch.setattr(settings, "hedge_min_samples", 3)
+    assert client._hedge_delay(group.name, None, False) == 0.05
+
+
+async def test_exhausted_hedge_budget_skips_hedging(
+    client: HTTPClient,
+    upstream: MockUpstream,
+    group: UpstreamGroup,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "hedge_budget_ratio", 0.0)
+    monkeypatch.setattr(settings, "hedge_budget_max_tokens", 0.0)
+
+    async def respond(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.1)
+        return httpx.Response(200)
+
+    upstream.respond = respond
+    await client.request("POST", "/v1/messages", upstream=group, json={})
+    assert len(upstream.requests) == 1
+    assert metrics.get_counter(
+        "upstream_hedges_skipped", upstream=group.name, reason="budget_exhausted"
+    ) == 1
@@ -0,0 +1,131 @@
+"""HTTP 客户端 (common/http_client.py)"""
+import asyncio
+
+import httpx
+import pytest
+
+from common.config import HTTPPoolConfig, settings
+from common.http_client import HTTPClient
+from common.metrics import metrics
+from common.transports import transport_stats
+
+from .conftest import MockUpstream
+
+# ---------------------------------------------------------------- 连接预热 / 保活
+
+
+async def test_prewarm_pings_each_upstream(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "http_prewarm_connections", 3)
+    stats = await client.prewarm(["https://relay-a/api", "https://relay-b/api"])
+
+    assert sorted(stats) == ["https://relay-a", "https://relay-b"]
+    assert stats["https://relay-a"]["base_url"] == "https://relay-a/api"
+    assert stats["https://relay-a"]["error"] is None
+    assert [request.method for request in upstream.requests] == ["HEAD"] * 6
+    assert client.warm_stats is stats
+
+
+async def test_prewarm_disabled(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "http_prewarm_connections", 0)
+    assert await client.prewarm(["https://relay-a/api"]) == {}
+    client.start_keepwarm(["https://relay-a/api"])
+    assert upstream.requests == []
+    assert client._keepwarm_task is None
+
+
+async def test_prewarm_failure_is_recorded(client: HTTPClient, upstream: MockUpstream) -> None:
+    def refuse(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("connection refused", request=request)
+
+    upstream.respond = refuse
+    stats = await client.prewarm(["https://relay-a/api"])
+    assert stats["https://relay-a"]["error"] == "connection refused"
+
+
+async def test_prewarm_timeout_does_not_block_startup(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    async def hang(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(10)
+        return httpx.Response(200)
+
+    monkeypatch.setattr(settings, "http_prewarm_timeout", 0.05)
+    upstream.respond = hang
+    assert await client.prewarm(["https://relay-a/api"]) == {}
+
+
+async def test_keepwarm_pings_until_closed(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "http_prewarm_connections", 1)
+    monkeypatch.setattr(settings, "http_keepwarm_interval", 0.01)
+    client.start_keepwarm(["https://relay-a/api"])
+    task = client._keepwarm_task
+    client.start_keepwarm(["https://relay-a/api"])
+    assert client._keepwarm_task is task
+
+    await asyncio.sleep(0.1)
+    assert len(upstream.requests) >= 2
+    await client.close()
+    assert task is not None
+    await asyncio.wait([task])
+    assert task.cancelled()
+
+
+# ---------------------------------------------------------------- 连接池隔离
+
+
+def test_select_pool_prefers_most_specific_match(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        settings,
+        "http_pools",
+        {
+            "relay": HTTPPoolConfig(base_url="https://relay-a"),
+            "relay-stream": HTTPPoolConfig(base_url="https://relay-a", stream=True),
+            "opus": HTTPPoolConfig(models=["claude-opus"]),
+        },
+    )
+    client = HTTPClient()
+    assert client.select_pool("https://relay-a/v1/messages") == "relay"
+    assert client.select_pool("https://relay-a/v1/messages", stream=True) == "relay-stream"
+    assert client.select_pool("https://relay-b/v1/messages", model="claude-opus-4") == "opus"
+    # 均不匹配时按上游 origin 隔离
+    assert client.select_pool("https://relay-b:8443/v1/messages") == "https://relay-b:8443"
+
+
+async def test_pools_use_separate_clients(client: HTTPClient, upstream: MockUpstream) -> None:
+    await client.request("POST", "https://relay-a/v1/messages", json={})
+    await client.request("POST", "https://relay-b/v1/messages", json={})
+    await client.request("POST", "https://relay-a/v1/messages", json={})
+
+    assert sorted(client._clients) == ["https://relay-a", "https://relay-b"]
+    assert client._clients["https://relay-a"] is not client._clients["https://relay-b"]
+    stats = client.pool_stats()
+    assert set(stats) == {"https://relay-a", "https://relay-b"}
+    assert {"connections", "active", "idle", "queued", "opened_total"} <= set(
+        stats["https://relay-a"]
+    )
+
+
+async def test_pool_limits_override_global_settings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "http_transport", "http1")
+    monkeypatch.setattr(settings, "http_transport_stripes", 1)
+    client = HTTPClient()._create_client(HTTPPoolConfig(max_connections=7, max_keepalive=50))
+    try:
+        assert transport_stats(client._transport)["max_connections"] == 7
+    finally:
+        await client.aclose()
+
+
+def test_metrics_summary_quantiles() -> None:
+    for value in range(1, 101):
+        metrics.observe("test_pool_wait_ms", float(value), pool="p")
+    assert metrics.count("test_pool_wait_ms", pool="p") == 100
+    assert metrics.quantile("test_pool_wait_ms", 0.5, pool="p") == 51.0
+    summary = metrics.snapshot()["summaries"]["test_pool_wait_ms{pool=p}"]
+    assert summary["max"] == 100.0
+    assert summary["p99"] == 100.0
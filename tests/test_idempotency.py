@@ -0,0 +1,163 @@
+"""Idempotency-Key 支持 (common/idempotency.py)"""
+import asyncio
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from typing import Any
+
+import pytest
+from fastapi.responses import Response, StreamingResponse
+from starlette.requests import Request
+
+from common.config import settings
+from common.errors import IdempotencyKeyReusedError
+from common.idempotency import REPLAYED_HEADER, IdempotencyStore, idempotency
+
+
+def make_request(body: bytes = b'{"model":"x"}', key: str | None = "req-1") -> Request:
+    headers = [(b"idempotency-key", key.encode())] if key else []
+
+    async def receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "scheme": "http",
+        "server": ("proxy", 80),
+        "path": "/v1/messages",
+        "query_string": b"",
+        "headers": headers,
+    }
+    return Request(scope, receive)
+
+
+async def read(response: Response) -> bytes:
+    if isinstance(response, StreamingResponse):
+        return b"".join([chunk async for chunk in response.body_iterator])  # type: ignore[misc]
+    return bytes(response.body)
+
+
+class Upstream:
+    """模拟请求处理: 记录调用次数, 流式响应在 release 之后才结束"""
+
+    def __init__(self, status_code: int = 200, streaming: bool = False) -> None:
+        self.status_code = status_code
+        self.streaming = streaming
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.cancelled = False
+
+    async def __call__(self) -> Response | Any:
+        self.calls += 1
+        if not self.streaming:
+            if self.status_code != 200:
+                return Response(b"bad", status_code=self.status_code)
+            return {"id": f"msg_{self.calls}"}
+        return StreamingResponse(self._events(), media_type="text/event-stream")
+
+    async def _events(self) -> AsyncIterator[bytes]:
+        try:
+            yield b"event: message_start\n\n"
+            await self.release.wait()
+            yield b"event: message_stop\n\n"
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+@pytest.fixture
+def store(monkeypatch: pytest.MonkeyPatch) -> IdempotencyStore:
+    monkeypatch.setattr(settings, "idempotency_enabled", True)
+    monkeypatch.setattr(settings, "idempotency_orphan_grace", 0.05)
+    monkeypatch.setattr(idempotency, "_inflight", {})
+    monkeypatch.setattr(idempotency, "_completed", OrderedDict())
+    monkeypatch.setattr(idempotency, "_stored_bytes", 0)
+    return idempotency
+
+
+async def test_without_key_calls_through(store: IdempotencyStore) -> None:
+    upstream = Upstream()
+    assert await store.handle(make_request(key=None), "sk-a", upstream) == {"id": "msg_1"}
+    assert await store.handle(make_request(key=None), "sk-a", upstream) == {"id": "msg_2"}
+
+
+async def test_completed_response_is_replayed(store: IdempotencyStore) -> None:
+    upstream = Upstream()
+    first = await store.handle(make_request(), "sk-a", upstream)
+    await asyncio.sleep(0)
+    second = await store.handle(make_request(), "sk-a", upstream)
+
+    assert upstream.calls == 1
+    assert await read(first) == await read(second) == b'{"id":"msg_1"}'
+    assert REPLAYED_HEADER not in first.headers
+    assert second.headers[REPLAYED_HEADER] == "true"
+    assert store.stats()["stored"] == 1
+
+    # Key 按调用方隔离
+    await store.handle(make_request(), "sk-b", upstream)
+    assert upstream.calls == 2
+
+
+async def test_reused_key_with_different_body(store: IdempotencyStore) -> None:
+    upstream = Upstream()
+    await store.handle(make_request(), "sk-a", upstream)
+    with pytest.raises(IdempotencyKeyReusedError) as info:
+        await store.handle(make_request(b'{"model":"y"}'), "sk-a", upstream)
+    assert info.value.status_code == 422
+
+
+async def test_failed_response_is_not_stored(store: IdempotencyStore) -> None:
+    upstream = Upstream(status_code=400)
+    response = await store.handle(make_request(), "sk-a", upstream)
+    assert response.status_code == 400
+    await asyncio.sleep(0)
+    await store.handle(make_request(), "sk-a", upstream)
+    assert upstream.calls == 2
+    assert store.stats()["stored"] == 0
+
+
+async def test_duplicate_attaches_to_inflight_stream(store: IdempotencyStore) -> None:
+    upstream = Upstream(streaming=True)
+    first = await store.handle(make_request(), "sk-a", upstream)
+    second = await store.handle(make_request(), "sk-a", upstream)
+    assert second.headers[REPLAYED_HEADER] == "true"
+
+    reads = [asyncio.create_task(read(response)) for response in (first, second)]
+    await asyncio.sleep(0.01)
+    upstream.release.set()
+    expected = b"event: message_start\n\nevent: message_stop\n\n"
+    assert await asyncio.gather(*reads) == [expected, expected]
+    assert upstream.calls == 1
+
+
+async def test_retry_after_disconnect_attaches_within_grace(store: IdempotencyStore) -> None:
+    upstream = Upstream(streaming=True)
+    first = await store.handle(make_request(), "sk-a", upstream)
+    iterator = first.body_iterator.__aiter__()  # type: ignore[union-attr]
+    assert await anext(iterator) == b"event: message_start\n\n"
+    # 客户端断开 (超时), 上游请求在宽限期内保留
+    await iterator.aclose()  # type: ignore[attr-defined]
+
+    retry = await store.handle(make_request(), "sk-a", upstream)
+    upstream.release.set()
+    assert await read(retry) == b"event: message_start\n\nevent: message_stop\n\n"
+    assert upstream.calls == 1
+    assert not upstream.cancelled
+
+
+async def test_orphaned_request_is_cancelled(store: IdempotencyStore) -> None:
+    upstream = Upstream(streaming=True)
+    first = await store.handle(make_request(), "sk-a", upstream)
+    iterator = first.body_iterator.__aiter__()  # type: ignore[union-attr]
+    await anext(iterator)
+    await iterator.aclose()  # type: ignore[attr-defined]
+
+    await asyncio.sleep(0.1)
+    assert upstream.cancelled
+    assert store.stats() == {"inflight": 0, "stored": 0, "stored_bytes": 0}
+
+    # 之后的重试重新执行
+    retry = await store.handle(make_request(), "sk-a", upstream)
+    upstream.release.set()
+    await read(retry)
+    assert upstream.calls == 2
@@ -0,0 +1,113 @@
+"""上游 API Key 池 (common/key_pool.py)"""
+from collections.abc import Iterator
+from pathlib import Path
+
+import httpx
+import pytest
+
+from common.config import KeyPoolConfig, settings
+from common.errors import RateLimitError
+from common.key_pool import KeyLease, KeyPool, KeyPools, with_api_key
+from common.pacing import pacer
+
+
+@pytest.fixture(autouse=True)
+def pacing_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    """每个测试使用独立的额度状态文件"""
+    monkeypatch.setattr(settings, "pacing_state_path", str(tmp_path / "ratelimit.sqlite"))
+    monkeypatch.setattr(pacer, "_conn", None)
+    monkeypatch.setattr(pacer, "_states", {})
+    yield
+    if pacer._conn is not None:
+        pacer._conn.close()
+
+
+def test_acquire_prefers_fewest_inflight() -> None:
+    pool = KeyPool("team", "anthropic", ["k1", "k2"])
+    first = pool.acquire()
+    second = pool.acquire()
+    assert {first.key, second.key} == {"k1", "k2"}
+
+    pool.release(first, 0.1, 200)
+    assert pool.acquire() is first
+    assert first.requests == 2
+    assert first.inflight == 1
+
+
+def test_cooled_down_key_leaves_rotation() -> None:
+    pool = KeyPool("team", "anthropic", ["k1", "k2"])
+    key = pool.acquire()
+    pool.release(key, None, 429)
+    pool.cool_down(key, 30.0)
+
+    assert key.rate_limited == 1
+    assert all(pool.acquire() is not key for _ in range(3))
+
+    other = next(candidate for candidate in pool.keys if candidate is not key)
+    pool.cool_down(other, 5.0)
+    with pytest.raises(RateLimitError) as info:
+        pool.acquire()
+    assert info.value.status_code == 429
+    with pytest.raises(RateLimitError):
+        pool.check_available()
+
+
+def test_lease_rotates_after_429() -> None:
+    pool = KeyPool("team", "anthropic", ["k1", "k2"])
+    lease = KeyLease(pool)
+    first = lease.key
+
+    lease.cool_down(None)
+    assert lease.can_rotate()
+    lease.rotate()
+    assert lease.key is not first
+    # 换下的 Key 已释放, 在途计数只剩当前 Key
+    assert first.inflight == 0
+    assert lease.key.inflight == 1
+
+    # 全部冷却时继续使用当前 Key
+    lease.cool_down(None)
+    assert not lease.can_rotate()
+    current = lease.key
+    lease.rotate()
+    assert lease.key is current
+
+    lease.release(None, 429)
+    assert current.inflight == 0
+
+
+async def test_rate_limited_key_sorted_last() -> None:
+    pool = KeyPool("team", "anthropic", ["k1", "k2"])
+    response = httpx.Response(
+        200,
+        headers={
+            "anthropic-ratelimit-requests-limit": "10",
+            "anthropic-ratelimit-requests-remaining": "0",
+            "anthropic-ratelimit-requests-reset": "60s",
+        },
+    )
+    await pacer.observe("anthropic", "k1", response)
+
+    # 额度状态来自进程内缓存, 不查询 SQLite
+    state = pacer.state("anthropic", "k1")
+    assert state is not None
+    assert state.requests_remaining == 0
+    assert pool.acquire().key == "k2"
+    assert pool.acquire().key == "k2"
+
+
+def test_pools_match_client_keys() -> None:
+    pools = KeyPools(
+        "test-upstream",
+        {"team": KeyPoolConfig(client_keys=["sk-team"], upstream_keys=["up-1"])},
+    )
+    pool = pools.for_client("sk-team")
+    assert pool is not None
+    assert pool.tenant == "team"
+    assert pools.for_client("sk-other") is None
+
+
+def test_with_api_key_keeps_header_name() -> None:
+    assert with_api_key({"X-Api-Key": "old"}, "new") == {"X-Api-Key": "new"}
+    assert with_api_key({"Authorization": "Bearer old"}, "new") == {"Authorization": "Bearer new"}
+    assert with_api_key(None, "new") == {"authorization": "Bearer new"}
@@ -0,0 +1,142 @@
+"""进程内存预算 (common/memory_budget.py)"""
+import asyncio
+from collections.abc import Iterator
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from common.config import settings
+from common.errors import ServiceUnavailableError
+from common.fanout import SharedResponse
+from common.memory_budget import MemoryBudget, MemoryBudgetMiddleware, memory_budget
+
+
+@pytest.fixture(autouse=True)
+def small_budget(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setattr(settings, "memory_budget_enabled", True)
+    monkeypatch.setattr(settings, "memory_budget_bytes", 1000)
+    monkeypatch.setattr(settings, "memory_budget_min_request", 100)
+    monkeypatch.setattr(settings, "memory_budget_max_request", 5000)
+    monkeypatch.setattr(settings, "memory_budget_body_factor", 3.0)
+    monkeypatch.setattr(settings, "memory_budget_max_queue", 2)
+    monkeypatch.setattr(settings, "memory_budget_queue_timeout", 0.2)
+    monkeypatch.setattr(settings, "request_spool_threshold", 0)
+    yield
+    assert memory_budget.used == 0
+
+
+def test_reservation() -> None:
+    budget = MemoryBudget()
+    assert budget.reservation(None) == 100
+    assert budget.reservation(10) == 100
+    assert budget.reservation(200) == 600
+    # 最多预留整个预算
+    assert budget.reservation(900) == 1000
+
+
+def test_spooled_body_reserved_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "request_spool_threshold", 250)
+    assert MemoryBudget().reservation(300) == 300
+
+
+async def test_queue_admits_in_order() -> None:
+    budget = MemoryBudget()
+    await budget.acquire(800, "/a")
+
+    order: list[str] = []
+
+    async def waiter(name: str, size: int) -> None:
+        await budget.acquire(size, "/b")
+        order.append(name)
+
+    first = asyncio.create_task(waiter("first", 500))
+    second = asyncio.create_task(waiter("second", 100))
+    await asyncio.sleep(0)
+    # 队首放不下时后面的小请求也继续等待
+    assert budget.stats()["queued"] == 2
+    assert order == []
+
+    budget.release("request", 800)
+    await asyncio.gather(first, second)
+    assert order == ["first", "second"]
+    assert budget.used == 600
+    budget.finish({"request": 600})
+    assert budget.used == 0
+
+
+async def test_queue_full_and_timeout() -> None:
+    budget = MemoryBudget()
+    await budget.acquire(1000, "/a")
+    waiters = [asyncio.create_task(budget.acquire(100, "/b")) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(ServiceUnavailableError) as info:
+        await budget.acquire(100, "/c")
+    assert info.value.status_code == 503
+
+    for result in await asyncio.gather(*waiters, return_exceptions=True):
+        assert isinstance(result, ServiceUnavailableError)
+    assert budget.stats()["queued"] == 0
+    budget.release("request", 1000)
+    assert budget.used == 0
+
+
+async def test_cancelled_waiter_does_not_leak() -> None:
+    budget = MemoryBudget()
+    await budget.acquire(1000, "/a")
+    waiter = asyncio.create_task(budget.acquire(300, "/b"))
+    await asyncio.sleep(0)
+
+    # 放行与取消同时发生: 已转交的预留必须归还
+    budget.release("request", 1000)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert budget.used == 0
+    assert budget.stats()["queued"] == 0
+
+
+async def test_shared_response_charged_while_recorded() -> None:
+    release = asyncio.Event()
+
+    async def call() -> dict[str, str]:
+        await release.wait()
+        return {"text": "x" * 200}
+
+    shared = SharedResponse(call, orphan_grace=10.0, on_done=lambda _: None, name="test")
+    response = asyncio.create_task(shared.response())
+    await asyncio.sleep(0)
+    release.set()
+    await response
+    await asyncio.sleep(0)
+    # 上游响应已结束且没有客户端仍在读取
+    assert shared.complete
+    assert memory_budget.usage["shared"] == 0
+
+
+def _app() -> MemoryBudgetMiddleware:
+    async def echo(request: Request) -> JSONResponse:
+        body = await request.body()
+        return JSONResponse({"size": len(body), "used": memory_budget.used})
+
+    return MemoryBudgetMiddleware(Starlette(routes=[Route("/echo", echo, methods=["POST"])]))
+
+
+def test_middleware_reserves_and_releases() -> None:
+    with TestClient(_app()) as client:
+        response = client.post("/echo", content=b"x" * 200)
+        assert response.status_code == 200
+        assert response.json() == {"size": 200, "used": 600}
+    assert memory_budget.used == 0
+
+
+def test_middleware_rejects_oversized_request() -> None:
+    with TestClient(_app()) as client:
+        response = client.post("/echo", content=b"x" * 6000)
+        assert response.status_code == 413
+        assert response.json()["detail"]["error"]["type"] == "request_too_large"
+    assert memory_budget.used == 0
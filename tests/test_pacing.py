@@ -0,0 +1,164 @@
+"""限流响应头驱动的请求节流 (common/pacing.py)"""
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from pathlib import Path
+
+import httpx
+import pytest
+
+from common.config import settings
+from common.errors import RateLimitError
+from common.pacing import (
+    RateLimitPacer,
+    RateLimitState,
+    api_key_from_headers,
+    key_fingerprint,
+    pacer,
+    parse_rate_limit_headers,
+)
+
+NOW = 1_700_000_000.0
+
+
+@pytest.fixture
+def store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Iterator[RateLimitPacer]:
+    """使用临时状态文件的节流器"""
+    monkeypatch.setattr(settings, "pacing_enabled", True)
+    monkeypatch.setattr(settings, "pacing_state_path", str(tmp_path / "ratelimit.sqlite"))
+    monkeypatch.setattr(pacer, "_conn", None)
+    monkeypatch.setattr(pacer, "_states", {})
+    monkeypatch.setattr(pacer, "_untracked", set())
+    yield pacer
+    if pacer._conn is not None:
+        pacer._conn.close()
+
+
+def test_parse_anthropic_headers() -> None:
+    reset = datetime.fromtimestamp(NOW + 30, UTC).isoformat().replace("+00:00", "Z")
+    response = httpx.Response(
+        200,
+        headers={
+            "anthropic-ratelimit-requests-limit": "50",
+            "anthropic-ratelimit-requests-remaining": "49",
+            "anthropic-ratelimit-requests-reset": reset,
+            "anthropic-ratelimit-input-tokens-remaining": "20000",
+            "anthropic-ratelimit-output-tokens-remaining": "800",
+            "anthropic-ratelimit-output-tokens-reset": reset,
+        },
+    )
+    assert parse_rate_limit_headers(response, NOW) == {
+        "requests_remaining": 49,
+        "requests_limit": 50,
+        "requests_reset": NOW + 30,
+        # 取剩余量最小的一组 token 额度
+        "tokens_remaining": 800,
+        "tokens_reset": NOW + 30,
+    }
+
+
+def test_parse_openai_headers() -> None:
+    response = httpx.Response(
+        200,
+        headers={
+            "x-ratelimit-limit-requests": "500",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "1m30.5s",
+            "x-ratelimit-remaining-tokens": "1500",
+            "x-ratelimit-reset-tokens": "20ms",
+        },
+    )
+    update = parse_rate_limit_headers(response, NOW)
+    assert update["requests_remaining"] == 0
+    assert update["requests_reset"] == pytest.approx(NOW + 90.5)
+    assert update["tokens_reset"] == pytest.approx(NOW + 0.02)
+
+
+def test_parse_retry_after_on_429() -> None:
+    assert parse_rate_limit_headers(httpx.Response(429, headers={"retry-after": "7"}), NOW) == {
+        "blocked_until": NOW + 7
+    }
+    assert parse_rate_limit_headers(httpx.Response(200, headers={"retry-after": "7"}), NOW) == {}
+
+
+def test_wait_time(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "pacing_min_tokens", 1000)
+    state = RateLimitState(requests_remaining=0, requests_reset=NOW + 5)
+    assert state.wait_time(NOW) == (5.0, "requests")
+    # 重置时间已过视为额度已恢复
+    assert state.wait_time(NOW + 6) == (0.0, None)
+
+    state = RateLimitState(tokens_remaining=10, tokens_reset=NOW + 2, blocked_until=NOW + 8)
+    assert state.wait_time(NOW) == (8.0, "retry_after")
+
+
+def test_api_key_from_headers() -> None:
+    assert api_key_from_headers({"X-Api-Key": "sk-a"}) == "sk-a"
+    assert api_key_from_headers({"authorization": "Bearer sk-b"}) == "sk-b"
+    assert api_key_from_headers({"content-type": "application/json"}) is None
+    assert key_fingerprint("sk-a") != "sk-a"
+
+
+async def test_admit_decrements_remaining(store: RateLimitPacer) -> None:
+    response = httpx.Response(200, headers={"x-ratelimit-remaining-requests": "2"})
+    await store.observe("test", "sk-a", response)
+
+    await store.acquire("test", "sk-a")
+    state = store.state("test", "sk-a")
+    assert state is not None and state.requests_remaining == 1
+    await store.acquire("test", "sk-a")
+    # 重置时间未知: 剩余为 0 时仍然放行 (不会无限等待)
+    await store.acquire("test", "sk-a")
+
+    stats = await store.stats()
+    assert [(row["upstream"], row["requests_remaining"]) for row in stats] == [("test", -1)]
+    assert stats[0]["key_id"] == key_fingerprint("sk-a")
+
+
+async def test_exhausted_key_waits_then_rejects(
+    store: RateLimitPacer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "pacing_max_wait", 0.1)
+    await store.observe(
+        "test",
+        "sk-a",
+        httpx.Response(
+            200,
+            headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "20ms"},
+        ),
+    )
+    await store.acquire("test", "sk-a")
+
+    await store.observe("test", "sk-a", httpx.Response(429, headers={"retry-after": "30"}))
+    with pytest.raises(RateLimitError) as info:
+        await store.acquire("test", "sk-a")
+    assert info.value.status_code == 429
+    # 其他 Key 不受影响
+    await store.acquire("test", "sk-b")
+
+
+async def test_untracked_key_skips_the_store(
+    store: RateLimitPacer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    await store.observe("test", "sk-a", httpx.Response(200))
+
+    def fail(*args: object) -> None:
+        raise AssertionError("store queried")
+
+    monkeypatch.setattr(store, "_try_admit", fail)
+    await store.acquire("test", "sk-a")
+
+    # 再次收到限流响应头后恢复节流
+    await store.observe(
+        "test", "sk-a", httpx.Response(200, headers={"x-ratelimit-remaining-requests": "3"})
+    )
+    with pytest.raises(AssertionError):
+        await store.acquire("test", "sk-a")
+
+
+async def test_disabled_pacing_is_a_no_op(
+    store: RateLimitPacer, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "pacing_enabled", False)
+    await store.observe("test", "sk-a", httpx.Response(429, headers={"retry-after": "30"}))
+    await store.acquire("test", "sk-a")
+    assert store.state("test", "sk-a") is None
@@ -0,0 +1,138 @@
+"""保留原始字节的 JSON 对象 (common/rawjson.py)"""
+import importlib
+import json
+
+import httpx
+import pytest
+
+from common.config import settings
+from common.http_client import HTTPClient
+from common.rawjson import RawJSON, RawJSONError, RawJSONResponse, body_kwargs, raw_response
+
+from .conftest import MockUpstream
+
+proxy = importlib.import_module("service-cc.proxy")
+router = importlib.import_module("service-cc.router")
+cx_formats = importlib.import_module("service-cx.formats")
+cx_proxy = importlib.import_module("service-cx.proxy")
+
+# 非紧凑格式 + \u 转义: 重新序列化必然改变字节
+RAW = (
+    b'{ "model" : "claude-sonnet-4-5",\n  "messages": [{"role": "user", '
+    b'"content": "\\u4f60\\u597d"}], "max_tokens": 1024 }'
+)
+
+
+def test_fields_are_parsed_lazily() -> None:
+    body = RawJSON(RAW)
+    assert body._parsed is None
+    assert body.get("model") == "claude-sonnet-4-5"
+    assert body["messages"][0]["content"] == "你好"
+    assert len(body) == 3 and "max_tokens" in body
+    assert body.parse() is body.parse()
+
+
+def test_invalid_bodies_raise_value_error() -> None:
+    with pytest.raises(ValueError):
+        RawJSON(b"{not json").get("model")
+    with pytest.raises(RawJSONError):
+        RawJSON(b"[1, 2]").get("model")
+
+
+def test_body_kwargs() -> None:
+    assert body_kwargs(RawJSON(RAW)) == {"content": RAW}
+    assert body_kwargs({"model": "x"}) == {"json": {"model": "x"}}
+
+
+def test_sniff_passthrough() -> None:
+    assert router._sniff_passthrough(RawJSON(RAW)) is False
+    assert router._sniff_passthrough(RawJSON(b'{"model":"x","messages":[1],"stream":true}'))
+    # 必需字段无效或无法解析时退回完整校验
+    assert router._sniff_passthrough(RawJSON(b'{"model":"x","messages":[]}')) is None
+    assert router._sniff_passthrough(RawJSON(b'{"model":1,"messages":[1]}')) is None
+    assert router._sniff_passthrough(RawJSON(b"{broken")) is None
+
+
+def test_raw_response(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "response_passthrough_enabled", True)
+    content = b'{"id": "msg_1",  "usage": {"input_tokens": 3}}'
+    upstream = httpx.Response(
+        201,
+        content=content,
+        headers={"content-type": "application/json", "request-id": "req_1", "x-other": "1"},
+    )
+    response = raw_response(upstream)
+
+    assert isinstance(response, RawJSONResponse)
+    assert response.body == content
+    assert response.status_code == 201
+    assert response.headers["request-id"] == "req_1"
+    assert "x-other" not in response.headers
+    assert response.json["usage"] == {"input_tokens": 3}
+
+    assert raw_response(httpx.Response(200, text="ok")) is None
+    monkeypatch.setattr(settings, "response_passthrough_enabled", False)
+    assert raw_response(upstream) is None
+
+
+async def test_request_and_response_bytes_pass_through(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "response_passthrough_enabled", True)
+    monkeypatch.setattr(proxy, "http_client", client)
+    content = b'{"id":"msg_1", "content":[{"type":"text","text":"\\u4f60\\u597d"}]}'
+    upstream.respond = lambda request: httpx.Response(
+        200, content=content, headers={"content-type": "application/json"}
+    )
+
+    response = await proxy.proxy_to_anthropic(RawJSON(RAW), "sk-test", stream=False)
+
+    assert upstream.requests[0].content == RAW
+    assert upstream.requests[0].headers["content-length"] == str(len(RAW))
+    assert isinstance(response, RawJSONResponse)
+    assert response.body == content
+    assert json.loads(response.body) == response.json.parse()
+
+
+def test_is_complete_response() -> None:
+    complete = {
+        "id": "resp_1",
+        "object": "response",
+        "created_at": 1,
+        "status": "completed",
+        "output": [],
+        "usage": {},
+    }
+    assert cx_formats.is_complete_response(complete)
+    assert not cx_formats.is_complete_response({k: v for k, v in complete.items() if k != "usage"})
+
+
+async def test_responses_api_passthrough(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "response_passthrough_enabled", True)
+    monkeypatch.setattr(cx_proxy, "http_client", client)
+    complete = (
+        b'{"id":"resp_1", "object":"response", "created_at":1, "status":"completed",'
+        b' "output":[], "usage":{"input_tokens":3}}'
+    )
+    upstream.respond = lambda request: httpx.Response(
+        200, content=complete, headers={"content-type": "application/json"}
+    )
+    response = await cx_proxy.proxy_to_openai({"model": "gpt-5"}, "sk-test")
+    assert isinstance(response, RawJSONResponse)
+    assert response.body == complete
+
+    # 缺少必需字段: 返回 parse_response 补全后的结果
+    upstream.respond = lambda request: httpx.Response(
+        200, content=b'{"id":"resp_2", "output":[]}', headers={"content-type": "application/json"}
+    )
+    response = await cx_proxy.proxy_to_openai({"model": "gpt-5"}, "sk-test")
+    assert response == {
+        "id": "resp_2",
+        "object": "response",
+        "created_at": 0,
+        "status": "completed",
+        "output": [],
+        "usage": {},
+    }
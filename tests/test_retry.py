@@ -0,0 +1,153 @@
+"""上游重试策略 (common/retry.py)"""
+import time
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from common.balancer import UpstreamGroup
+from common.config import settings
+from common.http_client import HTTPClient
+from common.retry import RetryBudget, backoff_delay, parse_retry_after, retry_after_from
+
+from .conftest import MockUpstream
+
+# ---------------------------------------------------------------- 重试预算 / 退避
+
+
+def test_budget_is_exhausted_and_refilled_by_requests() -> None:
+    budget = RetryBudget(ratio=0.5, min_per_second=0.0, max_tokens=2.0)
+    assert budget.try_withdraw()
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+    budget.deposit()
+    assert not budget.try_withdraw()
+    budget.deposit()
+    assert budget.try_withdraw()
+
+
+def test_budget_refills_over_time(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    budget = RetryBudget(ratio=0.0, min_per_second=2.0, max_tokens=1.0)
+    assert budget.try_withdraw()
+    assert not budget.try_withdraw()
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 0.5)
+    assert budget.try_withdraw()
+    # 不超过容量
+    monkeypatch.setattr(time, "monotonic", lambda: now + 60)
+    assert budget.tokens == 1.0
+
+
+def test_parse_retry_after() -> None:
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    delay = parse_retry_after(formatdate(time.time() + 10, usegmt=True))
+    assert delay is not None and 8 < delay <= 10
+
+    response = httpx.Response(429, headers={"retry-after-ms": "1500", "retry-after": "9"})
+    assert retry_after_from(response) == 1.5
+
+
+def test_backoff_delay(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "retry_backoff_base", 0.5)
+    monkeypatch.setattr(settings, "retry_backoff_max", 1.0)
+    monkeypatch.setattr(settings, "retry_max_retry_after", 5.0)
+    assert all(0 <= backoff_delay(1) <= 0.5 for _ in range(50))  # type: ignore[operator]
+    assert all(0 <= backoff_delay(5) <= 1.0 for _ in range(50))  # type: ignore[operator]
+    assert backoff_delay(1, retry_after=3.0) == 3.0
+    # 上游要求等待过久时放弃重试
+    assert backoff_delay(1, retry_after=6.0) is None
+
+
+# ---------------------------------------------------------------- 请求重试
+
+
+async def test_retryable_status_is_retried(client: HTTPClient, upstream: MockUpstream) -> None:
+    statuses = iter([503, 529, 200])
+    upstream.respond = lambda request: httpx.Response(next(statuses))
+
+    response = await client.request("POST", "https://relay-a/v1/messages", json={})
+    assert response.status_code == 200
+    assert len(upstream.requests) == 3
+
+
+async def test_last_response_returned_after_max_attempts(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "retry_max_attempts", 2)
+    upstream.respond = lambda request: httpx.Response(503, json={"error": "overloaded"})
+
+    response = await client.open_stream("POST", "https://relay-a/v1/messages", json={})
+    assert response.status_code == 503
+    assert await response.aread() == b'{"error":"overloaded"}'
+    await response.aclose()
+    assert len(upstream.requests) == 2
+
+
+async def test_non_retryable_status_is_returned(
+    client: HTTPClient, upstream: MockUpstream
+) -> None:
+    upstream.respond = lambda request: httpx.Response(400)
+    response = await client.open_stream("POST", "https://relay-a/v1/messages", json={})
+    assert response.status_code == 400
+    await response.aclose()
+    assert len(upstream.requests) == 1
+
+
+async def test_connect_error_is_raised_after_retries(
+    client: HTTPClient, upstream: MockUpstream
+) -> None:
+    def refuse(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError("connection refused", request=request)
+
+    upstream.respond = refuse
+    with pytest.raises(httpx.ConnectError):
+        await client.request("POST", "https://relay-a/v1/messages", json={})
+    assert len(upstream.requests) == settings.retry_max_attempts
+
+
+async def test_exhausted_budget_stops_retries(
+    client: HTTPClient, upstream: MockUpstream, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(settings, "retry_max_attempts", 5)
+    monkeypatch.setattr(settings, "retry_budget_ratio", 0.0)
+    monkeypatch.setattr(settings, "retry_budget_min_per_second", 0.0)
+    monkeypatch.setattr(settings, "retry_budget_max_tokens", 2.0)
+    upstream.respond = lambda request: httpx.Response(503)
+
+    # 首个请求用掉全部 2 个令牌 (共 3 次尝试), 之后的请求不再重试
+    for attempts in (3, 4):
+        response = await client.open_stream("POST", "https://relay-a/v1/messages", json={})
+        assert response.status_code == 503
+        await response.aclose()
+        assert len(upstream.requests) == attempts
+
+
+async def test_long_retry_after_is_not_waited(
+    client: HTTPClient, upstream: MockUpstream
+) -> None:
+    retry_after = str(settings.retry_max_retry_after + 1)
+    upstream.respond = lambda request: httpx.Response(429, headers={"retry-after": retry_after})
+
+    response = await client.open_stream("POST", "https://relay-a/v1/messages", json={})
+    assert response.status_code == 429
+    await response.aclose()
+    assert len(upstream.requests) == 1
+
+
+async def test_retry_avoids_failed_endpoint(client: HTTPClient, upstream: MockUpstream) -> None:
+    group = UpstreamGroup("test-retry", ["https://relay-a/api", "https://relay-b/api"])
+    group.endpoints[0].observe(0.1)
+    group.endpoints[1].observe(1.0)
+    upstream.respond = lambda request: httpx.Response(
+        502 if request.url.host == "relay-a" else 200
+    )
+
+    response = await client.request("POST", "/v1/messages", upstream=group, json={})
+    assert response.status_code == 200
+    assert [request.url.host for request in upstream.requests] == ["relay-a", "relay-b"]
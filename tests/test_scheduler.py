@@ -0,0 +1,148 @@
+"""请求调度 (common/scheduler.py)"""
+import asyncio
+import contextvars
+import time
+
+import pytest
+
+from common.concurrency import AdaptiveLimiter
+from common.config import settings
+from common.pacing import key_fingerprint
+from common.scheduler import (
+    FairQueue,
+    RequestContext,
+    Waiter,
+    current_request_context,
+    set_request_context,
+)
+
+
+def waiter(priority: int = 0, flow: str = "-", deadline: float | None = None) -> Waiter:
+    future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+    return Waiter(RequestContext(priority=priority, flow=flow, deadline=deadline), future)
+
+
+def drain(queue: FairQueue) -> list[Waiter]:
+    popped = []
+    while (item := queue.pop()) is not None:
+        item.future.set_result(None)
+        popped.append(item)
+    return popped
+
+
+async def test_higher_priority_first() -> None:
+    queue = FairQueue()
+    low, high, middle = waiter(0), waiter(100), waiter(50)
+    for item in (low, high, middle):
+        queue.push(item)
+    assert drain(queue) == [high, middle, low]
+    assert len(queue) == 0
+
+
+async def test_flows_share_a_priority_class() -> None:
+    queue = FairQueue()
+    burst = [waiter(flow="a") for _ in range(3)]
+    other = [waiter(flow="b") for _ in range(2)]
+    for item in [*burst, *other]:
+        queue.push(item)
+    # 流 a 的突发请求不会挤占流 b
+    assert drain(queue) == [burst[0], other[0], burst[1], other[1], burst[2]]
+
+
+async def test_flow_weights(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "scheduler_flow_weights", {"heavy": 2.0})
+    queue = FairQueue()
+    heavy = [waiter(flow="heavy") for _ in range(4)]
+    light = [waiter(flow="light") for _ in range(2)]
+    for item in [*heavy, *light]:
+        queue.push(item)
+    order = ["heavy" if item in heavy else "light" for item in drain(queue)]
+    assert order == ["heavy", "light", "heavy", "heavy", "light", "heavy"]
+
+
+async def test_earliest_deadline_first_within_flow() -> None:
+    queue = FairQueue()
+    late, early, none = waiter(deadline=20.0), waiter(deadline=10.0), waiter()
+    for item in (late, none, early):
+        queue.push(item)
+    assert drain(queue) == [early, late, none]
+
+
+async def test_cancelled_waiters_are_skipped() -> None:
+    queue = FairQueue()
+    first, second = waiter(), waiter()
+    queue.push(first)
+    queue.push(second)
+    first.future.cancel()
+    queue.discard(first)
+    assert len(queue) == 1
+    assert queue.pop() is second
+    assert queue.stats() == {}
+
+
+async def test_ahead_counts_fair_share() -> None:
+    queue = FairQueue()
+    for _ in range(5):
+        queue.push(waiter(flow="a"))
+    queue.push(waiter(flow="b"))
+    queue.push(waiter(priority=10, flow="c"))
+
+    # 新的流 d: 高优先级 1 个 + 每个流最多 1 个
+    assert queue.ahead(RequestContext(flow="d")) == 3
+    assert queue.ahead(RequestContext(flow="a")) == 1 + 5 + 1
+    assert queue.stats() == {"10": {"queued": 1, "flows": 1}, "0": {"queued": 6, "flows": 2}}
+
+
+async def test_limiter_releases_by_priority(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "concurrency_limit_enabled", True)
+    monkeypatch.setattr(settings, "concurrency_initial_limit", 1)
+    monkeypatch.setattr(settings, "concurrency_min_limit", 1)
+    limiter = AdaptiveLimiter("test")
+    acquired = await limiter.acquire()
+    order: list[int] = []
+
+    async def queued(priority: int) -> None:
+        set_request_context(priority=priority, api_key=None, client_ip=None, headers={})
+        limiter.release(await limiter.acquire())
+        order.append(priority)
+
+    tasks = [asyncio.create_task(queued(priority)) for priority in (0, 100, 50)]
+    await asyncio.sleep(0)
+    assert limiter.to_dict()["queued_by_priority"] == {
+        "100": {"queued": 1, "flows": 1},
+        "50": {"queued": 1, "flows": 1},
+        "0": {"queued": 1, "flows": 1},
+    }
+    limiter.release(acquired)
+    await asyncio.gather(*tasks)
+    assert order == [100, 50, 0]
+
+
+def test_request_context_from_headers(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "concurrency_queue_timeout", 30.0)
+
+    def run() -> None:
+        assert current_request_context() == RequestContext()
+        context = set_request_context(
+            priority=100,
+            api_key="sk-a",
+            client_ip="10.0.0.1",
+            headers={"x-proxy-priority": "10", "x-proxy-deadline": "5"},
+        )
+        assert context.priority == 10
+        assert context.flow == key_fingerprint("sk-a")
+        assert 4.9 < context.remaining(time.monotonic()) <= 5
+        assert current_request_context() is context
+
+        # 请求头只能降低优先级和缩短截止时间
+        context = set_request_context(
+            priority=50,
+            api_key=None,
+            client_ip="10.0.0.1",
+            headers={"x-proxy-priority": "999", "x-proxy-deadline": "600"},
+        )
+        assert context.priority == 50
+        assert context.flow == "10.0.0.1"
+        assert 29.9 < context.remaining(time.monotonic()) <= 30
+
+    contextvars.copy_context().run(run)
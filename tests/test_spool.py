@@ -0,0 +1,131 @@
+"""大请求体落盘 (common/spool.py)"""
+import base64
+import copy
+import importlib
+import json
+import mmap
+import os
+import tempfile
+from typing import Any
+
+import pytest
+from starlette.requests import Request
+
+from common import codec
+from common.config import settings
+from common.spool import Blob, SpooledBody, read_body
+from common.upload import iter_json
+
+schemas = importlib.import_module("service-cc.schemas.base")
+
+IMAGE = base64.b64encode(os.urandom(3000)).decode()
+PASTED = base64.b64encode(os.urandom(2000)).decode()
+
+
+@pytest.fixture(autouse=True)
+def small_strings(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "request_spool_min_string", 1024)
+    monkeypatch.setattr(settings, "request_spool_threshold", 1024)
+    monkeypatch.setattr(settings, "http_stream_upload_chunk_size", 4096)
+
+
+def _request_body() -> dict[str, Any]:
+    return {
+        "model": "claude-sonnet-4-5",
+        "messages": [
+            # 粘贴的 base64 文本: 需要 str 值
+            {"role": "user", "content": PASTED},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": PASTED},
+                    {
+                        "type": "image",
+                        "source": {"type": "base64", "media_type": "image/png", "data": IMAGE},
+                    },
+                    {"type": "input_image", "image_url": f"data:image/png;base64,{IMAGE}"},
+                    {"type": "text", "text": "描述 \"这张\" 图片\n"},
+                ],
+            },
+        ],
+    }
+
+
+def _spool(raw: bytes) -> SpooledBody:
+    with tempfile.TemporaryFile() as file:
+        file.write(raw)
+        file.flush()
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return SpooledBody(data)
+
+
+def test_only_binary_fields_are_blobs() -> None:
+    body = _spool(codec.dumps(_request_body()))
+    value = body.parse()
+    assert body.blob_count == 2
+
+    messages = value["messages"]
+    assert messages[0]["content"] == PASTED
+    assert messages[1]["content"][0]["text"] == PASTED
+    source = messages[1]["content"][1]["source"]["data"]
+    assert isinstance(source, Blob)
+    assert str(source) == IMAGE
+    assert isinstance(messages[1]["content"][2]["image_url"], Blob)
+    # text / content 字段仍是 str, 请求校验照常通过
+    schemas.ClaudeRequestBase(**value)
+
+
+@pytest.mark.parametrize("raw", [codec.dumps, lambda value: json.dumps(value, indent=2).encode()])
+def test_round_trip_is_byte_identical(raw: Any) -> None:
+    expected = _request_body()
+    value = _spool(raw(expected)).parse()
+
+    # 深拷贝不复制 Blob, 编码结果与内存中的请求体逐字节一致
+    transformed = copy.deepcopy(value)
+    assert transformed["messages"][1]["content"][1]["source"]["data"] is (
+        value["messages"][1]["content"][1]["source"]["data"]
+    )
+    encoded = b"".join(iter_json(transformed))
+    assert encoded == codec.dumps(expected)
+    assert codec.loads(encoded) == expected
+
+
+def test_keys_and_escaped_strings_are_not_blobs() -> None:
+    escaped = IMAGE[:1500] + "\\/" + IMAGE[1500:]
+    raw = codec.dumps({IMAGE: 1, "source": {"type": "base64", "data": escaped}})
+    body = _spool(raw)
+    value = body.parse()
+    assert body.blob_count == 0
+    assert value == codec.loads(raw)
+
+
+def _request(raw: bytes, chunk: int) -> Request:
+    chunks = [raw[i : i + chunk] for i in range(0, len(raw), chunk)]
+
+    async def receive() -> dict[str, Any]:
+        body = chunks.pop(0) if chunks else b""
+        return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/v1/messages",
+        "headers": [(b"content-length", str(len(raw)).encode())],
+    }
+    return Request(scope, receive)
+
+
+async def test_read_body_spools_large_bodies(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("common.spool._WRITE_BATCH", 2048)
+    raw = codec.dumps(_request_body())
+    request = _request(raw, 1000)
+    value = await read_body(request)
+
+    assert isinstance(value["messages"][1]["content"][1]["source"]["data"], Blob)
+    assert b"".join(iter_json(value)) == raw
+    assert len(request.state.spooled_body) == len(raw)
+
+
+async def test_read_body_small_bodies_stay_in_memory() -> None:
+    raw = b'{"model":"m","messages":[]}'
+    assert await read_body(_request(raw, 10)) == raw
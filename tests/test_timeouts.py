@@ -0,0 +1,135 @@
+"""上游分阶段超时 (common/timeouts.py)"""
+import asyncio
+from collections.abc import AsyncIterator
+
+import httpx
+import pytest
+
+from common.config import HTTPTimeoutConfig, settings
+from common.http_client import HTTPClient
+from common.timeouts import UpstreamTimeoutError, resolve_timeouts
+
+from .conftest import MockUpstream
+
+URL = "https://relay-a/v1/messages"
+
+
+class SlowStream(httpx.AsyncByteStream):
+    """每个数据块之前等待指定时间的响应体"""
+
+    def __init__(self, chunks: list[tuple[float, bytes]]) -> None:
+        self.chunks = chunks
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for delay, chunk in self.chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+
+
+@pytest.fixture
+def short_timeouts(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "http_headers_timeout", 0.05)
+    monkeypatch.setattr(settings, "http_first_event_timeout", 0.05)
+    monkeypatch.setattr(settings, "http_idle_timeout", 0.05)
+
+
+def test_model_override_uses_longest_prefix(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(
+        settings,
+        "http_model_timeouts",
+        {
+            "claude-": HTTPTimeoutConfig(headers=30.0),
+            "claude-opus": HTTPTimeoutConfig(first_event=300.0, idle=90.0),
+        },
+    )
+    timeouts = resolve_timeouts("claude-opus-4")
+    assert timeouts.first_event == 300.0
+    assert timeouts.idle == 90.0
+    # 未设置的字段使用全局配置 (不与较短前缀合并)
+    assert timeouts.headers == settings.http_headers_timeout
+    assert resolve_timeouts("claude-haiku").headers == 30.0
+    assert resolve_timeouts("gpt-5") == resolve_timeouts(None)
+
+
+async def test_headers_timeout_is_retried(
+    client: HTTPClient, upstream: MockUpstream, short_timeouts: None
+) -> None:
+    async def respond(request: httpx.Request) -> httpx.Response:
+        if len(upstream.requests) == 1:
+            await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    upstream.respond = respond
+    response = await client.request("POST", URL, json={})
+    assert response.status_code == 200
+    assert len(upstream.requests) == 2
+
+
+async def test_headers_timeout_raised_after_retries(
+    client: HTTPClient,
+    upstream: MockUpstream,
+    short_timeouts: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "retry_max_attempts", 2)
+
+    async def hang(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    upstream.respond = hang
+    with pytest.raises(UpstreamTimeoutError) as info:
+        await client.request("POST", URL, json={})
+    assert info.value.phase == "headers"
+    assert len(upstream.requests) == 2
+
+
+async def test_first_event_timeout_is_retried(
+    client: HTTPClient, upstream: MockUpstream, short_timeouts: None
+) -> None:
+    def respond(request: httpx.Request) -> httpx.Response:
+        delay = 1.0 if len(upstream.requests) == 1 else 0.0
+        return httpx.Response(200, stream=SlowStream([(delay, b"data: {}\n\n")]))
+
+    upstream.respond = respond
+    response = await client.open_stream("POST", URL, json={"stream": True})
+    assert await response.aread() == b"data: {}\n\n"
+    await response.aclose()
+    assert len(upstream.requests) == 2
+
+
+async def test_idle_timeout_aborts_the_stream(
+    client: HTTPClient, upstream: MockUpstream, short_timeouts: None
+) -> None:
+    upstream.respond = lambda request: httpx.Response(
+        200, stream=SlowStream([(0.0, b"data: 1\n\n"), (1.0, b"data: 2\n\n")])
+    )
+    response = await client.open_stream("POST", URL, json={"stream": True})
+    chunks = []
+    with pytest.raises(UpstreamTimeoutError) as info:
+        async for chunk in response.aiter_raw():
+            chunks.append(chunk)
+    await response.aclose()
+
+    assert info.value.phase == "idle"
+    assert chunks == [b"data: 1\n\n"]
+    # 流中途超时不重试
+    assert len(upstream.requests) == 1
+
+
+async def test_total_timeout_caps_other_phases(
+    client: HTTPClient,
+    upstream: MockUpstream,
+    short_timeouts: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "http_idle_timeout", 10.0)
+    monkeypatch.setattr(settings, "http_total_timeout", 0.1)
+    upstream.respond = lambda request: httpx.Response(
+        200, stream=SlowStream([(0.0, b"data: 1\n\n"), (1.0, b"data: 2\n\n")])
+    )
+    response = await client.open_stream("POST", URL, json={"stream": True})
+    with pytest.raises(UpstreamTimeoutError) as info:
+        await response.aread()
+    await response.aclose()
+    assert info.value.phase == "total"
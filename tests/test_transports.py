@@ -0,0 +1,110 @@
+"""上游传输后端 (common/transports.py)"""
+import httpx
+import pytest
+
+from common.transports import (
+    StripedTransport,
+    create_mounts,
+    create_transport,
+    environment_proxies,
+    transport_stats,
+)
+
+from .conftest import ChunkStream
+
+
+@pytest.fixture
+def proxy_env(monkeypatch: pytest.MonkeyPatch) -> pytest.MonkeyPatch:
+    """清空代理环境变量"""
+    for name in ("HTTPS_PROXY", "HTTP_PROXY", "ALL_PROXY", "NO_PROXY"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.lower(), raising=False)
+    return monkeypatch
+
+
+def test_environment_proxies(proxy_env: pytest.MonkeyPatch) -> None:
+    assert environment_proxies() == {}
+
+    proxy_env.setenv("HTTPS_PROXY", "proxy.internal:3128")
+    proxy_env.setenv("NO_PROXY", "localhost, .svc, 10.0.0.1, ::1, http://relay-a")
+    assert environment_proxies() == {
+        "https://": "http://proxy.internal:3128",
+        "all://*localhost": None,
+        "all://*.svc": None,
+        "all://10.0.0.1": None,
+        "all://[::1]": None,
+        "http://relay-a": None,
+    }
+
+    proxy_env.setenv("NO_PROXY", "*")
+    assert environment_proxies() == {}
+
+
+def test_create_mounts(proxy_env: pytest.MonkeyPatch) -> None:
+    assert create_mounts("http1", max_connections=10, max_keepalive=5, keepalive_expiry=5) == {}
+
+    proxy_env.setenv("ALL_PROXY", "http://proxy.internal:3128")
+    proxy_env.setenv("NO_PROXY", "relay-a")
+    mounts = create_mounts("http1", max_connections=10, max_keepalive=5, keepalive_expiry=5)
+    assert isinstance(mounts["all://"], httpx.AsyncHTTPTransport)
+    assert mounts["all://*relay-a"] is None
+
+
+def test_create_transport_splits_limits_across_stripes() -> None:
+    transport = create_transport(
+        "http2", stripes=4, max_connections=10, max_keepalive=5, keepalive_expiry=5
+    )
+    assert isinstance(transport, StripedTransport)
+    assert len(transport.transports) == 4
+    stats = transport_stats(transport)
+    assert stats["max_connections"] == 4 * 2
+    assert stats["stripes"] == [0, 0, 0, 0]
+
+    single = create_transport("http1", max_connections=10, max_keepalive=5, keepalive_expiry=5)
+    assert transport_stats(single)["max_connections"] == 10
+
+    with pytest.raises(ValueError):
+        create_transport("curl", max_connections=10, max_keepalive=5, keepalive_expiry=5)
+
+
+def test_aiohttp_transport() -> None:
+    pytest.importorskip("aiohttp")
+    transport = create_transport(
+        "aiohttp", max_connections=8, max_keepalive=4, keepalive_expiry=5
+    )
+    assert transport_stats(transport)["max_connections"] == 8
+    assert transport_stats(transport)["connections"] == 0
+
+
+async def test_striped_transport_picks_least_busy() -> None:
+    stripes = [
+        httpx.MockTransport(
+            lambda request, index=index: httpx.Response(
+                200, stream=ChunkStream([str(index).encode()])
+            )
+        )
+        for index in range(2)
+    ]
+    transport = StripedTransport(list(stripes))
+    async with httpx.AsyncClient(transport=transport) as client:
+        first = await client.send(client.build_request("GET", "https://relay-a/"), stream=True)
+        second = await client.send(client.build_request("GET", "https://relay-a/"), stream=True)
+        assert transport.inflight == [1, 1]
+        # 读完响应体即释放
+        assert await first.aread() == b"0"
+        assert transport.inflight == [0, 1]
+        third = await client.send(client.build_request("GET", "https://relay-a/"), stream=True)
+        assert transport.inflight == [1, 1]
+        await third.aclose()
+        await second.aclose()
+        assert transport.inflight == [0, 0]
+
+        # 发送失败时同样释放
+        transport.transports[0] = httpx.MockTransport(_refuse)
+        with pytest.raises(httpx.ConnectError):
+            await client.get("https://relay-a/")
+        assert transport.inflight == [0, 0]
+
+
+def _refuse(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError("connection refused", request=request)
@@ -0,0 +1,81 @@
+"""上游请求体流式上传 (common/upload.py)"""
+import httpx
+import pytest
+
+from common.codec import dumps, prepare
+from common.config import settings
+from common.http_client import HTTPClient
+from common.upload import JSONUploadStream, iter_json, stream_upload
+
+from .conftest import MockUpstream
+
+TOOLS = prepare([{"name": "Read", "input_schema": {"type": "object"}}])
+
+
+def _body() -> dict[str, object]:
+    return {
+        "model": "gpt-5-codex",
+        "instructions": "你是编程助手 \"Codex\"\n",
+        "input": [
+            {"role": "user", "content": [{"type": "input_text", "text": "x" * 3000}]}
+            for _ in range(5)
+        ],
+        "tools": [*TOOLS, {"name": "Bash", "input_schema": {"type": "object"}}],
+        "include": [],
+        "stream": True,
+        "temperature": 0.5,
+    }
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(settings, "http_stream_upload_enabled", True)
+    monkeypatch.setattr(settings, "http_stream_upload_chunk_size", 4096)
+
+
+@pytest.mark.parametrize(
+    "body", [_body(), {}, {"messages": [[1, 2], {"a": None}]}, [1, "二"], "text", None]
+)
+def test_iter_json_matches_dumps(body: object) -> None:
+    assert b"".join(iter_json(body)) == dumps(body)
+
+
+async def test_upload_stream_is_repeatable() -> None:
+    stream = JSONUploadStream(_body(), 4096)
+    first = [chunk async for chunk in stream]
+    second = [chunk async for chunk in stream]
+
+    assert first == second
+    assert len(first) > 1
+    assert all(len(chunk) >= 4096 for chunk in first[:-1])
+    assert b"".join(first) == dumps(_body())
+
+
+def test_stream_upload_small_body_has_content_length() -> None:
+    kwargs = stream_upload({"json": {"model": "x"}, "headers": {"x-api-key": "sk"}})
+    assert kwargs["content"] == b'{"model":"x"}'
+    assert "json" not in kwargs
+    assert kwargs["headers"]["x-api-key"] == "sk"
+    assert stream_upload({"params": {}}) == {"params": {}}
+
+
+def test_stream_upload_large_body(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert isinstance(stream_upload({"json": _body()})["content"], JSONUploadStream)
+
+    monkeypatch.setattr(settings, "http_stream_upload_enabled", False)
+    assert stream_upload({"json": _body()})["content"] == dumps(_body())
+
+
+async def test_upstream_receives_identical_bytes(
+    client: HTTPClient, upstream: MockUpstream
+) -> None:
+    statuses = iter([503, 200])
+    upstream.respond = lambda request: httpx.Response(next(statuses))
+    await client.request("POST", "https://relay-a/v1/responses", json=_body())
+
+    # 重试时重新编码, 两次尝试的请求体一致
+    assert len(upstream.requests) == 2
+    for request in upstream.requests:
+        assert request.headers["transfer-encoding"] == "chunked"
+        assert request.headers["content-type"] == "application/json"
+        assert request.content == dumps(_body())